@@ -5,29 +5,61 @@
 ########################################################################################################################
 
 
-from base64 import urlsafe_b64encode, urlsafe_b64decode
+from atexit import register as atexit_register
+from base64 import b64encode, urlsafe_b64encode, urlsafe_b64decode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import timedelta, datetime
+from decimal import Decimal, InvalidOperation
 from dotenv import load_dotenv
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from flask import Flask, g, session, request, Response, send_from_directory, make_response, render_template
-from hashlib import pbkdf2_hmac, sha3_512
+from flask import has_app_context, Request
+from flask.sessions import SecureCookieSessionInterface
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_SH, LOCK_UN
+from functools import lru_cache
+from gzip import open as gzip_open
+from hashlib import blake2b, pbkdf2_hmac, sha256, sha3_512
+from hmac import compare_digest
+from io import StringIO
+from html import escape as html_escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from ipaddress import ip_address, IPv4Address, IPv6Address
 from json import loads, dumps
-from logging import FileHandler as LogFileHandler
 from logging import INFO as LOG_INFO, exception as log_exception
 from logging import basicConfig as log_basicConfig, getLogger as GetLogger, Formatter as LogFormatter
-from os import urandom, environ, listdir
-from os.path import join, exists, dirname, getsize
+from logging.handlers import QueueHandler
+from math import ceil
+from os import urandom, environ, listdir, getpid, fsync, fstat, remove, replace as os_replace, stat as os_stat
+from os import sched_getaffinity, getuid, fchmod, open as os_open, close as os_close, O_RDWR, O_CREAT
+from os.path import join, exists, dirname, getsize, isdir, basename
 from pathlib import Path
-from random import uniform as rand_uniform
-from requests import request as requests_send
-from smtplib import SMTP
+from queue import Queue, Empty, Full
+from re import findall as re_findall
+from requests import request as requests_send, RequestException, Session as RequestsSession
+from requests.adapters import HTTPAdapter
+from smtplib import SMTP, SMTPException, SMTPServerDisconnected, SMTPResponseException
+from smtplib import SMTPRecipientsRefused, SMTPAuthenticationError, SMTPDataError
+from socketserver import StreamRequestHandler, ThreadingTCPServer
 from sqlite3 import connect as sqlite_connect, Connection as SQLite_Connection
+from sqlite3 import complete_statement as sqlite_complete_statement, Error as SQLite_Error
+from shutil import copyfileobj, rmtree
 from ssl import create_default_context
-from time import sleep
+from stdnum.ch import esr
+from stdnum.iso7064 import mod_97_10
+from string import Template
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from threading import Event, Lock, Thread, get_ident, local as thread_local
+from time import perf_counter, sleep, time
+from types import SimpleNamespace
 from urllib.parse import urlparse
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from xml.etree.ElementTree import iterparse, Element, ParseError
+import ast
+import click
+import tracemalloc
 import typing as t
 import qrbill
 
@@ -67,30 +99,263 @@ else:
     )
 
 
+def env_int(name: str, default: int) -> int:
+    """
+    Reads an integer setting from the environment
+    :param name: name of the environment variable
+    :param default: value used if the variable is not set or empty
+    :return: the setting
+    """
+    return int(environ.get(name) or default)
+
+
 ########################################################################################################################
 # LOGGING
 ########################################################################################################################
 
 
-def setup_logger(name, file):
+ACCESS_LOG_PATH = join(app.root_path, 'logs', 'access.log')
+ACCESS_LOG_HEADERS = frozenset({'Host', 'Accept', 'Accept-Language', 'Accept-Encoding', 'Content-Type'})
+ACCESS_LOG_LINE = '%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t\\UNAVAILABLE'
+ACCESS_LOG_BATCH_SIZE = 1024
+
+
+class AccessLogFormatter(LogFormatter):
+    """
+    Turns the raw request fields of an access log record into a line, on the writer thread instead of the request thread
+    """
+
+    def format(self, record) -> str:
+        if isinstance(record.args, tuple) and len(record.args) == 8:
+            ip, score, signed_in, method, path, user_agent, headers, content_length = record.args
+            record.args = (hash_ip(ip), score, signed_in, method, repr(path)[1:-1], repr(user_agent)[1:-1],
+                           repr(str(dict(headers)))[1:-1], content_length)
+        return super().format(record)
+
+
+class AccessLogWriter:
+    """
+    Appends access log lines in batches from a background thread of each worker. All workers append to the same file
+    with one write per batch; the file is rotated by size or age under a lock file shared by all workers. A rotated file
+    is compressed at the following rotation, when no worker can still be appending to it.
+    """
+
+    def __init__(self, path: str, formatter: LogFormatter, max_bytes: int, max_age: int, interval: float,
+                 capacity: int) -> None:
+        self._path = path
+        self._lock_path = f"{path}.lock"
+        self._formatter = formatter
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._interval = interval
+        self._capacity = capacity
+        self._queue = Queue(capacity)
+        self._file = None
+        self._opened = 0.0
+        self._pid = None
+        self._thread = None
+        self._start_lock = Lock()
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    def put(self, record) -> None:
+        """
+        Queues a record without blocking; it is dropped if the writer cannot keep up
+        :param record: the log record
+        :return:
+        """
+        if self._pid != getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._pid == getpid():
+                return
+            # a forked worker must neither inherit the queue of its parent nor the file handle
+            self._queue = Queue(self._capacity)
+            self._file = None
+            self._pid = getpid()
+            self._thread = Thread(target=self._run, args=(self._queue,), name='access-log', daemon=True)
+            self._thread.start()
+            atexit_register(self.stop)
+
+    def stop(self) -> None:
+        """
+        Writes the queued records and stops the writer thread of this process
+        :return:
+        """
+        if self._pid != getpid() or self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=self._interval)
+        except Full:
+            return
+        self._thread.join(self._interval * 4)
+        self._thread = None
+
+    def _run(self, queue: Queue) -> None:
+        while True:
+            record = queue.get()
+            if record is None:
+                return
+            records = [record]
+            stop = False
+            deadline = perf_counter() + self._interval
+            while len(records) < ACCESS_LOG_BATCH_SIZE:
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    record = queue.get(timeout=remaining)
+                except Empty:
+                    break
+                if record is None:
+                    stop = True
+                    break
+                records.append(record)
+            self._write(records)
+            if stop:
+                return
+
+    def _write(self, records: list) -> None:
+        lines = []
+        for record in records:
+            try:
+                lines.append(self._formatter.format(record) + '\n')
+            except Exception as error:
+                log_exception('An error occurred while formatting an access log record' + 0 * str(error))
+        if not lines:
+            return
+        try:
+            self._open()
+            self._file.write(''.join(lines).encode())
+            self.written += len(lines)
+            self._rotate()
+        except OSError as error:
+            log_exception('An error occurred while writing the access log' + 0 * str(error))
+            self._close()
+
+    @contextmanager
+    def _locked(self) -> t.Generator[t.TextIO, None, None]:
+        with open(self._lock_path, 'a+') as file:
+            flock(file, LOCK_EX)
+            file.seek(0)
+            yield file
+
+    def _current(self) -> bool:
+        try:
+            return Path(self._path).stat().st_ino == fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _open(self) -> None:
+        if self._file is not None:
+            if self._current():
+                return
+            self._close()
+        with self._locked() as lock:
+            self._file = open(self._path, 'ab', buffering=0)
+            try:
+                self._opened = float(lock.read())
+            except ValueError:
+                self._opened = time()
+                lock.truncate(0)
+                lock.write(str(self._opened))
+
+    def _close(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _rotate(self) -> None:
+        if fstat(self._file.fileno()).st_size < self._max_bytes and time() - self._opened < self._max_age:
+            return
+        with self._locked() as lock:
+            if self._current():
+                self._compress_rotated()
+                base = f"{self._path}.{datetime.now().strftime(DATE_FORMAT)}"
+                target, suffix = base, 0
+                while exists(target) or exists(f"{target}.gz"):
+                    suffix += 1
+                    target = f"{base}.{suffix}"
+                os_replace(self._path, target)
+                lock.truncate(0)
+                lock.write(str(time()))
+                self.rotations += 1
+        self._close()
+
+    def _compress_rotated(self) -> None:
+        directory = dirname(self._path)
+        prefix = f"{basename(self._path)}."
+        for name in listdir(directory):
+            if not name.startswith(prefix) or name.endswith(('.gz', '.lock')):
+                continue
+            source = join(directory, name)
+            with open(source, 'rb') as file_in, gzip_open(f"{source}.gz", 'wb') as file_out:
+                copyfileobj(file_in, file_out, pow(2, 10 * 2))
+            remove(source)
+
+    def stats(self) -> dict:
+        """
+        Counters of this worker
+        :return: dictionary of counters
+        """
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize(),
+            'rotations': self.rotations,
+        }
+
+
+class AccessLogHandler(QueueHandler):
+    """
+    Hands records to the access log writer as they are; formatting happens on the writer thread
+    """
+
+    def __init__(self, writer: AccessLogWriter) -> None:
+        super().__init__(None)
+        self.writer = writer
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record) -> None:
+        self.writer.put(record)
+
+
+def setup_logger(name, handler):
     """
     Creates a new logging instance
     :param name: the name
-    :param file: path to the file to which the contents will be written
+    :param handler: the handler to which the records will be passed
     :return:
     """
     logger = GetLogger(name)
-    formatter = LogFormatter('%(asctime)s\t%(message)s', datefmt='%Y-%m-%d_%H-%M-%S')
-    file_handler = LogFileHandler(file, mode='a')
-    file_handler.setFormatter(formatter)
     logger.setLevel(LOG_INFO)
-    logger.addHandler(file_handler)
+    logger.addHandler(handler)
     logger.propagate = False
 
 
 log_basicConfig(filename='main.log', format='%(asctime)s\t%(message)s', datefmt=DATE_FORMAT, level=LOG_INFO)
 
-setup_logger('access', join(app.root_path, 'logs', 'access.log'))
+ACCESS_LOG = AccessLogWriter(
+    ACCESS_LOG_PATH,
+    AccessLogFormatter('%(asctime)s\t%(message)s', datefmt=DATE_FORMAT),
+    env_int('ACCESS_LOG_MAX_BYTES', pow(2, 10 * 2) * 64),
+    env_int('ACCESS_LOG_MAX_AGE', 86400),
+    env_int('ACCESS_LOG_FLUSH_INTERVAL', 1),
+    env_int('ACCESS_LOG_QUEUE_SIZE', 16384),
+)
+setup_logger('access', AccessLogHandler(ACCESS_LOG))
 access_log = GetLogger('access')
 
 
@@ -99,32 +364,141 @@ access_log = GetLogger('access')
 ########################################################################################################################
 
 
-def get_db() -> SQLite_Connection:
+DATABASE_PATH = 'database.sqlite'
+DATABASE_PRAGMAS = {
+    'journal_mode': environ.get('DB_JOURNAL_MODE') or 'WAL',
+    'synchronous': environ.get('DB_SYNCHRONOUS') or 'NORMAL',
+    'mmap_size': env_int('DB_MMAP_SIZE', 268435456),
+    'cache_size': env_int('DB_CACHE_SIZE', -16000),
+    'temp_store': environ.get('DB_TEMP_STORE') or 'MEMORY',
+    'busy_timeout': env_int('DB_BUSY_TIMEOUT', 5000),
+}
+
+
+class PooledConnection(SQLite_Connection):
+    """
+    A SQLite connection which knows how deep it is nested in transaction()
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.transaction_depth = 0
+        self.commit_callbacks = []
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived SQLite connection per worker process and thread
+    """
+
+    def __init__(self, path: str, pragmas: dict, autocommit: bool = False) -> None:
+        self._path = path
+        self._pragmas = pragmas
+        self._autocommit = autocommit
+        self._lock = Lock()
+        self._pid = getpid()
+        self._connections: dict[int, PooledConnection] = {}
+        self._stats = {'opened': 0, 'reused': 0, 'released': 0, 'rolled_back': 0}
+
+    def _open(self) -> PooledConnection:
+        """
+        Opens a new connection and applies the configured PRAGMAs
+        :return: the new connection
+        """
+        conn = sqlite_connect(self._path, timeout=self._pragmas['busy_timeout'] / 1000, factory=PooledConnection)
+        if self._autocommit:
+            conn.isolation_level = None
+        for key, value in self._pragmas.items():
+            conn.execute(f"PRAGMA {key}={value}")
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        """
+        Gets the connection of the current thread, opening it on first use
+        :return: a pooled connection
+        """
+        with self._lock:
+            if self._pid != getpid():
+                # connections must never be shared with a forked child
+                self._connections = {}
+                self._pid = getpid()
+                self._stats = {key: 0 for key in self._stats}
+            conn = self._connections.get(get_ident())
+            if conn is None:
+                conn = self._connections[get_ident()] = self._open()
+                self._stats['opened'] += 1
+            else:
+                self._stats['reused'] += 1
+        return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        """
+        Hands a connection back to the pool, discarding unfinished transactions
+        :param conn: the connection from acquire()
+        :return:
+        """
+        with self._lock:
+            self._stats['released'] += 1
+            conn.transaction_depth = 0
+            conn.commit_callbacks = []
+            if conn.in_transaction:
+                self._stats['rolled_back'] += 1
+                conn.rollback()
+
+    def close_all(self) -> None:
+        """
+        Closes every connection of the current process
+        :return:
+        """
+        with self._lock:
+            if self._pid == getpid():
+                for conn in self._connections.values():
+                    conn.close()
+            self._connections = {}
+
+    def stats(self) -> dict:
+        """
+        Statistics about the connection reuse of this worker
+        :return: the counters, the number of open connections and the reuse rate
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = len(self._connections) if self._pid == getpid() else 0
+        acquired = stats['opened'] + stats['reused']
+        stats['reuse_rate'] = stats['reused'] / acquired if acquired else 0.0
+        stats['pid'] = getpid()
+        return stats
+
+
+DATABASE = ConnectionPool(DATABASE_PATH, DATABASE_PRAGMAS)
+
+
+def get_db() -> PooledConnection:
     """
     Gets the database instance
     :return: a pointer to the database
     """
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite_connect('database.sqlite')
+        db = g._database = DATABASE.acquire()
     return db
 
 
 @app.teardown_appcontext
 def close_connection(exception=None) -> None:  # noqa
     """
-    destroys the database point
+    returns the database connection to the pool
     :param exception: unused
     :return:
     """
     db = getattr(g, '_database', None)
     if db is not None:
-        db.close()
+        DATABASE.release(db)
 
 
 def query_db(query, args=(), one=False) -> list | tuple:
     """
-    Runs a SQL query
+    Runs a SQL query, committing writes immediately unless a transaction() is active
     :param query: the query as a SQL statement
     :param args: arguments to be inserted into the query
     :param one: if this function should only return one result
@@ -133,22 +507,345 @@ def query_db(query, args=(), one=False) -> list | tuple:
     conn = get_db()
     cur = conn.execute(query, args)
     result = cur.fetchall()
-    conn.commit()
     cur.close()
+    if conn.in_transaction and not conn.transaction_depth:
+        conn.commit()
     return (result[0] if result else None) if one else result
 
 
+@contextmanager
+def transaction(read_only: bool = False) -> t.Iterator[PooledConnection]:
+    """
+    Runs all enclosed queries as one unit of work which is committed once at the end. Nested calls join the
+    outermost transaction, an exception rolls everything back.
+    :param read_only: reject writes and never commit; gives a consistent snapshot for multi-query reads
+    :return: the database connection
+    """
+    conn = get_db()
+    if conn.transaction_depth:
+        conn.transaction_depth += 1
+        try:
+            yield conn
+        finally:
+            conn.transaction_depth -= 1
+        return
+    if read_only:
+        conn.execute('PRAGMA query_only=ON')
+    conn.execute('BEGIN')
+    conn.transaction_depth = 1
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        conn.commit_callbacks = []
+        raise
+    else:
+        if read_only:
+            conn.rollback()
+        else:
+            conn.commit()
+    finally:
+        conn.transaction_depth = 0
+        if read_only:
+            conn.execute('PRAGMA query_only=OFF')
+    callbacks, conn.commit_callbacks = conn.commit_callbacks, []
+    for callback in callbacks:
+        callback()
+
+
+def after_commit(callback: t.Callable[[], t.Any]) -> None:
+    """
+    Runs a function once the current transaction has been committed, or immediately outside a transaction
+    :param callback: function without arguments
+    :return:
+    """
+    conn = get_db()
+    if conn.transaction_depth:
+        conn.commit_callbacks.append(callback)
+    else:
+        callback()
+
+
+def identity_map() -> dict:
+    """
+    Gets the identity map of the current request, which holds every object loaded by id so far
+    :return: the objects keyed by (class name, id); an empty throw-away dict outside an app context
+    """
+    if not has_app_context():
+        return {}
+    identities = getattr(g, '_identities', None)
+    if identities is None:
+        identities = g._identities = {}
+    return identities
+
+
+def identity_mapped(func):
+    """
+    Makes a load(id) function read each row at most once per request
+    :param func: the load function of a class
+    :return: the wrapped function
+    """
+    kind = func.__qualname__.split('.')[0]
+
+    def wrapper(id_):
+        identities = identity_map()
+        key = (kind, id_)
+        if key not in identities:
+            identities[key] = func(id_)
+        return identities[key]
+
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def identity_discard(obj) -> None:
+    """
+    Removes an object from the identity map, so the next load reads it from the database again
+    :param obj: an object with an _id
+    :return:
+    """
+    identity_map().pop((type(obj).__name__, obj._id), None)  # noqa
+
+
 def relative_path(path: str) -> str:
     return str(join(dirname(__file__), path))
 
 
+MIGRATIONS_PATH = 'resources/migrations'
+
+
+def split_sql(script: str) -> list[str]:
+    """
+    Splits a SQL script into single statements, keeping trigger bodies together
+    :param script: the contents of a .sql file
+    :return: list of statements
+    """
+    statements = []
+    current = ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite_complete_statement(current):
+            if current.strip():
+                statements.append(current.strip())
+            current = ''
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+
+def list_migrations() -> list[tuple[int, str]]:
+    """
+    Lists the migration files in the order they have to be applied
+    :return: list of (version, file name)
+    """
+    return sorted((int(i.split('_', 1)[0]), i) for i in listdir(relative_path(MIGRATIONS_PATH)) if i.endswith('.sql'))
+
+
+def migrate_db(conn: SQLite_Connection) -> int:
+    """
+    Applies all migrations newer than the recorded schema version. Each worker calls this on import, so the
+    migrations run under an exclusive lock and the version is checked again once the lock is held.
+    :param conn: the database connection
+    :return: the schema version after migrating
+    """
+    migrations = list_migrations()
+    conn.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, '
+                 'applied TEXT NOT NULL)')
+    version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+    if version >= migrations[-1][0]:
+        return version
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+        for number, file_name in migrations:
+            if number <= version:
+                continue
+            with open(relative_path(join(MIGRATIONS_PATH, file_name)), 'r') as file:
+                statements = split_sql(file.read())
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute('INSERT INTO schema_version VALUES (?, ?, ?)',
+                         (number, file_name, datetime.now().strftime(DATE_FORMAT)))
+            version = number
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return version
+
+
 with app.app_context():
-    with open(relative_path('resources/create_database.sql'), 'r') as f:
-        _create_db = f.read()
-    _conn = get_db()
-    _conn.executescript(_create_db)
-    _conn.commit()
-    _conn.close()
+    SCHEMA_VERSION = migrate_db(get_db())
+
+
+########################################################################################################################
+# SHARED CACHE
+########################################################################################################################
+
+
+SHARED_CACHE_DIRECTORY = join('/dev/shm', f"ksalp-{sha3_512(app.root_path.encode()).hexdigest()[:16]}")
+SHARED_CACHE_PATH = environ.get('SHARED_CACHE_PATH') or (
+    join(SHARED_CACHE_DIRECTORY, 'cache.sqlite') if isdir('/dev/shm') else 'cache.sqlite'
+)
+if SHARED_CACHE_PATH == join(SHARED_CACHE_DIRECTORY, 'cache.sqlite'):
+    # everyone can write to /dev/shm, so the directory must not have been made by another user beforehand
+    Path(SHARED_CACHE_DIRECTORY).mkdir(mode=0o700, exist_ok=True)
+    if os_stat(SHARED_CACHE_DIRECTORY).st_uid != getuid() or os_stat(SHARED_CACHE_DIRECTORY).st_mode & 0o077:
+        raise PermissionError(f"{SHARED_CACHE_DIRECTORY} is not private to this user")
+    for _suffix in ('', '-wal', '-shm'):
+        # the cache used to be a file of its own in /dev/shm
+        Path(f"{SHARED_CACHE_DIRECTORY}.sqlite{_suffix}").unlink(missing_ok=True)
+SHARED_CACHE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'mmap_size': env_int('SHARED_CACHE_MMAP_SIZE', 67108864),
+    'cache_size': -4000,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 1000,
+}
+SHARED_CACHE_TOUCH_INTERVAL = 30
+
+
+class SharedCache:
+    """
+    A key-value cache shared by all workers of a host. The entries live in a memory-mapped SQLite file, on tmpfs when
+    available, expire after a TTL and are evicted least recently used first once the cache is full.
+    """
+
+    def __init__(self, path: str, ttl: int, max_entries: int, generation: int) -> None:
+        # the entries include sessions and users, so only this user may read the file; SQLite gives the journal files
+        # the same mode
+        file = os_open(path, O_RDWR | O_CREAT, 0o600)
+        fchmod(file, 0o600)
+        os_close(file)
+        self._pool = ConnectionPool(path, SHARED_CACHE_PRAGMAS, autocommit=True)
+        self._ttl = ttl
+        self._max_entries = max_entries
+        # rows change their shape with the schema, so entries of other schema versions are never read
+        self._generation = f"@{generation}"
+        self._lock = Lock()
+        self._ready_pid = None
+        self._writes = 0
+        self._stats: dict[str, dict[str, int]] = {}
+
+    def _connect(self) -> PooledConnection:
+        """
+        Gets the connection of this thread and creates the tables on first use
+        :return: a connection to the cache file
+        """
+        conn = self._pool.acquire()
+        if self._ready_pid != getpid():
+            with open(relative_path('resources/shared_cache.sql'), 'r') as file:
+                conn.executescript(file.read())
+            self._ready_pid = getpid()
+        return conn
+
+    def _count(self, namespace: str, counter: str) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'writes': 0, 'errors': 0})
+            stats[counter] += 1
+
+    def get(self, namespace: str, key: str) -> t.Any:
+        """
+        Reads an entry
+        :param namespace: the kind of entry
+        :param key: the key within the namespace
+        :return: the stored value or None if it is missing, expired or the cache is unavailable
+        """
+        now = time()
+        try:
+            conn = self._connect()
+            row = conn.execute('SELECT value, expires, accessed FROM entries WHERE namespace=? AND key=?',
+                               (namespace + self._generation, key)).fetchone()
+            if row is not None and row[1] > now and row[2] < now - SHARED_CACHE_TOUCH_INTERVAL:
+                conn.execute('UPDATE entries SET accessed=? WHERE namespace=? AND key=?',
+                             (now, namespace + self._generation, key))
+        except SQLite_Error as error:
+            log_exception('An error occurred while reading the shared cache' + 0 * str(error))
+            self._count(namespace, 'errors')
+            return None
+        if row is None or row[1] <= now:
+            self._count(namespace, 'misses')
+            return None
+        self._count(namespace, 'hits')
+        return loads(row[0])
+
+    def set(self, namespace: str, key: str, value: t.Any, ttl: int = None) -> None:
+        """
+        Writes an entry
+        :param namespace: the kind of entry
+        :param key: the key within the namespace
+        :param value: a JSON serializable value
+        :param ttl: seconds until the entry expires, defaults to the TTL of the cache
+        :return:
+        """
+        now = time()
+        try:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (
+                namespace + self._generation, key, dumps(value), now + (ttl or self._ttl), now))
+            self._count(namespace, 'writes')
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % 256 == 0
+            if evict:
+                self.evict()
+        except SQLite_Error as error:
+            log_exception('An error occurred while writing the shared cache' + 0 * str(error))
+            self._count(namespace, 'errors')
+
+    def delete(self, namespace: str, key: str) -> None:
+        """
+        Removes an entry, e.g. after the underlying row has changed
+        :param namespace: the kind of entry
+        :param key: the key within the namespace
+        :return:
+        """
+        try:
+            self._connect().execute('DELETE FROM entries WHERE namespace=? AND key=?',
+                                    (namespace + self._generation, key))
+        except SQLite_Error as error:
+            log_exception('An error occurred while writing the shared cache' + 0 * str(error))
+            self._count(namespace, 'errors')
+
+    def evict(self) -> None:
+        """
+        Removes expired entries and, if the cache is still too large, the least recently used ones
+        :return:
+        """
+        conn = self._connect()
+        conn.execute('DELETE FROM entries WHERE expires < ?', (time(),))
+        excess = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0] - self._max_entries
+        if excess > 0:
+            conn.execute('DELETE FROM entries WHERE (namespace, key) IN (SELECT namespace, key FROM entries '
+                         'ORDER BY accessed LIMIT ?)', (excess,))
+
+    def execute(self, statement: str, args: tuple = ()) -> list:
+        """
+        Runs a statement on the cache file, for the tables next to the key-value entries
+        :param statement: the SQL statement
+        :param args: arguments to be inserted into the statement
+        :return: the resulting rows
+        :raises SQLite_Error: if the cache is unavailable
+        """
+        return self._connect().execute(statement, args).fetchall()
+
+    def stats(self) -> dict:
+        """
+        Hit-rate counters of this worker
+        :return: the counters by namespace
+        """
+        with self._lock:
+            stats = {key: dict(value) for key, value in self._stats.items()}
+        for value in stats.values():
+            lookups = value['hits'] + value['misses']
+            value['hit_rate'] = value['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+SHARED_CACHE = SharedCache(SHARED_CACHE_PATH, env_int('SHARED_CACHE_TTL', 300),
+                           env_int('SHARED_CACHE_MAX_ENTRIES', 100000), SCHEMA_VERSION)
 
 
 ########################################################################################################################
@@ -164,6 +861,48 @@ def get_current_time() -> str:
     return datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
 
 
+def to_epoch(value: datetime) -> int:
+    """
+    Converts a date to the seconds since 1970, as timestamps are stored in the database
+    :param value: the date in local time
+    :return: the timestamp
+    """
+    return int(value.timestamp())
+
+
+@lru_cache(maxsize=65536)
+def from_epoch(value: int) -> datetime:
+    """
+    Converts a timestamp of the database to a date. Memoised, as the same values are decoded again and again.
+    :param value: the seconds since 1970
+    :return: the date in local time
+    """
+    return datetime.fromtimestamp(value)
+
+
+def parse_date_arg(name: str) -> t.Optional[int]:
+    """
+    Reads an optional date from the query string, in the same format the API returns dates in
+    :param name: the name of the argument
+    :return: the timestamp or None if the argument is missing
+    :raises ValueError: if the argument is not a valid date
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    return to_epoch(datetime.strptime(value, DATE_FORMAT))
+
+
+@lru_cache(maxsize=4096)
+def decode_base64(value: str) -> bytes:
+    """
+    Decodes a base64 value as stored in the database. Memoised like from_epoch.
+    :param value: the stored value
+    :return: the decoded bytes
+    """
+    return urlsafe_b64decode(value)
+
+
 ########################################################################################################################
 # RANDOM
 ########################################################################################################################
@@ -171,16 +910,11 @@ def get_current_time() -> str:
 
 def rand_base64(digits: int) -> str:
     """
-    Generates a new string of random base64 characters
+    Generates a new string of random base64 characters, e.g. for secrets. Use IDS for ids which must be unique.
     :param digits: the length of the string to be generated
     :return: a random string of base64 characters
     """
-    while True:
-        n = urlsafe_b64encode(urandom(digits)).decode()[:digits]
-        result = query_db('SELECT * FROM used_ids WHERE id=?', (n,), True)
-        if not result:
-            query_db('INSERT INTO used_ids VALUES (?, ?)', (n, get_current_time()))
-            return n
+    return urlsafe_b64encode(urandom(digits)).decode()[:digits]
 
 
 def rand_base16(digits: int) -> str:
@@ -189,12 +923,16 @@ def rand_base16(digits: int) -> str:
     :param digits: the length of the string to be generated
     :return: a random string of base16 characters
     """
-    while True:
-        n = urandom(digits).hex()[:digits]
-        result = query_db('SELECT * FROM used_ids WHERE id=?', (n,), True)
-        if not result:
-            query_db('INSERT INTO used_ids VALUES (?, ?)', (n, get_current_time()))
-            return n
+    return urandom(digits).hex()[:digits]
+
+
+def rand_digits(digits: int) -> str:
+    """
+    Generates a new string of random decimal digits
+    :param digits: the length of the string to be generated
+    :return: a random string of decimal digits
+    """
+    return str(int.from_bytes(urandom(digits), 'big') % 10 ** digits).zfill(digits)
 
 
 def rand_salt() -> str:
@@ -205,61 +943,563 @@ def rand_salt() -> str:
     return urlsafe_b64encode(urandom(32)).decode()
 
 
+########################################################################################################################
+# IDS
+########################################################################################################################
+
+
+ID_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
+ID_SLOT_BITS = 12
+ID_COUNTER_BITS = 36
+ID_TICKS_PER_SECOND = 16
+ID_EPOCH = 1704067200  # 2024-01-01 UTC
+ID_BLOCK_SIZE = 1024
+ID_STATE_PATH = environ.get('ID_STATE_PATH') or f"{DATABASE_PATH}-ids"
+
+
+class IdGenerator:
+    """
+    Generates unique ids without asking the database. Every worker leases one of 4096 slots by locking a file in
+    ID_STATE_PATH; the lock is released by the kernel when the worker exits. Within its slot a worker counts upwards
+    from the highest counter any previous holder has reserved, or from the current time if that is higher, and writes
+    the new high-water mark to the slot file once per block. The slot and counter fill the first 48 bits (8 digits),
+    longer ids are padded with random bits, and the whole value is passed through a keyed permutation so that ids
+    neither reveal their order nor can be guessed. A permutation never maps two values to the same id. The key is
+    read from the first set variable of `key_variables`; it has its own setting so that the password peppers can be
+    rotated without touching it.
+    """
+
+    def __init__(self, path: str, key_variables: tuple[str, ...]) -> None:
+        self._path = path
+        self._key_variables = key_variables
+        self._key = b''
+        self._lock = Lock()
+        self._pid = None
+        self._file = None
+        self._slot = 0
+        self._counter = 0
+        self._reserved = 0
+
+    def _lease(self) -> None:
+        """
+        Locks a free slot for this process
+        :return:
+        """
+        if self._file is not None:
+            # the lock belongs to the parent process
+            self._file.close()
+            self._file = None
+        # the key must never change, otherwise new ids could repeat old ones
+        key = next((environ[i] for i in self._key_variables if environ.get(i)), None)
+        if key is None:
+            raise RuntimeError(f"None of {', '.join(self._key_variables)} is set")
+        self._key = sha3_512(b'ksalp ids' + key.encode()).digest()[:64]
+        Path(self._path).mkdir(parents=True, exist_ok=True)
+        first = int.from_bytes(urandom(2), 'big')
+        for i in range(1 << ID_SLOT_BITS):
+            slot = (first + i) % (1 << ID_SLOT_BITS)
+            file = open(join(self._path, str(slot)), 'a+')
+            try:
+                flock(file, LOCK_EX | LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                continue
+            file.seek(0)
+            high_water = file.read().strip()
+            self._file = file
+            self._slot = slot
+            self._counter = max(int(high_water or 0), int((time() - ID_EPOCH) * ID_TICKS_PER_SECOND))
+            self._reserved = self._counter
+            self._pid = getpid()
+            return
+        raise RuntimeError('All id slots are in use')
+
+    def _take(self, count: int) -> int:
+        """
+        Takes a contiguous range of counters
+        :param count: how many counters are needed
+        :return: the first counter of the range
+        """
+        with self._lock:
+            if self._pid != getpid():
+                self._lease()
+            if self._counter + count > self._reserved:
+                self._reserved = self._counter + max(count, ID_BLOCK_SIZE)
+                if self._reserved >= 1 << ID_COUNTER_BITS:
+                    raise RuntimeError('The id counter is exhausted')
+                self._file.seek(0)
+                self._file.truncate()
+                self._file.write(str(self._reserved))
+                self._file.flush()
+                fsync(self._file.fileno())
+            first = self._counter
+            self._counter += count
+            return first
+
+    def _permute(self, value: int, bits: int) -> int:
+        """
+        Four round Feistel network over a value with an even number of bits
+        :param value: the value to permute
+        :param bits: the width of the value
+        :return: the permuted value
+        """
+        half = bits // 2
+        mask = (1 << half) - 1
+        left, right = value >> half, value & mask
+        for i in range(4):
+            digest = blake2b(right.to_bytes(8, 'big') + bytes((i, bits)), key=self._key, digest_size=8).digest()
+            left, right = right, left ^ (int.from_bytes(digest, 'big') & mask)
+        return (left << half) | right
+
+    def _encode(self, counter: int, digits: int) -> str:
+        bits = digits * 6
+        value = (self._slot << ID_COUNTER_BITS | counter) << (bits - 48)
+        value |= int.from_bytes(urandom(bits // 8 + 1), 'big') & ((1 << (bits - 48)) - 1)
+        value = self._permute(value, bits)
+        return ''.join(ID_ALPHABET[(value >> (6 * i)) & 63] for i in range(digits - 1, -1, -1))
+
+    def new(self, digits: int) -> str:
+        """
+        Generates a new unique id
+        :param digits: the length of the id, at least 8
+        :return: the id
+        """
+        return self._encode(self._take(1), digits)
+
+    def reserve(self, digits: int, count: int) -> list[str]:
+        """
+        Generates many unique ids at once, e.g. for imports
+        :param digits: the length of the ids, at least 8
+        :param count: how many ids are needed
+        :return: the ids
+        """
+        first = self._take(count)
+        return [self._encode(first + i, digits) for i in range(count)]
+
+
+# HASH_PEPPER_1 keyed the ids before ID_KEY existed; set ID_KEY to its value before rotating the pepper
+IDS = IdGenerator(ID_STATE_PATH, ('ID_KEY', 'HASH_PEPPER_1'))
+
+
 ########################################################################################################################
 # E-MAIL
 #######################################################################################################################
 
 
-def send_mail(address: str, subject: str, message_plain: str, message: str) -> t.Union[Exception, None]:
+MAIL_LOCK_PATH = environ.get('MAIL_LOCK_PATH') or f"{DATABASE_PATH}-mail.lock"
+MAIL_IDLE_TIMEOUT = 30
+MAIL_RETRY_MAX_DELAY = 3600
+SMTP_TIMEOUT = 30
+
+
+def smtp_connect() -> SMTP:
     """
-    Sends an e-mail to the specified address
+    Opens an authenticated connection to the mail server
+    :return: the connection
+    """
+    smtp = SMTP(environ['SMTP_SERVER'], int(environ['SMTP_PORT']), timeout=SMTP_TIMEOUT)
+    try:
+        smtp.starttls(context=create_default_context())
+        smtp.login(environ['SMTP_ADDRESS'], environ['SMTP_PASSWORD'])
+    except BaseException:
+        smtp.close()
+        raise
+    return smtp
+
+
+def build_mail(address: str, subject: str, message_plain: str, message: str) -> str:
+    """
+    Builds an e-mail with a plain text and an html part
     :param address: e-mail address
     :param subject: subject line
     :param message_plain: plain text message
     :param message: html message
-    :return: None if successful, Exception if not
+    :return: the e-mail as a string
     """
-    smtp_server = environ['SMTP_SERVER']
-    smtp_port = int(environ['SMTP_PORT'])
-    sender_email = environ['SMTP_ADDRESS']
-    context = create_default_context()
-    server = None
     m = MIMEMultipart('alternative')
     m['Subject'] = subject
-    m['From'] = sender_email
+    m['From'] = environ['SMTP_ADDRESS']
     m['To'] = address
-    part1 = MIMEText(message_plain, 'plain')
-    part2 = MIMEText(message, 'html')
-    m.attach(part1)
-    m.attach(part2)
+    m.attach(MIMEText(message_plain, 'plain'))
+    m.attach(MIMEText(message, 'html'))
+    return m.as_string()
+
+
+class MailServerUnavailable(Exception):
+    """
+    No connection to the mail server could be opened, so none of the queued messages can be sent right now
+    """
+
+
+class MailSender:
+    """
+    Sends the e-mails of the mail_queue table from a background thread. Every worker runs the thread, but only the
+    one holding the lock file sends, so the host keeps a single authenticated SMTP connection, which is reused for all
+    messages and closed after MAIL_IDLE_TIMEOUT seconds without mail. Another worker takes over when the sending one
+    exits. Failed messages are retried with exponential backoff; messages refused for good and messages which failed
+    `max_attempts` times are kept with the status `failed`. If no connection to the server can be opened, the batch
+    stops without counting an attempt and the whole queue waits, with the same backoff, before the next try.
+    """
+
+    def __init__(self, lock_path: str, poll_interval: int, max_attempts: int, retry_delay: int) -> None:
+        self._lock_path = lock_path
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._lock_file = None
+        self._smtp = None
+        self._used = 0.0
+        self._outages = 0
+        self._paused_until = 0.0
+        self._pid = None
+        self._wake = Event()
+        self._lock = Lock()
+        self._stats = {'sent': 0, 'retried': 0, 'failed': 0, 'connections': 0, 'unavailable': 0, 'errors': 0}
+
+    def start(self) -> None:
+        """
+        Starts the thread of this worker
+        :return:
+        """
+        if self._pid == getpid():
+            return
+        with self._lock:
+            if self._pid == getpid():
+                return
+            # the lock and the connection belong to the parent process
+            self._lock_file = None
+            self._smtp = None
+            self._pid = getpid()
+        Thread(target=self._run, name='mail', daemon=True).start()
+
+    def wake(self) -> None:
+        """
+        Makes the thread of this worker look for new messages now instead of at its next poll
+        :return:
+        """
+        self._wake.set()
+
+    def _count(self, counter: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[counter] += n
+
+    def lead(self) -> bool:
+        """
+        Tries to become the sending process of the host
+        :return: if this process sends the queued messages
+        """
+        if self._lock_file is None:
+            file = open(self._lock_path, 'a')
+            try:
+                flock(file, LOCK_EX | LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                return False
+            self._lock_file = file
+        return True
+
+    def _run(self) -> None:
+        while True:
+            if not self.lead():
+                self._wake.wait(self._poll_interval * 5)
+                self._wake.clear()
+                continue
+            try:
+                with app.app_context():
+                    sent = self.send_due()
+            except Exception as error:
+                log_exception('An error occurred while sending queued e-mails' + 0 * str(error))
+                self._count('errors')
+                sent = 0
+            if not sent:
+                if self._smtp is not None and time() - self._used > MAIL_IDLE_TIMEOUT:
+                    self._disconnect()
+                self._wake.wait(self._poll_interval)
+                self._wake.clear()
+
+    def _connect(self) -> SMTP:
+        smtp = smtp_connect()
+        self._count('connections')
+        return smtp
+
+    def _disconnect(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (SMTPException, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+    def _deliver(self, address: str, subject: str, message_plain: str, message: str) -> None:
+        mail = build_mail(address, subject, message_plain, message)
+        for attempt in range(2):
+            if self._smtp is None:
+                try:
+                    self._smtp = self._connect()
+                except (SMTPException, OSError) as error:
+                    raise MailServerUnavailable(repr(error)) from error
+                self._outages = 0
+            try:
+                self._smtp.sendmail(environ['SMTP_ADDRESS'], address, mail)
+                self._used = time()
+                return
+            except SMTPServerDisconnected:
+                # the server closed the idle connection
+                self._smtp = None
+                if attempt:
+                    raise
+
+    def send_due(self, limit: int = 100) -> int:
+        """
+        Sends the messages whose next attempt is due; only call it while leading
+        :param limit: the maximum number of messages
+        :return: the number of messages attempted
+        """
+        if time() < self._paused_until:
+            return 0
+        now = to_epoch(datetime.now())
+        rows = query_db('SELECT id, address, subject, message_plain, message, attempts FROM mail_queue '
+                        'WHERE status = \'queued\' AND next_attempt <= ? ORDER BY next_attempt LIMIT ?', (now, limit))
+        attempted = 0
+        for id_, address, subject, message_plain, message, attempts in rows:
+            try:
+                self._deliver(address, subject, message_plain, message)
+            except MailServerUnavailable as error:
+                # every other message would wait for the same timeout, so the whole queue backs off
+                log_exception('The mail server is unavailable' + 0 * str(error))
+                self._count('unavailable')
+                self._outages += 1
+                self._paused_until = time() + min(self._retry_delay * pow(2, self._outages - 1), MAIL_RETRY_MAX_DELAY)
+                break
+            except (SMTPException, OSError) as error:
+                attempted += 1
+                log_exception('An error occurred while sending e-mail' + 0 * str(error))
+                permanent = isinstance(error, SMTPRecipientsRefused) and all(
+                    code >= 500 for code, _ in error.recipients.values()) or (
+                    isinstance(error, SMTPResponseException) and error.smtp_code >= 500 and
+                    not isinstance(error, SMTPAuthenticationError))
+                if not isinstance(error, (SMTPRecipientsRefused, SMTPDataError)):
+                    self._disconnect()
+                attempts += 1
+                if permanent or attempts >= self._max_attempts:
+                    query_db('UPDATE mail_queue SET status = \'failed\', attempts = ?, error = ? WHERE id = ?',
+                             (attempts, repr(error), id_))
+                    self._count('failed')
+                else:
+                    delay = min(self._retry_delay * pow(2, attempts - 1), MAIL_RETRY_MAX_DELAY)
+                    query_db('UPDATE mail_queue SET attempts = ?, next_attempt = ?, error = ? WHERE id = ?',
+                             (attempts, to_epoch(datetime.now()) + delay, repr(error), id_))
+                    self._count('retried')
+                continue
+            attempted += 1
+            query_db('DELETE FROM mail_queue WHERE id = ?', (id_,))
+            self._count('sent')
+        return attempted
+
+    def stats(self) -> dict:
+        """
+        Counters of this worker
+        :return: dictionary of counters
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['sending'] = self._lock_file is not None
+        stats['paused'] = max(0, round(self._paused_until - time()))
+        return stats
+
+
+MAIL_SENDER = MailSender(MAIL_LOCK_PATH, env_int('MAIL_POLL_INTERVAL', 2), env_int('MAIL_MAX_ATTEMPTS', 8),
+                         env_int('MAIL_RETRY_DELAY', 30))
+
+
+def send_mail(address: str, subject: str, message_plain: str, message: str) -> t.Union[Exception, None]:
+    """
+    Queues an e-mail to the specified address, it is sent in the background
+    :param address: e-mail address
+    :param subject: subject line
+    :param message_plain: plain text message
+    :param message: html message
+    :return: None if successful, Exception if not
+    """
+    now = to_epoch(datetime.now())
     try:
-        server = SMTP(smtp_server, smtp_port)
-        server.starttls(context=context)
-        server.login(sender_email, environ['SMTP_PASSWORD'])
-        server.sendmail(sender_email, address, m.as_string())
-    except Exception as error:
-        log_exception('An error occurred while sending e-mail')
+        query_db('INSERT INTO mail_queue (address, subject, message_plain, message, created, status, attempts, '
+                 'next_attempt, error) VALUES (?, ?, ?, ?, ?, \'queued\', 0, ?, \'\')',
+                 (address, subject, message_plain, message, now, now))
+    except SQLite_Error as error:
+        log_exception('An error occurred while queueing e-mail')
         return error
-    finally:
-        server.quit()
+    after_commit(MAIL_SENDER.wake)
     return None
 
 
-########################################################################################################################
-# HASHING
-########################################################################################################################
+########################################################################################################################
+# HASHING
+########################################################################################################################
+
+
+HASH_STATE_PATH = environ.get('HASH_STATE_PATH') or f"{DATABASE_PATH}-hashing"
+HASH_POLL_INTERVAL = 0.01
+
+
+class HashingBusy(Exception):
+    """
+    All password hashing slots of the host are taken and there is no room left to wait for one
+    """
+
+
+class PasswordHasher:
+    """
+    Runs PBKDF2 in a bounded number of workers at once, so that a burst of sign-ins cannot occupy every worker of the
+    host. The workers share `slots` lock files in HASH_STATE_PATH. A worker which finds all of them taken has to lock
+    one of `queue` further files to wait for a slot, and is turned away at once if those are taken too or once
+    `timeout` seconds have passed. The kernel releases the locks of a worker that dies. The peppers and the iteration
+    count are read from the environment once per process.
+    """
+
+    def __init__(self, path: str, slots: int, queue: int, timeout: int) -> None:
+        self._path = path
+        self._slot_count = slots
+        self._queue_count = queue
+        self._timeout = timeout
+        self._slots = []
+        self._queue = []
+        self._peppers = (b'', b'')
+        self._iterations = 0
+        self._duration = 0.0
+        self._pid = None
+        self._lock = Lock()
+        self.hashed = 0
+        self.waited = 0
+        self.rejected = 0
+
+    def _open(self) -> None:
+        if self._pid == getpid():
+            return
+        for file in self._slots + self._queue:
+            # the locks belong to the parent process
+            file.close()
+        Path(self._path).mkdir(parents=True, exist_ok=True)
+        self._slots = [open(join(self._path, f"slot-{i}"), 'a') for i in range(self._slot_count)]
+        self._queue = [open(join(self._path, f"queue-{i}"), 'a') for i in range(self._queue_count)]
+        self._peppers = (urlsafe_b64decode(environ['HASH_PEPPER_1']), urlsafe_b64decode(environ['HASH_PEPPER_2']))
+        self._iterations = int(environ['HASH_ITERATIONS'])
+        self._pid = getpid()
+
+    @property
+    def iterations(self) -> int:
+        """
+        The iteration count for new hashes
+        :return: HASH_ITERATIONS
+        """
+        with self._lock:
+            self._open()
+        return self._iterations
+
+    @staticmethod
+    def _try_lock(files: list[t.TextIO]) -> t.Optional[t.TextIO]:
+        for file in files:
+            try:
+                flock(file, LOCK_EX | LOCK_NB)
+            except BlockingIOError:
+                continue
+            return file
+        return None
+
+    @contextmanager
+    def _slot(self) -> t.Iterator[None]:
+        slot = self._try_lock(self._slots)
+        if slot is None:
+            ticket = self._try_lock(self._queue)
+            if ticket is None:
+                self.rejected += 1
+                raise HashingBusy('No password hashing slot is available')
+            self.waited += 1
+            try:
+                deadline = perf_counter() + self._timeout
+                while slot is None:
+                    if perf_counter() >= deadline:
+                        self.rejected += 1
+                        raise HashingBusy('No password hashing slot became available')
+                    sleep(HASH_POLL_INTERVAL)
+                    slot = self._try_lock(self._slots)
+            finally:
+                flock(ticket, LOCK_UN)
+        try:
+            yield
+        finally:
+            flock(slot, LOCK_UN)
+
+    def hash(self, password: str, salt: bytes, iterations: int) -> bytes:
+        """
+        Hashes a password, one at a time per worker
+        :param password: the password
+        :param salt: the salt of the user
+        :param iterations: the iteration count the user was hashed with
+        :return: the hash
+        :raises HashingBusy: if no slot can be taken
+        """
+        with self._lock:
+            self._open()
+            with self._slot():
+                start = perf_counter()
+                digest = pbkdf2_hmac(
+                    hash_name='sha3_512',
+                    password=self._peppers[0] + password.encode() + self._peppers[1],
+                    salt=salt,
+                    iterations=iterations,
+                )
+                duration = perf_counter() - start
+            self.hashed += 1
+            if iterations == self._iterations:
+                self._duration = duration if not self._duration else self._duration * 0.9 + duration * 0.1
+        return digest
+
+    def imitate(self) -> None:
+        """
+        Takes as long as hashing a password with the current iteration count, so that sign-ins of unknown e-mail
+        addresses cannot be told apart by their timing. Once the duration has been measured it only sleeps for that
+        long, without taking a slot away from real sign-ins; until then it hashes an empty password.
+        :return:
+        :raises HashingBusy: if no slot can be taken for the first measurement
+        """
+        duration = self._duration
+        if duration:
+            sleep(duration)
+            return
+        self.hash('', bytes(32), self.iterations)
+
+    def stats(self) -> dict:
+        """
+        Counters of this worker
+        :return: dictionary of counters
+        """
+        return {
+            'hashed': self.hashed,
+            'waited': self.waited,
+            'rejected': self.rejected,
+            'duration_ms': round(self._duration * 1000, 1),
+        }
 
 
-def hash_password(password: str, salt: bytes):
-    return pbkdf2_hmac(
-        hash_name='sha3_512',
-        password=urlsafe_b64decode(environ['HASH_PEPPER_1']) + password.encode() + urlsafe_b64decode(
-            environ['HASH_PEPPER_2']),
-        salt=salt,
-        iterations=int(environ['HASH_ITERATIONS']),
-    )
+# one hash per CPU at a time; a whole class signing in at once may wait HASH_QUEUE_TIMEOUT seconds for its turn
+HASH_SLOTS = env_int('HASH_SLOTS', len(sched_getaffinity(0)))
+PASSWORD_HASHER = PasswordHasher(HASH_STATE_PATH, HASH_SLOTS, env_int('HASH_QUEUE', HASH_SLOTS * 16),
+                                 env_int('HASH_QUEUE_TIMEOUT', 3))
+HASH_ITERATIONS_BACKFILL = 'UPDATE users SET hash_iterations=? WHERE hash_iterations=0 RETURNING id'
+
+
+def hash_password(password: str, salt: bytes, iterations: int):
+    return PASSWORD_HASHER.hash(password, salt, iterations)
 
 
+with app.app_context():
+    # users hashed before the iteration count was stored were hashed with HASH_ITERATIONS
+    for _user in query_db(HASH_ITERATIONS_BACKFILL, (PASSWORD_HASHER.iterations,)):
+        SHARED_CACHE.delete('user', _user[0])
+
+
+@lru_cache(env_int('HASH_IP_CACHE_SIZE', 65536))
 def hash_ip(ip):
     try:
         ip_obj = ip_address(ip)
@@ -338,50 +1578,690 @@ def import_learnset(file: str, seperator: str = '; ') -> list[dict]:
     return output
 
 
+########################################################################################################################
+# PAYMENTS
+########################################################################################################################
+
+
+PAYMENT_REFERENCE_DIGITS = 20
+PAYMENT_IMPORT_BATCH_SIZE = 500
+PAYMENT_REFERENCE_CREATE = (
+    'INSERT INTO payment_references (number, account, product, created) VALUES (?, ?, ?, ?) '
+    'ON CONFLICT (account, product) DO NOTHING'
+)
+
+
+def add_year(date: datetime) -> datetime:
+    """
+    Moves a date one year ahead, from the 29th of February to the 28th
+    :param date: the date
+    :return: the same day of the next year
+    """
+    try:
+        return date.replace(year=date.year + 1)
+    except ValueError:
+        return date.replace(year=date.year + 1, day=28)
+
+
+def qr_iban(iban: str) -> bool:
+    """
+    Checks if an IBAN is a QR-IBAN, which only accepts payments with a QR reference
+    :param iban: the IBAN
+    :return: True if the institution id is in the QR-IID range
+    """
+    return 30000 <= int(iban.replace(' ', '')[4:9]) <= 31999
+
+
+def payment_reference(number: str, qrr: bool) -> str:
+    """
+    Formats the number of a payment reference
+    :param number: the number, PAYMENT_REFERENCE_DIGITS digits
+    :param qrr: True for a QR reference (QRR), False for an ISO 11649 creditor reference (SCOR)
+    :return: the reference
+    """
+    if qrr:
+        payload = number.zfill(26)
+        return payload + esr.calc_check_digit(payload)
+    return f"RF{mod_97_10.calc_check_digits(number + 'RF')}{number}"
+
+
+def payment_reference_number(reference: str) -> t.Optional[str]:
+    """
+    Extracts the number of a payment reference
+    :param reference: a QR or creditor reference, as printed or as transmitted
+    :return: the number or None if the reference is invalid or was not issued by payment_reference
+    """
+    reference = reference.replace(' ', '').upper()
+    if reference.startswith('RF'):
+        number = reference[4:]
+        if len(number) != PAYMENT_REFERENCE_DIGITS or not reference[2:].isdigit():
+            return None
+        # the ISO 11649 check of a numeric reference, see payment_reference
+        return number if int(f"{number}2715{reference[2:4]}") % 97 == 1 else None
+    if len(reference) != 27 or not reference.isdigit() or reference[:-1 - PAYMENT_REFERENCE_DIGITS].strip('0'):
+        return None
+    if esr.calc_check_digit(reference[:-1]) != reference[-1]:
+        return None
+    return reference[-1 - PAYMENT_REFERENCE_DIGITS:-1]
+
+
+def payment_reference_for(user_id: str, product: str) -> str:
+    """
+    Gets the reference number under which a user pays for a product, creating it on first use. The number never
+    changes, so it is cached for all workers and showing a bill again does not touch the database.
+    :param user_id: the user id
+    :param product: the product
+    :return: the number
+    """
+    key = f"{user_id}/{product}"
+    number = SHARED_CACHE.get('payment-reference', key)
+    if number is not None:
+        return number
+    result = query_db('SELECT number FROM payment_references WHERE account=? AND product=?', (user_id, product), True)
+    if not result:
+        query_db(PAYMENT_REFERENCE_CREATE, (rand_digits(PAYMENT_REFERENCE_DIGITS), user_id, product,
+                                            to_epoch(datetime.now())))
+        result = query_db('SELECT number FROM payment_references WHERE account=? AND product=?', (user_id, product),
+                          True)
+    SHARED_CACHE.set('payment-reference', key, result[0])
+    return result[0]
+
+
+def camt_credits(file: t.BinaryIO) -> t.Iterator[dict[str, t.Any]]:
+    """
+    Reads the booked credits with a structured reference from an ISO 20022 camt.053 statement or camt.054
+    notification of any version. Entries are dropped from the tree once read, so memory does not grow with the file.
+    :param file: the XML file
+    :return: the credits with their unique entry id, reference, amount, currency and booking date
+    """
+    parents: list[Element] = []
+    seen: dict[str, int] = {}
+    for event, element in iterparse(file, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        # the namespace differs between versions of the standard
+        element.tag = element.tag.rsplit('}', 1)[-1]
+        if element.tag != 'Ntry':
+            continue
+        yield from camt_entry_credits(element, seen)
+        if parents:
+            parents[-1].remove(element)
+
+
+def camt_entry_credits(entry: Element, seen: dict[str, int]) -> t.Iterator[dict[str, t.Any]]:
+    """
+    Reads the credits of one entry of a camt statement. A credit is identified by the reference of the bank, or if
+    there is none by what every report of the booking shows: the booking date, amount, reference and the EndToEndId
+    or TxId, so that a camt.054 notification and the later camt.053 statement give it the same id.
+    :param entry: the Ntry element
+    :param seen: how often each of these fallback ids has occurred in the file so far, which tells identical credits
+        of one file apart
+    :return: the credits, one for each transaction with a structured reference
+    """
+    status = entry.findtext('Sts/Cd') or entry.findtext('Sts') or ''
+    if (entry.findtext('CdtDbtInd') != 'CRDT' or status.strip() != 'BOOK'
+            or entry.findtext('RvslInd', 'false').strip() == 'true'):
+        return
+    booked = entry.findtext('BookgDt/Dt') or (entry.findtext('BookgDt/DtTm') or '')[:10]
+    entry_id = entry.findtext('AcctSvcrRef')
+    transactions = entry.findall('NtryDtls/TxDtls')
+    for i, transaction_ in enumerate(transactions):
+        reference = transaction_.findtext('RmtInf/Strd/CdtrRefInf/Ref')
+        if not reference or transaction_.findtext('CdtDbtInd', 'CRDT') != 'CRDT':
+            continue
+        amount = transaction_.find('AmtDtls/TxAmt/Amt')
+        if amount is None:
+            amount = transaction_.find('Amt')
+        if amount is None and len(transactions) == 1:
+            amount = entry.find('Amt')
+        if amount is None:
+            continue
+        key = transaction_.findtext('Refs/AcctSvcrRef') or (
+            entry_id and f"{entry_id}/{i}/{(amount.text or '').strip()}/{reference.strip()}")
+        if not key:
+            end_to_end = (transaction_.findtext('Refs/EndToEndId') or '').strip()
+            if end_to_end == 'NOTPROVIDED':
+                end_to_end = ''
+            key = '/'.join((booked, (amount.text or '').strip(), amount.get('Ccy', ''), reference.strip(),
+                            end_to_end or (transaction_.findtext('Refs/TxId') or '').strip()))
+            seen[key] = seen.get(key, 0) + 1
+            key = f"{key}/{seen[key]}"
+        yield {
+            'entry': key,
+            'reference': reference,
+            'amount': (amount.text or '').strip(),
+            'currency': amount.get('Ccy', ''),
+            'booked': datetime.strptime(booked, '%Y-%m-%d'),
+        }
+
+
+def import_payments(file: t.BinaryIO) -> dict[str, int]:
+    """
+    Extends the subscriptions of the users whose payments are booked in a camt statement. The references are matched
+    in batches while the file is read; all matched users are updated in one transaction. Every credit is recorded in
+    payment_imports, so a statement can be imported again without paying twice.
+    :param file: the XML file
+    :return: the number of credits read, matched, already imported, paid too little or in another currency, and
+        activated
+    """
+    counts = {'credits': 0, 'matched': 0, 'duplicates': 0, 'underpaid': 0, 'activated': 0}
+    matched: list[tuple[dict[str, t.Any], str, str, str]] = []
+    batch: dict[str, list[dict[str, t.Any]]] = {}
+
+    def resolve() -> None:
+        for number, account, product in query_db('SELECT number, account, product FROM payment_references WHERE '
+                                                 'number IN (SELECT value FROM json_each(?))', (dumps(list(batch)),)):
+            matched.extend((credit, number, account, product) for credit in batch[number])
+        batch.clear()
+
+    for credit in camt_credits(file):
+        counts['credits'] += 1
+        number = payment_reference_number(credit['reference'])
+        if number is not None:
+            batch.setdefault(number, []).append(credit)
+            if len(batch) >= PAYMENT_IMPORT_BATCH_SIZE:
+                resolve()
+    resolve()
+    counts['matched'] = len(matched)
+    users: dict[str, User] = {}
+    now = to_epoch(datetime.now())
+    with transaction():
+        for credit, number, account, product in matched:
+            try:
+                paid = credit['currency'] == 'CHF' and Decimal(credit['amount']) >= Decimal(PRICES[product])
+            except InvalidOperation:
+                paid = False
+            if paid and account not in users:
+                try:
+                    users[account] = User.load(account)
+                except KeyError:
+                    paid = False
+            status = 'activated' if paid else 'underpaid'
+            if not query_db('INSERT INTO payment_imports (entry, number, amount, currency, booked, imported, status) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (entry) DO NOTHING RETURNING entry', (
+                                credit['entry'], number, credit['amount'], credit['currency'],
+                                to_epoch(credit['booked']), now, status,
+                            )):
+                counts['duplicates'] += 1
+                continue
+            counts[status] += 1
+            if paid:
+                user = users[account]
+                field = PRODUCT_PAYMENTS[product]
+                setattr(user, field, add_year(max(getattr(user, field), credit['booked'])))
+        for user in users.values():
+            user.save()
+    return counts
+
+
 ########################################################################################################################
 # SECURITY
 ########################################################################################################################
 
 
+def session_state(login_id: str) -> list:
+    """
+    Gets what is needed to validate a session, cached for all workers
+    :param login_id: the Login id stored in the session
+    :return: [account id, expiry as a timestamp, browser]
+    """
+    state = SHARED_CACHE.get('session', login_id)
+    if state is None:
+        login = Login.load(login_id)
+        state = [login.account, login._valid, login.browser]  # noqa
+        SHARED_CACHE.set('session', login_id, state)
+    return state
+
+
+def entitlements(user_id: str) -> tuple[bool, bool]:
+    """
+    Checks the subscriptions of a user, cached for all workers
+    :param user_id: the user id
+    :return: if the user has premium and if the user has premium lite
+    """
+    dates = SHARED_CACHE.get('entitlement', user_id)
+    if dates is None:
+        user = User.load(user_id)
+        dates = [user._payment, user._payment_lite]  # noqa
+        SHARED_CACHE.set('entitlement', user_id, dates)
+    now = time()
+    return dates[0] > now, dates[1] > now
+
+
+LOGIN_LIFETIME = timedelta(days=100)
+SESSION_VALIDATION = environ.get('SESSION_VALIDATION') or 'signed'
+SESSION_SYNC_SLACK = 5
+
+
+class SessionRevocations:
+    """
+    Logins which have been revoked although a signed session may still claim them valid. A Login is revoked by moving
+    its expiry into the past, so every worker builds the set from the indexed `valid` column of the login table: all
+    logins that expired within the last LOGIN_LIFETIME. Each worker keeps them in a bloom filter, adds the logins that
+    expired since its last sync every few seconds and starts a new generation of the filter once a day or when it is
+    full. A hit only means that the login table has to be consulted.
+    """
+
+    def __init__(self, bits: int, hashes: int, sync_interval: int, generation_lifetime: int) -> None:
+        self._bits = bits
+        self._hashes = hashes
+        self._capacity = bits // 10
+        self._sync_interval = sync_interval
+        self._generation_lifetime = generation_lifetime
+        self._filter = bytearray(bits // 8)
+        self._count = 0
+        self._synced = 0
+        self._generation_started = 0
+        self._pid = None
+        self._healthy = False
+        self._lock = Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _positions(self, login_id: str) -> list[int]:
+        digest = blake2b(login_id.encode(), digest_size=4 * self._hashes).digest()
+        return [int.from_bytes(digest[i:i + 4], 'little') % self._bits for i in range(0, 4 * self._hashes, 4)]
+
+    def add(self, login_id: str) -> None:
+        """
+        Revokes a Login in this worker immediately, the other workers pick it up at their next sync
+        :param login_id: the Login id
+        :return:
+        """
+        for position in self._positions(login_id):
+            self._filter[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def might_contain(self, login_id: str) -> bool:
+        """
+        Checks if a Login may have been revoked
+        :param login_id: the Login id
+        :return: False if the Login has certainly not been revoked
+        """
+        self._sync()
+        if not self._healthy:
+            return True
+        for position in self._positions(login_id):
+            if not self._filter[position >> 3] & (1 << (position & 7)):
+                self.misses += 1
+                return False
+        self.hits += 1
+        return True
+
+    def _sync(self) -> None:
+        now = int(time())
+        if self._pid == getpid() and now - self._synced < self._sync_interval:
+            return
+        with self._lock:
+            if self._pid == getpid() and now - self._synced < self._sync_interval:
+                return
+            new_generation = self._pid != getpid() or not self._healthy or self._count > self._capacity or \
+                now - self._generation_started >= self._generation_lifetime
+            after = now - int(LOGIN_LIFETIME.total_seconds()) if new_generation else self._synced - SESSION_SYNC_SLACK
+            try:
+                rows = query_db('SELECT id FROM login WHERE valid > ? AND valid <= ?', (after, now))
+            except SQLite_Error as error:
+                log_exception('An error occurred while loading the revoked logins' + 0 * str(error))
+                self.errors += 1
+                self._healthy = False
+                self._pid = getpid()
+                self._synced = now
+                return
+            if new_generation:
+                self._filter = bytearray(self._bits // 8)
+                self._count = 0
+                self._generation_started = now
+                self.generation += 1
+            for row in rows:
+                self.add(row[0])
+            self._pid = getpid()
+            self._synced = now
+            self._healthy = True
+
+    def stats(self) -> dict:
+        """
+        Counters of this worker
+        :return: dictionary of counters
+        """
+        return {
+            'generation': self.generation,
+            'entries': self._count,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+        }
+
+
+SESSION_REVOCATIONS = SessionRevocations(
+    env_int('SESSION_BLOOM_BITS', pow(2, 20)),
+    7,
+    env_int('SESSION_SYNC_INTERVAL', 2),
+    86400,
+)
+
+
+def start_session(login) -> None:
+    """
+    Signs the session in and stores what is needed to validate it without the login table
+    :param login: the new Login
+    :return:
+    """
+    session['account'] = login.id_
+    session['user'] = login.account
+    session['valid'] = login._valid  # noqa
+    session['browser'] = login.browser
+
+
+def end_session() -> None:
+    """
+    Signs the session out
+    :return:
+    """
+    session['account'] = ''
+    for key in ('user', 'valid', 'browser'):
+        session.pop(key, None)
+
+
+def revoke_login(login_id: str) -> None:
+    """
+    Removes a revoked Login from the caches and adds it to the revocations of this worker once the transaction commits
+    :param login_id: the Login id
+    :return:
+    """
+    def revoke():
+        Login.uncache(login_id)
+        SESSION_REVOCATIONS.add(login_id)
+    after_commit(revoke)
+
+
+def session_user() -> str:
+    """
+    Gets the user id of the signed-in session; only call it after is_signed_in
+    :return: the user id
+    """
+    if SESSION_VALIDATION == 'signed' and session.get('user'):
+        return session['user']
+    return session_state(session['account'])[0]
+
+
 def is_signed_in():
-    if 'account' in session:
+    if session.get('account'):
+        if SESSION_VALIDATION == 'signed' and 'valid' in session:
+            if session['valid'] <= time() or session['browser'] != extract_browser(request.user_agent):
+                return False
+            if not SESSION_REVOCATIONS.might_contain(session['account']):
+                return True
         try:
-            login = Login.load(session['account'])
+            account, valid, browser = session_state(session['account'])
         except Exception as error:
             log_exception('An error occurred while loading the account data' + 0 * str(error))
             return False
-        if login.valid > datetime.now() and extract_browser(request.user_agent) == login.browser:
+        if valid > time() and extract_browser(request.user_agent) == browser:
+            if SESSION_VALIDATION == 'signed' and 'valid' not in session:
+                # sessions signed in before the validation data was stored in them
+                session.update({'user': account, 'valid': valid, 'browser': browser})
             return True
     return False
 
 
-def scan_request():
-    ip = request.access_route[-1]
-    user_agent = request.user_agent.string
-    path = repr(request.full_path)[1:-1]
-    score = query_db('SELECT score, ip FROM ips WHERE ip = ?', (ip,), True)
-    if not score:
-        score = 2
-        query_db('INSERT INTO ips VALUES (?, ?, ?)', (ip, 2, 'unknown'))
-    else:
-        score = score[0]
-    before = score
-
-    if before != score:
-        query_db('UPDATE ips SET score = ? WHERE ip = ?', (score, ip))
-
-    headers = dict(request.headers)
-    headers_to_remove = []
-    for key in headers:
-        if key not in ['Host', 'Accept', 'Accept-Language', 'Accept-Encoding', 'Content-Type']:
-            headers_to_remove.append(key)
-    for key in headers_to_remove:
+IP_DEFAULT_SCORE = 2
+IP_SCORE_RELOAD = env_int('IP_SCORE_RELOAD', 60)
+
+
+class IpScores:
+    """
+    The scores of client IPs, which are needed on every request. All workers of a host share the scores through a
+    table in the shared cache, in front of which every worker remembers the scores it has read for IP_SCORE_TTL
+    seconds, so a changed score, e.g. a ban, reaches every worker within that time. New IPs and changed scores are
+    marked dirty and written to the ips table in batches by a background thread of each worker. Scores which are not
+    dirty are read from the ips table again after IP_SCORE_RELOAD seconds, so that bans written straight into the
+    database apply within that time as well.
+    """
+
+    def __init__(self, cache: SharedCache, ttl: int, flush_interval: int) -> None:
+        self._cache = cache
+        self._ttl = ttl
+        self._flush_interval = flush_interval
+        self._local: dict[str, tuple[int, float]] = {}
+        self._lock = Lock()
+        self._flusher_pid = None
+        self._stats = {'local': 0, 'shared': 0, 'database': 0, 'flushed': 0, 'errors': 0}
+
+    def _count(self, counter: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[counter] += n
+
+    def get(self, ip: str) -> int:
+        """
+        Gets the score of an IP, new IPs get the default score
+        :param ip: the IP address
+        :return: the score, 0 means banned
+        """
+        now = time()
+        local = self._local.get(ip)
+        if local is not None and local[1] > now:
+            self._count('local')
+            return local[0]
+        self._start_flusher()
         try:
-            del headers[key]
-        except KeyError:
-            pass
-    headers = repr(str(headers))[1:-1]
-    user_agent = repr(user_agent)[1:-1]
+            rows = self._cache.execute('SELECT score FROM ip_scores WHERE ip=?', (ip,))
+        except SQLite_Error as error:
+            log_exception('An error occurred while reading the IP scores' + 0 * str(error))
+            self._count('errors')
+            rows = []
+        if rows:
+            self._count('shared')
+            score = rows[0][0]
+        else:
+            score = self._load(ip, now)
+        if len(self._local) > 10000:
+            self._local.clear()
+        self._local[ip] = (score, now + self._ttl)
+        return score
+
+    def _load(self, ip: str, now: float) -> int:
+        """
+        Reads the score of an IP which is not in the shared cache from the database
+        :param ip: the IP address
+        :param now: the current time
+        :return: the score
+        """
+        self._count('database')
+        row = query_db('SELECT score FROM ips WHERE ip = ?', (ip,), True)
+        score, dirty = (row[0], 0) if row else (IP_DEFAULT_SCORE, 1)
+        try:
+            self._cache.execute('INSERT OR IGNORE INTO ip_scores VALUES (?, ?, ?, ?)', (ip, score, dirty, now))
+        except SQLite_Error as error:
+            log_exception('An error occurred while writing the IP scores' + 0 * str(error))
+            self._count('errors')
+            if dirty:
+                query_db('INSERT OR IGNORE INTO ips VALUES (?, ?, ?)', (ip, score, 'unknown'))
+        return score
+
+    def set(self, ip: str, score: int) -> None:
+        """
+        Changes the score of an IP
+        :param ip: the IP address
+        :param score: the new score, 0 bans the IP
+        :return:
+        """
+        now = time()
+        try:
+            self._cache.execute('INSERT INTO ip_scores VALUES (?, ?, 1, ?) ON CONFLICT (ip) DO UPDATE SET '
+                                'score = excluded.score, dirty = 1', (ip, score, now))
+        except SQLite_Error as error:
+            log_exception('An error occurred while writing the IP scores' + 0 * str(error))
+            self._count('errors')
+            query_db('INSERT INTO ips VALUES (?, ?, ?) ON CONFLICT (ip) DO UPDATE SET score = excluded.score',
+                     (ip, score, 'unknown'))
+        self._local[ip] = (score, now + self._ttl)
+
+    def flush(self) -> int:
+        """
+        Writes a batch of dirty scores of all workers to the database
+        :return: the number of scores written
+        """
+        rows = self._cache.execute('SELECT ip, score FROM ip_scores WHERE dirty = 1 LIMIT 1000')
+        if rows:
+            batch = dumps(rows)
+            query_db('INSERT INTO ips SELECT json_extract(value, \'$[0]\'), json_extract(value, \'$[1]\'), '
+                     '\'unknown\' FROM json_each(?) WHERE true ON CONFLICT (ip) DO UPDATE SET score = excluded.score',
+                     (batch,))
+            # scores changed during the flush stay dirty for the next one
+            self._cache.execute('UPDATE ip_scores SET dirty = 0 FROM (SELECT json_extract(value, \'$[0]\') AS ip, '
+                                'json_extract(value, \'$[1]\') AS score FROM json_each(?)) AS flushed WHERE '
+                                'ip_scores.ip = flushed.ip AND ip_scores.score = flushed.score', (batch,))
+            self._count('flushed', len(rows))
+        self._cache.execute('DELETE FROM ip_scores WHERE dirty = 0 AND loaded < ?', (time() - IP_SCORE_RELOAD,))
+        return len(rows)
+
+    def _start_flusher(self) -> None:
+        if self._flusher_pid == getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == getpid():
+                return
+            self._flusher_pid = getpid()
+        Thread(target=self._run_flusher, name='ip-scores', daemon=True).start()
+
+    def _run_flusher(self) -> None:
+        while True:
+            sleep(self._flush_interval)
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as error:
+                log_exception('An error occurred while writing the IP scores' + 0 * str(error))
+                self._count('errors')
+
+    def stats(self) -> dict:
+        """
+        Counters of this worker: where scores were found and how many have been written
+        :return: the counters
+        """
+        with self._lock:
+            return dict(self._stats)
+
+
+IP_SCORES = IpScores(SHARED_CACHE, env_int('IP_SCORE_TTL', 5), env_int('IP_FLUSH_INTERVAL', 10))
+
+
+RATE_LIMIT_TAKE = (
+    'INSERT INTO rate_limits (key, tokens, allowed, updated) VALUES (?1, ?2 - 1, 1, ?4) '
+    'ON CONFLICT (key) DO UPDATE SET '
+    'tokens = min(?2, tokens + (?4 - updated) * ?3) - (min(?2, tokens + (?4 - updated) * ?3) >= 1), '
+    'allowed = min(?2, tokens + (?4 - updated) * ?3) >= 1, updated = ?4 RETURNING tokens, allowed'
+)
+RATE_LIMIT_CLEAN_INTERVAL = 60
+
+
+def rate_limits() -> dict[str, tuple[int, float]]:
+    """
+    Reads the limits of all endpoint groups; RATE_LIMIT_<GROUP> overrides one as `burst,requests per minute`
+    :return: burst and requests per second by group, a burst of 0 disables the limit
+    """
+    limits = {}
+    for group, (burst, per_minute) in RATE_LIMITS.items():
+        override = environ.get(f"RATE_LIMIT_{group.upper()}")
+        if override:
+            burst, per_minute = (int(value) for value in override.split(','))
+        limits[group] = (burst, per_minute / 60)
+    return limits
+
+
+class RateLimiter:
+    """
+    Token buckets per endpoint group and IP, shared by all workers through the shared cache. A bucket holds up to
+    `burst` tokens and regains its rate continuously; every request takes one token. The bucket is refilled, taken
+    from and read in a single statement, so concurrent workers never lose or double-spend tokens. The limiter fails
+    open if the cache is unavailable.
+    """
+
+    def __init__(self, cache: SharedCache, groups: list[tuple[str, str]], limits: dict[str, tuple[int, float]]) -> None:
+        self._cache = cache
+        self._groups = groups
+        self._limits = limits
+        self._idle = max((burst / rate for burst, rate in limits.values() if burst and rate), default=0)
+        self._cleaned = 0.0
+        self._lock = Lock()
+        self._stats = {group: {'allowed': 0, 'limited': 0} for group in limits}
+        self.errors = 0
+
+    def group(self, path: str) -> str:
+        """
+        Finds the endpoint group of a path
+        :param path: the request path
+        :return: the group name
+        """
+        for prefix, group in self._groups:
+            if path.startswith(prefix):
+                return group
+        return 'default'
+
+    def check(self, ip: str, path: str) -> int:
+        """
+        Takes a token from the bucket of an IP
+        :param ip: the client IP
+        :param path: the request path
+        :return: 0 if the request may proceed, otherwise the seconds until the next token is available
+        """
+        group = self.group(path)
+        burst, rate = self._limits[group]
+        if not burst:
+            return 0
+        now = time()
+        try:
+            tokens, allowed = self._cache.execute(RATE_LIMIT_TAKE, (f"{group}\t{ip}", burst, rate, now))[0]
+            if now - self._cleaned >= RATE_LIMIT_CLEAN_INTERVAL:
+                self._clean(now)
+        except SQLite_Error as error:
+            log_exception('An error occurred while checking the rate limit' + 0 * str(error))
+            with self._lock:
+                self.errors += 1
+            return 0
+        with self._lock:
+            self._stats[group]['allowed' if allowed else 'limited'] += 1
+        if allowed:
+            return 0
+        return max(1, ceil((1 - tokens) / rate)) if rate else RATE_LIMIT_CLEAN_INTERVAL
+
+    def _clean(self, now: float) -> None:
+        # an untouched bucket is full again after burst / rate seconds and equals a missing one
+        self._cleaned = now
+        self._cache.execute('DELETE FROM rate_limits WHERE updated < ?', (now - self._idle,))
+
+    def stats(self) -> dict:
+        """
+        Counters of this worker
+        :return: allowed and limited requests by group
+        """
+        with self._lock:
+            stats = {group: dict(value) for group, value in self._stats.items()}
+            stats['errors'] = self.errors
+        return stats
+
+
+RATE_LIMITER = RateLimiter(SHARED_CACHE, RATE_LIMIT_GROUPS, rate_limits())
+
+
+def scan_request(full: bool = True):
+    """
+    Scores and logs the request
+    :param full: False for the public tier, which does not look up the session
+    :return: the score of the client IP
+    """
+    ip = request.access_route[-1]
+    score = IP_SCORES.get(ip)
+    if not full:
+        access_log.info(ACCESS_LOG_LINE, ip, score, '-', request.method, request.full_path, request.user_agent.string,
+                        [(key, value) for key, value in request.headers.items() if key in ACCESS_LOG_HEADERS], 0)
+        return score
+
+    headers = [(key, value) for key, value in request.headers.items() if key in ACCESS_LOG_HEADERS]
     content_length = request.content_length if request.content_length else 0
 
     if content_length > pow(2, 10 * 3) * 2:
@@ -412,8 +2292,8 @@ def scan_request():
     # for password in passwords:
     #     content = content.replace(password, '\\PASSWORD\\')
 
-    access_log.info(f"{hash_ip(ip)}\t{score}\t{int(is_signed_in())}\t{request.method}\t{path}\t{user_agent}\t"
-                    f"{headers}\t{content_length}\t\\UNAVAILABLE")
+    access_log.info(ACCESS_LOG_LINE, ip, score, int(is_signed_in()), request.method, request.full_path,
+                    request.user_agent.string, headers, content_length)
     return score
 
 
@@ -422,54 +2302,64 @@ def scan_request():
 ########################################################################################################################
 
 
+NO_PAYMENT = datetime(2000, 1, 1)
+DEFAULT_FAVORITES = (
+    'https://schulnetz.lu.ch/ksalp | Schulnetz',
+    'https://outlook.office.com/mail/ | @sluz Mail',
+    'https://microsoft365.com/ | Microsoft 365',
+    'https://ksalpenquai.lu.ch/ | Kantonsschule Alpenquai Luzern',
+    'https://ksalpenquai.lu.ch/service/so | Schüler*innen-organisation (SO)',
+    'https://duden.de/ | Duden',
+    'https://mentor.duden.de/ | Duden Mentor',
+    'https://deepl.com/translator | DeepL Übersetzer',
+    'https://www.wolframalpha.com/ | WolframAlpha Rechner',
+    'https://www.geo.lu.ch/map/basisplan | Karte Luzern',
+    'https://openstreetmap.org | Karte International',
+)
+
+
 class User:
+    __slots__ = (
+        '_id', '_name', '_mail', '_salt', '_hash', '_newsletter', '_created', '_theme', '_iframe', '_payment',
+        '_payment_lite', '_banned', '_search', '_classes', '_grade', '_favorites', '_hash_iterations',
+    )
 
     def __init__(self, id_: str = None, name: str = '', mail: str = '', salt: bytes = b'', hash_: bytes = b'',
                  newsletter: int = 0, created: datetime = None, theme: str = 'light', iframe: int = 0,
                  payment: datetime = None, payment_lite: datetime = None, banned: list = None,
-                 search: str = 'Startpage', classes: list = None, grade: str = '-', favorites: list = None) -> None:
+                 search: str = 'Startpage', classes: list = None, grade: str = '-', favorites: list = None,
+                 hash_iterations: int = 0) -> None:
         self._id = ''
         self._name = ''
         self._mail = ''
         self._salt = ''
         self._hash = ''
         self._newsletter = 0
-        self._created = ''
+        self._created = 0
         self._theme = 'light'
         self._iframe = 0
-        self._payment = ''
-        self._payment_lite = ''
+        self._payment = 0
+        self._payment_lite = 0
         self._banned = ''
         self._search = 'Startpage'
         self._classes = ''
         self._grade = ''
         self._favorites = ''
+        self._hash_iterations = 0
         if id_ is None:
-            id_ = rand_base64(8)
+            id_ = IDS.new(8)
         if created is None:
             created = datetime.now()
         if payment is None:
-            payment = datetime.strptime('2000-01-01', '%Y-%m-%d')
+            payment = NO_PAYMENT
         if payment_lite is None:
-            payment_lite = datetime.strptime('2000-01-01', '%Y-%m-%d')
+            payment_lite = NO_PAYMENT
         if banned is None:
             banned = []
         if classes is None:
             classes = ['-']
         if favorites is None:
-            favorites = [
-                'https://schulnetz.lu.ch/ksalp | Schulnetz',
-                'https://outlook.office.com/mail/ | @sluz Mail',
-                'https://microsoft365.com/ | Microsoft 365',
-                'https://ksalpenquai.lu.ch/ | Kantonsschule Alpenquai Luzern',
-                'https://ksalpenquai.lu.ch/service/so | Schüler*innen-organisation (SO)',
-                'https://duden.de/ | Duden',
-                'https://mentor.duden.de/ | Duden Mentor',
-                'https://deepl.com/translator | DeepL Übersetzer',
-                'https://www.wolframalpha.com/ | WolframAlpha Rechner',
-                'https://www.geo.lu.ch/map/basisplan | Karte Luzern',
-                'https://openstreetmap.org | Karte International',
-            ]
+            favorites = DEFAULT_FAVORITES
         self.id_ = id_
         self.name = name
         self.mail = mail
@@ -486,6 +2376,7 @@ class User:
         self.classes = classes
         self.grade = grade
         self.favorites = favorites
+        self.hash_iterations = hash_iterations
 
     def __str__(self) -> str:
         return f"User #{self._id}"
@@ -508,6 +2399,7 @@ class User:
             'classes': self.classes,
             'grade': self.grade,
             'favorites': self.favorites,
+            'hash_iterations': self.hash_iterations,
         }
 
     @property
@@ -538,71 +2430,112 @@ class User:
         """
         if self._id is None:
             raise ValueError('No user id')
-        if not query_db('SELECT id FROM users WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
-                self._id,
-                self._name,
-                self._mail,
-                self._salt,
-                self._hash,
-                self._newsletter,
-                self._created,
-                self._theme,
-                self._iframe,
-                self._payment,
-                self._payment_lite,
-                self._banned,
-                self._search,
-                self._classes,
-                self._grade,
-                self._favorites,
-            ))
-        else:
-            query_db('UPDATE users SET name=?, mail=?, salt=?, hash=?, newsletter=?, created=?, theme=?, iframe=?, '
-                     'payment=?, payment_lite=?, banned=?, search=?, class=?, grade=?, favorites=? WHERE id=?', (
-                         self._name,
-                         self._mail,
-                         self._salt,
-                         self._hash,
-                         self._newsletter,
-                         self._created,
-                         self._theme,
-                         self._iframe,
-                         self._payment,
-                         self._payment_lite,
-                         self._banned,
-                         self._search,
-                         self._classes,
-                         self._grade,
-                         self._favorites,
-                         self._id
-                     ))
+        with transaction():
+            if not query_db('SELECT id FROM users WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                    self._id,
+                    self._name,
+                    self._mail,
+                    self._salt,
+                    self._hash,
+                    self._newsletter,
+                    self._created,
+                    self._theme,
+                    self._iframe,
+                    self._payment,
+                    self._payment_lite,
+                    self._banned,
+                    self._search,
+                    self._classes,
+                    self._grade,
+                    self._favorites,
+                    self._hash_iterations,
+                ))
+            else:
+                # the credentials stay as they are if the user came from the shared cache and they were never read
+                query_db('UPDATE users SET name=?, mail=?, salt=COALESCE(?, salt), hash=COALESCE(?, hash), '
+                         'newsletter=?, created=?, theme=?, iframe=?, payment=?, payment_lite=?, banned=?, search=?, '
+                         'class=?, grade=?, favorites=?, hash_iterations=? WHERE id=?', (
+                             self._name,
+                             self._mail,
+                             self._salt,
+                             self._hash,
+                             self._newsletter,
+                             self._created,
+                             self._theme,
+                             self._iframe,
+                             self._payment,
+                             self._payment_lite,
+                             self._banned,
+                             self._search,
+                             self._classes,
+                             self._grade,
+                             self._favorites,
+                             self._hash_iterations,
+                             self._id
+                         ))
+            after_commit(lambda: User.uncache(self._id))
+        identity_discard(self)
+
+    @staticmethod
+    def uncache(user_id: str) -> None:
+        """
+        Removes a user from the shared cache of all workers
+        :param user_id: the user id
+        :return:
+        """
+        SHARED_CACHE.delete('user', user_id)
+        SHARED_CACHE.delete('entitlement', user_id)
 
     @staticmethod
+    @identity_mapped
     def load(user_id):
         """
         loads a user from the database
         :return: a new user instance
         """
-        result = query_db('SELECT * FROM users WHERE id=?', (user_id,), True)
-        if not result:
-            raise KeyError(f"No user with the id #{user_id} has been found")
-        user = User(id_=result[0])
-        user._name = result[1]
-        user._mail = result[2]
-        user._salt = result[3]
-        user._hash = result[4]
-        user._newsletter = result[5]
-        user._created = result[6]
-        user._theme = result[7]
-        user._iframe = result[8]
-        user._payment = result[9]
-        user._payment_lite = result[10]
-        user._banned = result[11]
-        user._search = result[12]
-        user._classes = result[13]
-        user._grade = result[14]
-        user._favorites = result[15]
+        result = SHARED_CACHE.get('user', user_id)
+        if result is None:
+            result = query_db('SELECT * FROM users WHERE id=?', (user_id,), True)
+            if not result:
+                raise KeyError(f"No user with the id #{user_id} has been found")
+            # the credentials are read from the database when needed, so that the cache file never holds them
+            SHARED_CACHE.set('user', user_id, [*result[:3], None, None, *result[5:]])
+        return User._from_row(result)
+
+    def _load_credentials(self) -> None:
+        """
+        Reads the salt and hash of a user loaded from the shared cache, which leaves them out
+        :return:
+        """
+        if self._salt is None or self._hash is None:
+            self._salt, self._hash = query_db('SELECT salt, hash FROM users WHERE id=?', (self._id,), True)
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a user from a row of the users table without running the setters
+        :param row: the row
+        :return: a new user instance
+        """
+        user = User.__new__(User)
+        user._id = row[0]
+        user._name = row[1]
+        user._mail = row[2]
+        user._salt = row[3]
+        user._hash = row[4]
+        user._newsletter = row[5]
+        user._created = row[6]
+        user._theme = row[7]
+        user._iframe = row[8]
+        user._payment = row[9]
+        user._payment_lite = row[10]
+        user._banned = row[11]
+        user._search = row[12]
+        user._classes = row[13]
+        user._grade = row[14]
+        user._favorites = row[15]
+        user._hash_iterations = row[16]
         return user
 
     @property
@@ -631,7 +2564,8 @@ class User:
 
     @property
     def salt(self) -> bytes:
-        return urlsafe_b64decode(self._salt)
+        self._load_credentials()
+        return decode_base64(self._salt)
 
     @salt.setter
     def salt(self, v: bytes) -> None:
@@ -639,7 +2573,8 @@ class User:
 
     @property
     def hash_(self) -> bytes:
-        return urlsafe_b64decode(self._hash)
+        self._load_credentials()
+        return decode_base64(self._hash)
 
     @hash_.setter
     def hash_(self, v: bytes) -> None:
@@ -655,11 +2590,11 @@ class User:
 
     @property
     def created(self) -> datetime:
-        return datetime.strptime(self._created, '%Y-%m-%d_%H-%M-%S')
+        return from_epoch(self._created)
 
     @created.setter
     def created(self, v: datetime) -> None:
-        self._created = v.strftime('%Y-%m-%d_%H-%M-%S')
+        self._created = to_epoch(v)
 
     @property
     def theme(self) -> str:
@@ -681,19 +2616,19 @@ class User:
 
     @property
     def payment(self) -> datetime:
-        return datetime.strptime(self._payment, '%Y-%m-%d')
+        return from_epoch(self._payment)
 
     @payment.setter
     def payment(self, v: datetime) -> None:
-        self._payment = v.strftime('%Y-%m-%d')
+        self._payment = to_epoch(datetime(v.year, v.month, v.day))
 
     @property
     def payment_lite(self) -> datetime:
-        return datetime.strptime(self._payment_lite, '%Y-%m-%d')
+        return from_epoch(self._payment_lite)
 
     @payment_lite.setter
     def payment_lite(self, v: datetime) -> None:
-        self._payment_lite = v.strftime('%Y-%m-%d')
+        self._payment_lite = to_epoch(datetime(v.year, v.month, v.day))
 
     @property
     def banned(self) -> list:
@@ -742,6 +2677,14 @@ class User:
     def favorites(self, v: list) -> None:
         self._favorites = '\n'.join(v)
 
+    @property
+    def hash_iterations(self) -> int:
+        return self._hash_iterations
+
+    @hash_iterations.setter
+    def hash_iterations(self, v: int) -> None:
+        self._hash_iterations = int(v)
+
     def is_banned(self, checks: list) -> bool:
         """
         Check if a user is banned
@@ -756,7 +2699,17 @@ class User:
         :param password:
         :return: boolean if password is correct
         """
-        return hash_password(password, self.salt) == self.hash_
+        return compare_digest(hash_password(password, self.salt, self.hash_iterations), self.hash_)
+
+    def set_password(self, password: str) -> None:
+        """
+        Hashes a new password with a new salt and the current iteration count
+        :param password: the new password
+        :return:
+        """
+        self.salt = urlsafe_b64decode(rand_salt())
+        self.hash_iterations = PASSWORD_HASHER.iterations
+        self.hash_ = hash_password(password, self.salt, self.hash_iterations)
 
     def valid_payment(self) -> bool:
         """
@@ -774,6 +2727,7 @@ class User:
 
 
 class Comment:
+    __slots__ = ('_id', '_content', '_author', '_subject', '_posted')
 
     def __init__(self, id_: str = None, content: str = '', author: str = '', subject: str = '',
                  posted: datetime = None) -> None:
@@ -781,9 +2735,9 @@ class Comment:
         self._content = ''
         self._author = ''
         self._subject = ''
-        self._posted = ''
+        self._posted = 0
         if id_ is None:
-            id_ = rand_base64(11)
+            id_ = IDS.new(11)
         if posted is None:
             posted = datetime.now()
         self.id_ = id_
@@ -811,24 +2765,27 @@ class Comment:
         """
         if self._id is None:
             raise ValueError('No comment id')
-        if not query_db('SELECT * FROM comments WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO comments VALUES (?, ?, ?, ?, ?)', (
-                self._id,
-                self._content,
-                self._author,
-                self._subject,
-                self._posted,
-            ))
-        else:
-            query_db('UPDATE comments SET content=?, author=?, subject=?, posted=? WHERE id=?', (
-                self._content,
-                self._author,
-                self._subject,
-                self._posted,
-                self._id,
-            ))
+        with transaction():
+            if not query_db('SELECT * FROM comments WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO comments VALUES (?, ?, ?, ?, ?)', (
+                    self._id,
+                    self._content,
+                    self._author,
+                    self._subject,
+                    self._posted,
+                ))
+            else:
+                query_db('UPDATE comments SET content=?, author=?, subject=?, posted=? WHERE id=?', (
+                    self._content,
+                    self._author,
+                    self._subject,
+                    self._posted,
+                    self._id,
+                ))
+        identity_discard(self)
 
     @staticmethod
+    @identity_mapped
     def load(comment_id):
         """
         loads a comment from the database
@@ -837,7 +2794,22 @@ class Comment:
         result = query_db('SELECT * FROM comments WHERE id=?', (comment_id,), True)
         if not result:
             raise KeyError(f"No comment with the id #{comment_id} has been found")
-        return Comment(*result)
+        return Comment._from_row(result)
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a comment from a row of the comments table without running the setters
+        :param row: the row
+        :return: a new comment instance
+        """
+        comment = Comment.__new__(Comment)
+        comment._id = row[0]
+        comment._content = row[1]
+        comment._author = row[2]
+        comment._subject = row[3]
+        comment._posted = row[4]
+        return comment
 
     @property
     def id_(self) -> str:
@@ -873,19 +2845,23 @@ class Comment:
 
     @property
     def posted(self) -> datetime:
-        return datetime.strptime(self._posted, '%Y-%m-%d_%H-%M-%S')
+        return from_epoch(self._posted)
 
     @posted.setter
     def posted(self, v: datetime) -> None:
-        self._posted = v.strftime('%Y-%m-%d_%H-%M-%S')
+        self._posted = to_epoch(v)
 
 
 class Document:
+    __slots__ = (
+        '_id', '_title', '_subject', '_description', '_class', '_grade', '_language', '_owner', '_edited', '_created',
+        '_extension', '_mimetype', '_size', '_blob', '_owner_name',
+    )
 
     def __init__(self, id_: str = None, title: str = '', subject: str = '-', description: str = '', class_: str = '',
                  grade: str = '-', language: str = '-', owner: str = '', edited: datetime = None,
                  created: datetime = None,
-                 extension: str = '', mimetype: str = '', size: int = 0) -> None:
+                 extension: str = '', mimetype: str = '', size: int = 0, blob: str = '') -> None:
         self._id = ''
         self._title = ''
         self._subject = ''
@@ -894,13 +2870,15 @@ class Document:
         self._grade = ''
         self._language = ''
         self._owner = ''
-        self._edited = ''
-        self._created = ''
+        self._edited = 0
+        self._created = 0
         self._extension = ''
         self._mimetype = ''
         self._size = 0
+        self._blob = ''
+        self._owner_name = None
         if id_ is None:
-            id_ = rand_base64(8)
+            id_ = IDS.new(8)
         if created is None:
             created = datetime.now()
         if edited is None:
@@ -918,6 +2896,7 @@ class Document:
         self.extension = extension
         self.mimetype = mimetype
         self.size = size
+        self.blob = blob
 
     def __str__(self) -> str:
         return f"Document #{self._id}"
@@ -938,7 +2917,8 @@ class Document:
             'mimetype': self.mimetype,
             'size': self.size,
             'formated_size': self.format_size(use_1024=True),
-            'owner_name': query_db('SELECT name FROM users WHERE id=?', (self.owner,), True)[0]
+            'owner_name': self._owner_name if self._owner_name is not None else
+            query_db('SELECT name FROM users WHERE id=?', (self.owner,), True)[0]
         }
 
     def save(self) -> None:
@@ -948,26 +2928,10 @@ class Document:
         """
         if self._id is None:
             raise ValueError('No document id')
-        if not query_db('SELECT id FROM documents WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
-                self._id,
-                self._title,
-                self._subject,
-                self._description,
-                self._class,
-                self._grade,
-                self._language,
-                self._owner,
-                self._edited,
-                self._created,
-                self._extension,
-                self._mimetype,
-                self._size,
-            ))
-        else:
-            query_db(
-                'UPDATE documents SET title=?, subject=?, description=?, class=?, grade=?, language=?, owner=?, edited=?, '
-                'created=?, extension=?, mimetype=?, size=? WHERE id=?', (
+        with transaction():
+            if not query_db('SELECT id FROM documents WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                    self._id,
                     self._title,
                     self._subject,
                     self._description,
@@ -980,10 +2944,31 @@ class Document:
                     self._extension,
                     self._mimetype,
                     self._size,
-                    self._id,
+                    self._blob,
                 ))
+            else:
+                query_db(
+                    'UPDATE documents SET title=?, subject=?, description=?, class=?, grade=?, language=?, owner=?, edited=?, '
+                    'created=?, extension=?, mimetype=?, size=?, blob=? WHERE id=?', (
+                        self._title,
+                        self._subject,
+                        self._description,
+                        self._class,
+                        self._grade,
+                        self._language,
+                        self._owner,
+                        self._edited,
+                        self._created,
+                        self._extension,
+                        self._mimetype,
+                        self._size,
+                        self._blob,
+                        self._id,
+                    ))
+        identity_discard(self)
 
     @staticmethod
+    @identity_mapped
     def load(document_id):
         """
         loads a document from the database
@@ -992,19 +2977,59 @@ class Document:
         result = query_db('SELECT * FROM documents WHERE id=?', (document_id,), True)
         if not result:
             raise KeyError(f"No document with the id #{document_id} has been found")
-        document = Document(id_=result[0])
-        document._title = result[1]
-        document._subject = result[2]
-        document._description = result[3]
-        document._class = result[4]
-        document._grade = result[5]
-        document._language = result[6]
-        document._owner = result[7]
-        document._edited = result[8]
-        document._created = result[9]
-        document._extension = result[10]
-        document._mimetype = result[11]
-        document._size = result[12]
+        return Document._from_row(result)
+
+    @staticmethod
+    def load_many(document_ids: list) -> list:
+        """
+        loads several documents together with the names of their owners in a single query
+        :param document_ids: list of document ids
+        :return: the documents which exist, in the order of document_ids
+        """
+        result = query_db('SELECT documents.*, COALESCE(users.name, \'\') FROM documents LEFT JOIN users ON '
+                          'users.id = documents.owner WHERE documents.id IN (SELECT value FROM json_each(?))',
+                          (dumps(document_ids),))
+        documents = {i[0]: Document._from_row(i) for i in result}
+        return [documents[i] for i in document_ids if i in documents]
+
+    @staticmethod
+    def load_all(since: int = None) -> list:
+        """
+        loads all documents together with the names of their owners in a single query
+        :param since: only load documents edited at or after this timestamp
+        :return: list of all documents
+        """
+        if since is None:
+            result = query_db('SELECT documents.*, COALESCE(users.name, \'\') FROM documents LEFT JOIN users ON '
+                              'users.id = documents.owner')
+        else:
+            result = query_db('SELECT documents.*, COALESCE(users.name, \'\') FROM documents LEFT JOIN users ON '
+                              'users.id = documents.owner WHERE documents.edited >= ?', (since,))
+        return [Document._from_row(i) for i in result]
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a document from a row of the documents table without running the setters
+        :param row: the row, optionally followed by the owner name
+        :return: a new document instance
+        """
+        document = Document.__new__(Document)
+        document._id = row[0]
+        document._title = row[1]
+        document._subject = row[2]
+        document._description = row[3]
+        document._class = row[4]
+        document._grade = row[5]
+        document._language = row[6]
+        document._owner = row[7]
+        document._edited = row[8]
+        document._created = row[9]
+        document._extension = row[10]
+        document._mimetype = row[11]
+        document._size = row[12]
+        document._blob = row[13]
+        document._owner_name = row[14] if len(row) > 14 else None
         return document
 
     @property
@@ -1073,25 +3098,25 @@ class Document:
 
     @owner.setter
     def owner(self, v: str) -> None:
-        if not query_db('SELECT id FROM users WHERE id=?', (v,), True) and v != '':
+        if v != '' and not query_db('SELECT id FROM users WHERE id=?', (v,), True):
             raise ValueError(f"No user with id #{v} exists")
         self._owner = v
 
     @property
     def edited(self) -> datetime:
-        return datetime.strptime(self._edited, '%Y-%m-%d_%H-%M-%S')
+        return from_epoch(self._edited)
 
     @edited.setter
     def edited(self, v: datetime) -> None:
-        self._edited = v.strftime('%Y-%m-%d_%H-%M-%S')
+        self._edited = to_epoch(v)
 
     @property
     def created(self) -> datetime:
-        return datetime.strptime(self._created, '%Y-%m-%d_%H-%M-%S')
+        return from_epoch(self._created)
 
     @created.setter
     def created(self, v: datetime) -> None:
-        self._created = v.strftime('%Y-%m-%d_%H-%M-%S')
+        self._created = to_epoch(v)
 
     @property
     def extension(self) -> str:
@@ -1117,6 +3142,14 @@ class Document:
     def size(self, v: int) -> None:
         self._size = v
 
+    @property
+    def blob(self) -> str:
+        return self._blob
+
+    @blob.setter
+    def blob(self, v: str) -> None:
+        self._blob = v
+
     def format_size(self, use_1024: bool = False) -> str:
         """
         Formats the file size in a user readable format
@@ -1157,6 +3190,10 @@ class Document:
 
 
 class LearnSet:
+    __slots__ = (
+        '_id', '_title', '_subject', '_description', '_class', '_grade', '_language', '_owner', '_edited', '_created',
+        '_exercise_count', '_answer_count', '_owner_name',
+    )
 
     def __init__(self, id_: str = None, title: str = '', subject: str = '', description: str = '', class_: str = '',
                  grade: str = '-', language: str = '-', owner: str = '', edited: datetime = None,
@@ -1169,10 +3206,13 @@ class LearnSet:
         self._grade = ''
         self._language = ''
         self._owner = ''
-        self._edited = ''
-        self._created = ''
+        self._edited = 0
+        self._created = 0
+        self._exercise_count = 0
+        self._answer_count = 0
+        self._owner_name = None
         if id_ is None:
-            id_ = rand_base64(8)
+            id_ = IDS.new(8)
         if created is None:
             created = datetime.now()
         if edited is None:
@@ -1203,8 +3243,10 @@ class LearnSet:
             'owner': self.owner,
             'edited': self.edited,
             'created': self.created,
-            'owner_name': query_db('SELECT name FROM users WHERE id=?', (self.owner,), True)[0],
-            'size': query_db('SELECT COUNT(*) FROM learn_exercises WHERE set_id=?', (self.id_,), True)[0],
+            'owner_name': self._owner_name if self._owner_name is not None else
+            query_db('SELECT name FROM users WHERE id=?', (self.owner,), True)[0],
+            'size': self._exercise_count,
+            'answer_count': self._answer_count,
         }
 
     def save(self) -> None:
@@ -1212,55 +3254,100 @@ class LearnSet:
         Saves the LearnSet in the database.
         :return: None
         """
-        if self._id is None:
-            raise ValueError('No LearnSet id')
-        if not query_db('SELECT id FROM learn_sets WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO learn_sets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
-                self._id,
-                self._title,
-                self._subject,
-                self._description,
-                self._class,
-                self._grade,
-                self._language,
-                self._owner,
-                self._edited,
-                self._created,
-            ))
+        if self._id is None:
+            raise ValueError('No LearnSet id')
+        with transaction():
+            if not query_db('SELECT id FROM learn_sets WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO learn_sets (id, title, subject, description, class, grade, language, owner, '
+                         'edited, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                    self._id,
+                    self._title,
+                    self._subject,
+                    self._description,
+                    self._class,
+                    self._grade,
+                    self._language,
+                    self._owner,
+                    self._edited,
+                    self._created,
+                ))
+            else:
+                query_db('UPDATE learn_sets SET title=?, subject=?, description=?, class=?, grade=?, language=?, '
+                         'owner=?, edited=?, created=? WHERE id=?', (
+                             self._title,
+                             self._subject,
+                             self._description,
+                             self._class,
+                             self._grade,
+                             self._language,
+                             self._owner,
+                             self._edited,
+                             self._created,
+                             self._id,
+                         ))
+        identity_discard(self)
+
+    @staticmethod
+    @identity_mapped
+    def load(learn_set_id):
+        """
+        loads a LearnSet from the database
+        :return: a new LearnSet instance
+        """
+        result = query_db('SELECT * FROM learn_sets WHERE id=?', (learn_set_id,), True)
+        if not result:
+            raise KeyError(f"No LearnSet with the id #{learn_set_id} has been found")
+        return LearnSet._from_row(result)
+
+    @staticmethod
+    def load_many(learn_set_ids: list) -> list:
+        """
+        loads several LearnSets together with the names of their owners in a single query
+        :param learn_set_ids: list of LearnSet ids
+        :return: the LearnSets which exist, in the order of learn_set_ids
+        """
+        result = query_db('SELECT learn_sets.*, COALESCE(users.name, \'\') FROM learn_sets LEFT JOIN users ON '
+                          'users.id = learn_sets.owner WHERE learn_sets.id IN (SELECT value FROM json_each(?))',
+                          (dumps(learn_set_ids),))
+        learnsets = {i[0]: LearnSet._from_row(i) for i in result}
+        return [learnsets[i] for i in learn_set_ids if i in learnsets]
+
+    @staticmethod
+    def load_all(since: int = None) -> list:
+        """
+        loads all LearnSets together with the names of their owners in a single query
+        :param since: only load LearnSets edited at or after this timestamp
+        :return: list of all LearnSets
+        """
+        if since is None:
+            result = query_db('SELECT learn_sets.*, COALESCE(users.name, \'\') FROM learn_sets LEFT JOIN users ON '
+                              'users.id = learn_sets.owner')
         else:
-            query_db('UPDATE learn_sets SET title=?, subject=?, description=?, class=?, grade=?, language=?, owner=?, '
-                     'edited=?, created=? WHERE id=?', (
-                         self._title,
-                         self._subject,
-                         self._description,
-                         self._class,
-                         self._grade,
-                         self._language,
-                         self._owner,
-                         self._edited,
-                         self._created,
-                         self._id,
-                     ))
+            result = query_db('SELECT learn_sets.*, COALESCE(users.name, \'\') FROM learn_sets LEFT JOIN users ON '
+                              'users.id = learn_sets.owner WHERE learn_sets.edited >= ?', (since,))
+        return [LearnSet._from_row(i) for i in result]
 
     @staticmethod
-    def load(learn_set_id):
+    def _from_row(row):
         """
-        loads a LearnSet from the database
+        creates a LearnSet from a row of the learn_sets table without running the setters
+        :param row: the row, optionally followed by the owner name
         :return: a new LearnSet instance
         """
-        result = query_db('SELECT * FROM learn_sets WHERE id=?', (learn_set_id,), True)
-        if not result:
-            raise KeyError(f"No LearnSet with the id #{learn_set_id} has been found")
-        learnset = LearnSet(result[0])
-        learnset._title = result[1]
-        learnset._subject = result[2]
-        learnset._description = result[3]
-        learnset._class = result[4]
-        learnset._grade = result[5]
-        learnset._language = result[6]
-        learnset._owner = result[7]
-        learnset._edited = result[8]
-        learnset._created = result[9]
+        learnset = LearnSet.__new__(LearnSet)
+        learnset._id = row[0]
+        learnset._title = row[1]
+        learnset._subject = row[2]
+        learnset._description = row[3]
+        learnset._class = row[4]
+        learnset._grade = row[5]
+        learnset._language = row[6]
+        learnset._owner = row[7]
+        learnset._edited = row[8]
+        learnset._created = row[9]
+        learnset._exercise_count = row[10]
+        learnset._answer_count = row[11]
+        learnset._owner_name = row[12] if len(row) > 12 else None
         return learnset
 
     @property
@@ -1329,25 +3416,25 @@ class LearnSet:
 
     @owner.setter
     def owner(self, v: str) -> None:
-        if not query_db('SELECT id FROM users WHERE id=?', (v,), True) and v != '':
+        if v != '' and not query_db('SELECT id FROM users WHERE id=?', (v,), True):
             raise ValueError(f"No user with id #{v} exists")
         self._owner = v
 
     @property
     def edited(self) -> datetime:
-        return datetime.strptime(self._edited, '%Y-%m-%d_%H-%M-%S')
+        return from_epoch(self._edited)
 
     @edited.setter
     def edited(self, v: datetime) -> None:
-        self._edited = v.strftime('%Y-%m-%d_%H-%M-%S')
+        self._edited = to_epoch(v)
 
     @property
     def created(self) -> datetime:
-        return datetime.strptime(self._created, '%Y-%m-%d_%H-%M-%S')
+        return from_epoch(self._created)
 
     @created.setter
     def created(self, v: datetime) -> None:
-        self._created = v.strftime('%Y-%m-%d_%H-%M-%S')
+        self._created = to_epoch(v)
 
     def get_owner(self) -> User:
         """
@@ -1362,10 +3449,11 @@ class LearnSet:
         :return: a list of LearnExercise
         """
         result = query_db('SELECT * FROM learn_exercises WHERE set_id=?', (self.id_,), False)
-        return [LearnExercise(*i) for i in result]
+        return [LearnExercise._from_row(i) for i in result]
 
 
 class LearnExercise:
+    __slots__ = ('_id', '_set_id', '_question', '_answer', '_answers', '_frequency', '_auto_check')
 
     def __init__(self, id_: str = None, set_id: str = '', question: str = '', answer: str = '', answers: list = None,
                  frequency: float = 1.0, auto_check: int = 0):
@@ -1377,7 +3465,7 @@ class LearnExercise:
         self._frequency = 1.0
         self._auto_check = 0
         if id_ is None:
-            id_ = rand_base64(8)
+            id_ = IDS.new(8)
         if answers is None:
             answers = []
         self.id_ = id_
@@ -1409,30 +3497,33 @@ class LearnExercise:
         """
         if self._id is None:
             raise ValueError('No LearnExercise id')
-        if not query_db('SELECT id FROM learn_exercises WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO learn_exercises VALUES (?, ?, ?, ?, ?, ?, ?)', (
-                self._id,
-                self._set_id,
-                self._question,
-                self._answer,
-                self._answers,
-                self._frequency,
-                self._auto_check,
-            ))
-        else:
-            query_db(
-                'UPDATE learn_exercises SET id=?, set_id=?, question=?, answer=?, answers=?, frequency=?, auto_check=? '
-                'WHERE id=?', (
+        with transaction():
+            if not query_db('SELECT id FROM learn_exercises WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO learn_exercises VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                    self._id,
                     self._set_id,
                     self._question,
                     self._answer,
                     self._answers,
                     self._frequency,
                     self._auto_check,
-                    self._id,
                 ))
+            else:
+                query_db(
+                    'UPDATE learn_exercises SET set_id=?, question=?, answer=?, answers=?, frequency=?, auto_check=? '
+                    'WHERE id=?', (
+                        self._set_id,
+                        self._question,
+                        self._answer,
+                        self._answers,
+                        self._frequency,
+                        self._auto_check,
+                        self._id,
+                    ))
+        identity_discard(self)
 
     @staticmethod
+    @identity_mapped
     def load(learn_exercise_id):
         """
         loads a LearnExercise from the database
@@ -1441,13 +3532,37 @@ class LearnExercise:
         result = query_db('SELECT * FROM learn_exercises WHERE id=?', (learn_exercise_id,), True)
         if not result:
             raise KeyError(f"No LearnExercise with the id #{learn_exercise_id} has been found")
-        exercise = LearnExercise(result[0])
-        exercise._set_id = result[1]
-        exercise._question = result[2]
-        exercise._answer = result[3]
-        exercise._answers = result[4]
-        exercise._frequency = result[5]
-        exercise._auto_check = result[6]
+        return LearnExercise._from_row(result)
+
+    @staticmethod
+    def load_by_sets(learn_set_ids: list) -> list:
+        """
+        loads the exercises of several LearnSets in a single query
+        :param learn_set_ids: list of LearnSet ids
+        :return: the exercises grouped in the order of learn_set_ids
+        """
+        result = query_db('SELECT * FROM learn_exercises WHERE set_id IN (SELECT value FROM json_each(?)) '
+                          'ORDER BY rowid', (dumps(learn_set_ids),))
+        exercises = {}
+        for row in result:
+            exercises.setdefault(row[1], []).append(LearnExercise._from_row(row))
+        return [exercise for i in learn_set_ids for exercise in exercises.get(i, [])]
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a LearnExercise from a row of the learn_exercises table without running the setters
+        :param row: the row
+        :return: a new LearnExercise instance
+        """
+        exercise = LearnExercise.__new__(LearnExercise)
+        exercise._id = row[0]
+        exercise._set_id = row[1]
+        exercise._question = row[2]
+        exercise._answer = row[3]
+        exercise._answers = row[4]
+        exercise._frequency = row[5]
+        exercise._auto_check = row[6]
         return exercise
 
     @property
@@ -1514,6 +3629,7 @@ class LearnExercise:
 
 
 class LearnStat:
+    __slots__ = ('_id', '_exercise_id', '_owner', '_correct', '_wrong')
 
     def __init__(self, id_: str = None, exercise_id: str = '', owner: str = '', correct: int = 0, wrong: int = 0):
         self._id = ''
@@ -1522,7 +3638,7 @@ class LearnStat:
         self._correct = 0
         self._wrong = 0
         if id_ is None:
-            id_ = rand_base64(12)
+            id_ = IDS.new(12)
         self.id_ = id_
         self.exercise_id = exercise_id
         self.owner = owner
@@ -1548,24 +3664,27 @@ class LearnStat:
         """
         if self._id is None:
             raise ValueError('No LearnStat id')
-        if not query_db('SELECT id FROM learn_stats WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO learn_stats VALUES (?, ?, ?, ?, ?)', (
-                self._id,
-                self._exercise_id,
-                self._owner,
-                self._correct,
-                self._wrong,
-            ))
-        else:
-            query_db('UPDATE learn_stats SET exercise_id=?, owner=?, correct=?, wrong=? WHERE id=?', (
-                self._exercise_id,
-                self._owner,
-                self._correct,
-                self._wrong,
-                self._id,
-            ))
+        with transaction():
+            if not query_db('SELECT id FROM learn_stats WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO learn_stats VALUES (?, ?, ?, ?, ?)', (
+                    self._id,
+                    self._exercise_id,
+                    self._owner,
+                    self._correct,
+                    self._wrong,
+                ))
+            else:
+                query_db('UPDATE learn_stats SET exercise_id=?, owner=?, correct=?, wrong=? WHERE id=?', (
+                    self._exercise_id,
+                    self._owner,
+                    self._correct,
+                    self._wrong,
+                    self._id,
+                ))
+        identity_discard(self)
 
     @staticmethod
+    @identity_mapped
     def load(learn_stat_id):
         """
         loads a LearnStat from the database
@@ -1574,7 +3693,34 @@ class LearnStat:
         result = query_db('SELECT * FROM learn_stats WHERE id=?', (learn_stat_id,), True)
         if not result:
             raise KeyError(f"No LearnStat with the id #{learn_stat_id} has been found")
-        return LearnStat(*result)
+        return LearnStat._from_row(result)
+
+    @staticmethod
+    def load_by_owner(owner: str, exercise_ids: list) -> dict:
+        """
+        loads the statistics of one user for several exercises in a single query
+        :param owner: the user id
+        :param exercise_ids: list of LearnExercise ids
+        :return: the LearnStats by exercise id
+        """
+        result = query_db('SELECT * FROM learn_stats WHERE owner=? AND exercise_id IN '
+                          '(SELECT value FROM json_each(?))', (owner, dumps(exercise_ids)))
+        return {i[1]: LearnStat._from_row(i) for i in result}
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a LearnStat from a row of the learn_stats table without running the setters
+        :param row: the row
+        :return: a new LearnStat instance
+        """
+        learn_stat = LearnStat.__new__(LearnStat)
+        learn_stat._id = row[0]
+        learn_stat._exercise_id = row[1]
+        learn_stat._owner = row[2]
+        learn_stat._correct = row[3]
+        learn_stat._wrong = row[4]
+        return learn_stat
 
     @property
     def id_(self) -> str:
@@ -1632,14 +3778,15 @@ class LearnStat:
 
 
 class MailCheck:
+    __slots__ = ('_id', '_account', '_valid', '_code')
 
     def __init__(self, id_: str = None, account: dict = None, valid: datetime = None, code: str = None):
         self._id = ''
         self._account = ''
-        self._valid = ''
+        self._valid = 0
         self._code = ''
         if id_ is None:
-            id_ = rand_base64(12)
+            id_ = IDS.new(12)
         if account is None:
             account = {}
         if valid is None:
@@ -1669,22 +3816,25 @@ class MailCheck:
         """
         if self._id is None:
             raise ValueError('No MailCheck id')
-        if not query_db('SELECT id FROM mail_check WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO mail_check VALUES (?, ?, ?, ?)', (
-                self._id,
-                self._account,
-                self._valid,
-                self._code,
-            ))
-        else:
-            query_db('UPDATE mail_check SET account=?, valid=?, code=? WHERE id=?', (
-                self._account,
-                self._valid,
-                self._code,
-                self._id,
-            ))
+        with transaction():
+            if not query_db('SELECT id FROM mail_check WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO mail_check VALUES (?, ?, ?, ?)', (
+                    self._id,
+                    self._account,
+                    self._valid,
+                    self._code,
+                ))
+            else:
+                query_db('UPDATE mail_check SET account=?, valid=?, code=? WHERE id=?', (
+                    self._account,
+                    self._valid,
+                    self._code,
+                    self._id,
+                ))
+        identity_discard(self)
 
     @staticmethod
+    @identity_mapped
     def load(mail_check_id):
         """
         loads a MailCheck from the database
@@ -1693,11 +3843,7 @@ class MailCheck:
         result = query_db('SELECT * FROM mail_check WHERE id=?', (mail_check_id,), True)
         if not result:
             raise KeyError(f"No MailCheck with the id #{mail_check_id} has been found")
-        mail_check = MailCheck(id_=result[0])
-        mail_check._account = result[1]
-        mail_check._valid = result[2]
-        mail_check._code = result[3]
-        return mail_check
+        return MailCheck._from_row(result)
 
     @staticmethod
     def load_by_code(mail_check_code: str):
@@ -1708,10 +3854,20 @@ class MailCheck:
         result = query_db('SELECT * FROM mail_check WHERE code=?', (mail_check_code,), True)
         if not result:
             raise KeyError(f"No MailCheck with the code #{mail_check_code} has been found")
-        mail_check = MailCheck(id_=result[0])
-        mail_check._account = result[1]
-        mail_check._valid = result[2]
-        mail_check._code = result[3]
+        return MailCheck._from_row(result)
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a MailCheck from a row of the mail_check table without running the setters
+        :param row: the row
+        :return: a new MailCheck instance
+        """
+        mail_check = MailCheck.__new__(MailCheck)
+        mail_check._id = row[0]
+        mail_check._account = row[1]
+        mail_check._valid = row[2]
+        mail_check._code = row[3]
         return mail_check
 
     @property
@@ -1732,11 +3888,11 @@ class MailCheck:
 
     @property
     def valid(self) -> datetime:
-        return datetime.strptime(self._valid, '%Y-%m-%d_%H-%M-%S')
+        return from_epoch(self._valid)
 
     @valid.setter
     def valid(self, v: datetime) -> None:
-        self._valid = v.strftime('%Y-%m-%d_%H-%M-%S')
+        self._valid = to_epoch(v)
 
     @property
     def code(self) -> str:
@@ -1748,16 +3904,17 @@ class MailCheck:
 
 
 class Login:
+    __slots__ = ('_id', '_account', '_valid', '_browser')
 
     def __init__(self, id_: str = None, account: str = '', valid: datetime = None, browser: str = '') -> None:
         self._id = ''
         self._account = ''
-        self._valid = ''
+        self._valid = 0
         self._browser = ''
         if id_ is None:
             id_ = rand_base64(64)
         if valid is None:
-            valid = datetime.now() + timedelta(days=100)
+            valid = datetime.now() + LOGIN_LIFETIME
         self.id_ = id_
         self.account = account
         self.valid = valid
@@ -1781,34 +3938,61 @@ class Login:
         """
         if self._id is None:
             raise ValueError('No Login id')
-        if not query_db('SELECT id FROM login WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO login VALUES (?, ?, ?, ?)', (
-                self._id,
-                self._account,
-                self._valid,
-                self._browser,
-            ))
-        else:
-            query_db('UPDATE login SET account=?, valid=?, browser=? WHERE id=?', (
-                self._account,
-                self._valid,
-                self._browser,
-                self._id,
-            ))
+        with transaction():
+            if not query_db('SELECT id FROM login WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO login VALUES (?, ?, ?, ?)', (
+                    self._id,
+                    self._account,
+                    self._valid,
+                    self._browser,
+                ))
+            else:
+                query_db('UPDATE login SET account=?, valid=?, browser=? WHERE id=?', (
+                    self._account,
+                    self._valid,
+                    self._browser,
+                    self._id,
+                ))
+            after_commit(lambda: Login.uncache(self._id))
+        identity_discard(self)
+
+    @staticmethod
+    def uncache(login_id: str) -> None:
+        """
+        Removes a Login from the shared cache of all workers
+        :param login_id: the Login id
+        :return:
+        """
+        SHARED_CACHE.delete('login', login_id)
+        SHARED_CACHE.delete('session', login_id)
 
     @staticmethod
+    @identity_mapped
     def load(login_id):
         """
         loads a Login from the database
         :return: a new Login instance
         """
-        result = query_db('SELECT * FROM login WHERE id=?', (login_id,), True)
-        if not result:
-            raise KeyError(f"No Login with the id #{login_id} has been found")
-        login = Login(id_=result[0])
-        login._account = result[1]
-        login._valid = result[2]
-        login._browser = result[3]
+        result = SHARED_CACHE.get('login', login_id)
+        if result is None:
+            result = query_db('SELECT * FROM login WHERE id=?', (login_id,), True)
+            if not result:
+                raise KeyError(f"No Login with the id #{login_id} has been found")
+            SHARED_CACHE.set('login', login_id, result)
+        return Login._from_row(result)
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a Login from a row of the login table without running the setters
+        :param row: the row
+        :return: a new Login instance
+        """
+        login = Login.__new__(Login)
+        login._id = row[0]
+        login._account = row[1]
+        login._valid = row[2]
+        login._browser = row[3]
         return login
 
     @property
@@ -1829,11 +4013,11 @@ class Login:
 
     @property
     def valid(self) -> datetime:
-        return datetime.strptime(self._valid, '%Y-%m-%d_%H-%M-%S')
+        return from_epoch(self._valid)
 
     @valid.setter
     def valid(self, v: datetime) -> None:
-        self._valid = v.strftime('%Y-%m-%d_%H-%M-%S')
+        self._valid = to_epoch(v)
 
     @property
     def browser(self) -> str:
@@ -1848,6 +4032,7 @@ class Login:
 
 
 class Calendar:
+    __slots__ = ('_id', '_owner', '_access', '_name', '_color')
 
     def __init__(self, id_: str = None, owner: str = '', access: str = '', name: str = '', color: str = ''):
         self._id = ''
@@ -1856,7 +4041,7 @@ class Calendar:
         self._name = ''
         self._color = ''
         if id_ is None:
-            id_ = rand_base64(9)
+            id_ = IDS.new(9)
         self.id_ = id_
         self.owner = owner
         self.access = access
@@ -1883,23 +4068,27 @@ class Calendar:
         """
         if self._id is None:
             raise ValueError('No Calendar id')
-        if not query_db('SELECT id FROM calendars WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO calendars VALUES (?, ?, ?, ?, ?)', (
-                self._id,
-                self._owner,
-                self._access,
-                self._name,
-                self._color,
-            ))
-        else:
-            query_db('UPDATE calendars SET owner=?, access=?, name=?, color=? WHERE id=?', (
-                self._owner,
-                self._access,
-                self._name,
-                self._color,
-            ))
+        with transaction():
+            if not query_db('SELECT id FROM calendars WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO calendars VALUES (?, ?, ?, ?, ?)', (
+                    self._id,
+                    self._owner,
+                    self._access,
+                    self._name,
+                    self._color,
+                ))
+            else:
+                query_db('UPDATE calendars SET owner=?, access=?, name=?, color=? WHERE id=?', (
+                    self._owner,
+                    self._access,
+                    self._name,
+                    self._color,
+                    self._id,
+                ))
+        identity_discard(self)
 
     @staticmethod
+    @identity_mapped
     def load(calendar_id):
         """
         loads a Calendar from the database
@@ -1909,11 +4098,21 @@ class Calendar:
         result = query_db('SELECT * FROM calendars WHERE id=?', (calendar_id,), True)
         if not result:
             raise KeyError(f"No Calendar with the id #{calendar_id} has been found")
-        calendar = Calendar(id_=result[0])
-        calendar._owner = result[1]
-        calendar._access = result[2]
-        calendar._name = result[3]
-        calendar._color = result[4]
+        return Calendar._from_row(result)
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a Calendar from a row of the calendars table without running the setters
+        :param row: the row
+        :return: a new Calendar instance
+        """
+        calendar = Calendar.__new__(Calendar)
+        calendar._id = row[0]
+        calendar._owner = row[1]
+        calendar._access = row[2]
+        calendar._name = row[3]
+        calendar._color = row[4]
         return calendar
 
     @property
@@ -1930,7 +4129,7 @@ class Calendar:
 
     @owner.setter
     def owner(self, v: str) -> None:
-        if not query_db('SELECT id FROM users WHERE id=?', (self.owner,), True) and v != '':
+        if v != '' and not query_db('SELECT id FROM users WHERE id=?', (v,), True):
             raise ValueError(f"No user with id #{v} has been found")
         self._owner = v
 
@@ -1973,6 +4172,7 @@ def check_calendar_access(access: str, account: User, write: bool = False) -> bo
 
 
 class CalendarEvent:
+    __slots__ = ('_id', '_calendar', '_title', '_description', '_start', '_end', '_color', '_schulnetz')
 
     def __init__(self, id_: str = None, calendar: str = '', title: str = '', description: str = '',
                  start: datetime = None, end: datetime = None, color: str = '', schulnetz: str = ''):
@@ -1980,12 +4180,12 @@ class CalendarEvent:
         self._calendar = ''
         self._title = ''
         self._description = ''
-        self._start = ''
-        self._end = ''
+        self._start = 0
+        self._end = 0
         self._color = ''
         self._schulnetz = ''
         if id_ is None:
-            id_ = rand_base64(14)
+            id_ = IDS.new(14)
         if start is None:
             start = datetime.now()
         if end is None:
@@ -2021,31 +4221,34 @@ class CalendarEvent:
         """
         if self._id is None:
             raise ValueError('No CalendarEvent id')
-        if not query_db('SELECT id FROM calendar_events WHERE id=?', (self._id,), True):
-            query_db('INSERT INTO calendar_events VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
-                self._id,
-                self._calendar,
-                self._title,
-                self._description,
-                self._start,
-                self._end,
-                self._color,
-                self._schulnetz,
-            ))
-        else:
-            query_db('UPDATE calendar_events SET calendar=?, title=?, description=?, start=?, end=?, color=?,'
-                     ' schulnetz=? WHERE id=?', (
-                         self._calendar,
-                         self._title,
-                         self._description,
-                         self._start,
-                         self._end,
-                         self._color,
-                         self._schulnetz,
-                         self._id,
-                     ))
+        with transaction():
+            if not query_db('SELECT id FROM calendar_events WHERE id=?', (self._id,), True):
+                query_db('INSERT INTO calendar_events VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                    self._id,
+                    self._calendar,
+                    self._title,
+                    self._description,
+                    self._start,
+                    self._end,
+                    self._color,
+                    self._schulnetz,
+                ))
+            else:
+                query_db('UPDATE calendar_events SET calendar=?, title=?, description=?, start=?, end=?, color=?,'
+                         ' schulnetz=? WHERE id=?', (
+                             self._calendar,
+                             self._title,
+                             self._description,
+                             self._start,
+                             self._end,
+                             self._color,
+                             self._schulnetz,
+                             self._id,
+                         ))
+        identity_discard(self)
 
     @staticmethod
+    @identity_mapped
     def load(calendar_event_id):
         """
         loads a CalendarEvent from the database
@@ -2055,14 +4258,41 @@ class CalendarEvent:
         result = query_db('SELECT * FROM calendar_events WHERE id=?', (calendar_event_id,), True)
         if not result:
             raise KeyError(f"No CalendarEvent with id #{calendar_event_id} has been found")
-        calendar_event = CalendarEvent(id_=result[0])
-        calendar_event._calendar = result[1]
-        calendar_event._title = result[2]
-        calendar_event._description = result[3]
-        calendar_event._start = result[4]
-        calendar_event._end = result[5]
-        calendar_event._color = result[6]
-        calendar_event._schulnetz = result[7]
+        return CalendarEvent._from_row(result)
+
+    @staticmethod
+    def load_range(calendar_ids: list, after: int = None, before: int = None) -> list:
+        """
+        loads the events of several calendars which overlap a period, in a single query
+        :param calendar_ids: list of Calendar ids
+        :param after: only events which end at or after this timestamp
+        :param before: only events which start before this timestamp
+        :return: list of CalendarEvents ordered by their start
+        """
+        result = query_db('SELECT * FROM calendar_events WHERE calendar IN (SELECT value FROM json_each(?)) AND '
+                          'start < ? AND end >= ? ORDER BY start', (
+                              dumps(calendar_ids),
+                              before if before is not None else 1 << 62,
+                              after if after is not None else -1 << 62,
+                          ))
+        return [CalendarEvent._from_row(i) for i in result]
+
+    @staticmethod
+    def _from_row(row):
+        """
+        creates a CalendarEvent from a row of the calendar_events table without running the setters
+        :param row: the row
+        :return: a new CalendarEvent instance
+        """
+        calendar_event = CalendarEvent.__new__(CalendarEvent)
+        calendar_event._id = row[0]
+        calendar_event._calendar = row[1]
+        calendar_event._title = row[2]
+        calendar_event._description = row[3]
+        calendar_event._start = row[4]
+        calendar_event._end = row[5]
+        calendar_event._color = row[6]
+        calendar_event._schulnetz = row[7]
         return calendar_event
 
     @property
@@ -2079,7 +4309,7 @@ class CalendarEvent:
 
     @calendar.setter
     def calendar(self, v: str) -> None:
-        if not query_db('SELECT id FROM calendars WHERE id=?', (self._id,), True):
+        if v != '' and not query_db('SELECT id FROM calendars WHERE id=?', (v,), True):
             raise ValueError(f"No Calendar with the id #{v} has been found")
         self._calendar = v
 
@@ -2091,101 +4321,660 @@ class CalendarEvent:
     def title(self, v: str) -> None:
         self._title = v
 
-    @property
-    def description(self) -> str:
-        return self._description
+    @property
+    def description(self) -> str:
+        return self._description
+
+    @description.setter
+    def description(self, v: str) -> None:
+        self._description = v
+
+    @property
+    def start(self) -> datetime:
+        return from_epoch(self._start)
+
+    @start.setter
+    def start(self, v: datetime) -> None:
+        self._start = to_epoch(v)
+
+    @property
+    def end(self) -> datetime:
+        return from_epoch(self._end)
+
+    @end.setter
+    def end(self, v: datetime) -> None:
+        self._end = to_epoch(v)
+
+    @property
+    def color(self) -> str:
+        return self._color
+
+    @color.setter
+    def color(self, v: str) -> None:
+        self._color = v
+
+    @property
+    def schulnetz(self) -> str:
+        return self._schulnetz
+
+    @schulnetz.setter
+    def schulnetz(self, v: str) -> None:
+        self._schulnetz = v
+
+
+########################################################################################################################
+# DECORATORS
+########################################################################################################################
+
+
+def login_required(func):
+    def wrapper(*args, **kwargs):
+        r = {'error': 'account required'}, 401
+        if is_signed_in():
+            return func(*args, **kwargs)
+        return r
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def blob_upload(max_size: int):
+    """
+    Streams the files uploaded to a route into the blob store, see BlobRequest
+    :param max_size: the maximum size of the request in bytes, larger requests are answered with 413
+    :return: the decorator
+    """
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            request.max_content_length = max_size
+            g.blob_upload = max_size
+            return func(*args, **kwargs)
+
+        wrapper.__name__ = func.__name__
+        return wrapper
+
+    return decorator
+
+
+def premium_required(func):
+    def wrapper(*args, **kwargs):
+        r = {
+            'error': 'premium required',
+            'message': 'Premium subscription or above is required.',
+        }, 401
+        if 'account' in session:
+            try:
+                paid, _ = entitlements(session_user())
+            except Exception as error:
+                log_exception('An error occurred while loading the account data' + 0 * str(error))
+                return r
+            if paid:
+                return func(*args, **kwargs)
+        return r
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def premium_lite_required(func):
+    def wrapper(*args, **kwargs):
+        r = {
+            'error': 'premium lite required',
+            'message': 'Premium Lite subscription or above is required.',
+        }, 401
+        if 'account' in session:
+            try:
+                paid, paid_lite = entitlements(session_user())
+            except Exception as error:
+                log_exception('An error occurred while loading the account data' + 0 * str(error))
+                return r
+            if paid or paid_lite:
+                return func(*args, **kwargs)
+        return r
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def admin_required(func):
+    def wrapper(*args, **kwargs):
+        r = {
+            'error': 'admin required',
+            'message': 'Administrator privileges are required.',
+        }, 403
+        if 'account' in session:
+            try:
+                user: User = Login.load(session['account']).get_account()
+            except Exception as error:
+                log_exception('An error occurred while loading the account data' + 0 * str(error))
+                return r
+            if user.mail in [i.strip() for i in environ.get('KSALP_ADMINS', '').split(',') if i.strip()]:
+                return func(*args, **kwargs)
+        return r
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+########################################################################################################################
+# BLOBS
+########################################################################################################################
+
+
+BLOBS_PATH = 'files/blobs'
+BLOB_CHUNK_SIZE = 1 << 16
+BLOB_GRACE_PERIOD = 86400
+BLOB_TOUCH = (
+    'INSERT INTO blobs (hash, size, refs, updated) VALUES (?, ?, 0, ?) '
+    'ON CONFLICT (hash) DO UPDATE SET updated = excluded.updated'
+)
+
+
+class BlobUpload:
+    """
+    The target of an uploaded file: writes it to a temporary file in the blob store while computing its SHA-256, and
+    refuses to grow beyond `max_size` bytes unless that is 0. The temporary file is deleted as soon as the limit is
+    exceeded, and otherwise when the request ends unless it was moved into the store.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self._file = NamedTemporaryFile('w+b', dir=directory, prefix='.upload-', delete=False)
+        self._max_size = max_size
+        self._hash = sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self._max_size and self.size > self._max_size:
+            self.close()
+            raise RequestEntityTooLarge()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name: str) -> t.Any:
+        return getattr(self._file, name)
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        return iter(self._file)
+
+    @property
+    def digest(self) -> str:
+        """
+        The SHA-256 of the data written so far
+        :return: the hex digest
+        """
+        return self._hash.hexdigest()
+
+    def move(self, path: str) -> None:
+        """
+        Moves the file to its place in the store
+        :param path: the final path
+        :return: None
+        """
+        self._file.flush()
+        fsync(self._file.fileno())
+        self._file.close()
+        os_replace(self._file.name, path)
+        self._file = open(path, 'rb')
+
+    def close(self) -> None:
+        self._file.close()
+        if basename(self._file.name).startswith('.upload-'):
+            try:
+                remove(self._file.name)
+            except FileNotFoundError:
+                pass
+
+
+class BlobRequest(Request):
+    """
+    Hands the files of routes decorated with blob_upload to a BlobUpload instead of a spooled temporary file, so the
+    upload is hashed while it arrives and written only once
+    """
+
+    def _get_file_stream(self, total_content_length: t.Optional[int], content_type: t.Optional[str],
+                         filename: t.Optional[str] = None, content_length: t.Optional[int] = None) -> t.IO[bytes]:
+        if g.get('blob_upload'):
+            upload = BlobUpload(BLOBS.path, g.blob_upload)
+            # the parser drops the file when the upload fails half-way, so the request has to remember it
+            g.setdefault('blob_uploads', []).append(upload)
+            return upload
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+app.request_class = BlobRequest
+
+
+@app.teardown_request
+def close_blob_uploads(_=None) -> None:
+    for upload in g.pop('blob_uploads', []):
+        upload.close()
+
+
+class BlobStore:
+    """
+    Keeps files by the SHA-256 of their content under `path`/<first two hex digits>/<hash>, so identical uploads are
+    stored once. The blobs table counts the documents referring to each blob through triggers. Storing takes a shared
+    flock on the store and collecting garbage an exclusive one, so a blob cannot be deleted between an upload finding
+    it and the commit of the document that refers to it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.stored = 0
+        self.deduplicated = 0
+        self._lock = Lock()
+
+    def file(self, blob: str) -> str:
+        """
+        Gets the path of a blob relative to the store
+        :param blob: the hash
+        :return: the relative path
+        """
+        return join(blob[:2], blob)
+
+    @contextmanager
+    def _locked(self, operation: int) -> t.Iterator[None]:
+        Path(self.path).mkdir(parents=True, exist_ok=True)
+        with open(join(self.path, '.lock'), 'a') as file:
+            flock(file, operation)
+            yield
+
+    @contextmanager
+    def store(self, upload: t.BinaryIO) -> t.Iterator[str]:
+        """
+        Stores an uploaded file; the enclosed block should save the records referring to the blob, which happens in the
+        same transaction as recording the blob
+        :param upload: the uploaded file, ideally a BlobUpload
+        :return: the hash of the blob
+        """
+        if not isinstance(upload, BlobUpload):
+            upload.seek(0)
+            copy = BlobUpload(self.path, 0)
+            copyfileobj(upload, copy, BLOB_CHUNK_SIZE)
+            upload = copy
+        blob = upload.digest
+        with self._locked(LOCK_SH), transaction():
+            query_db(BLOB_TOUCH, (blob, upload.size, to_epoch(datetime.now())))
+            path = join(self.path, self.file(blob))
+            if exists(path):
+                upload.close()
+                counter = 'deduplicated'
+            else:
+                Path(dirname(path)).mkdir(exist_ok=True)
+                upload.move(path)
+                counter = 'stored'
+            yield blob
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def collect(self) -> int:
+        """
+        Deletes the blobs which no document has referred to for BLOB_GRACE_PERIOD seconds, and the temporary files of
+        uploads which are older than that, e.g. left behind by a worker that was killed
+        :return: the number of deleted files
+        """
+        cutoff = to_epoch(datetime.now()) - BLOB_GRACE_PERIOD
+        with self._locked(LOCK_EX):
+            with transaction():
+                blobs = query_db('DELETE FROM blobs WHERE refs = 0 AND updated < ? RETURNING hash', (cutoff,))
+            paths = [join(self.path, self.file(blob[0])) for blob in blobs]
+            paths += [join(self.path, i) for i in listdir(self.path) if i.startswith('.upload-')]
+            deleted = 0
+            for path in paths:
+                try:
+                    if basename(path).startswith('.upload-') and os_stat(path).st_mtime >= cutoff:
+                        # an upload which is still running
+                        continue
+                    remove(path)
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        return deleted
+
+    def stats(self) -> dict[str, int]:
+        """
+        Counts the uploads of this worker
+        :return: the counters
+        """
+        with self._lock:
+            return {'stored': self.stored, 'deduplicated': self.deduplicated}
+
+
+BLOBS = BlobStore(relative_path(BLOBS_PATH))
+DOCUMENT_MAX_SIZE = env_int('DOCUMENT_MAX_SIZE', 64 << 20)
+
+
+########################################################################################################################
+# FAVICONS
+########################################################################################################################
+
+
+FAVICONS_PATH = 'favicons'
+FAVICON_MAX_AGE = 604800
+FAVICON_EMPTY = '_empty.png'
+FAVICON_EMPTY_MAX_AGE = 3600
+FAVICON_LOCK_PATH = environ.get('FAVICON_LOCK_PATH') or f"{DATABASE_PATH}-favicons"
+FAVICON_LOCK_STRIPES = 4096
+FAVICON_LOCK_POLL_INTERVAL = 0.05
+FAVICON_MAP_THREADS = 4
+FAVICON_WARM_QUEUE_SIZE = 16
+
+
+class FaviconIndex:
+    """
+    Maps hostnames to the stored favicon files. Every worker keeps the index in memory and rebuilds it when the
+    modification time of the favicon directory changes, which happens whenever any worker stores a new icon, so a
+    lookup costs a stat instead of a directory listing. The ETag of a file is a hash of its contents, computed once per
+    version of the file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._files: dict[str, str] = {}
+        self._etags: dict[str, tuple[int, str]] = {}
+        self._mtime = None
+        self._lock = Lock()
+
+    def _refresh(self) -> None:
+        mtime = os_stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        files = {}
+        for file in sorted(listdir(self.path)):
+            if file.startswith('.'):
+                # downloads which are still being written
+                continue
+            files.setdefault(file.rsplit('.', 1)[0].lower(), file)
+        with self._lock:
+            self._files = files
+            self._mtime = mtime
+
+    def get(self, hostname: str) -> t.Optional[str]:
+        """
+        Finds the favicon of a website
+        :param hostname: the hostname of the website
+        :return: the file name or None if no icon is stored
+        """
+        self._refresh()
+        return self._files.get(hostname.lower())
 
-    @description.setter
-    def description(self, v: str) -> None:
-        self._description = v
+    def etag(self, file: str) -> str:
+        """
+        Gets the strong ETag of a favicon file
+        :param file: the file name
+        :return: the ETag
+        """
+        mtime = os_stat(join(self.path, file)).st_mtime_ns
+        cached = self._etags.get(file)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(join(self.path, file), 'rb') as icon:
+            etag = blake2b(icon.read(), digest_size=16).hexdigest()
+        with self._lock:
+            self._etags[file] = (mtime, etag)
+        return etag
 
-    @property
-    def start(self) -> datetime:
-        return datetime.strptime(self._start, DATE_FORMAT)
 
-    @start.setter
-    def start(self, v: datetime) -> None:
-        self._start = v.strftime(DATE_FORMAT)
+FAVICONS = FaviconIndex(relative_path(FAVICONS_PATH))
 
-    @property
-    def end(self) -> datetime:
-        return datetime.strptime(self._end, DATE_FORMAT)
 
-    @end.setter
-    def end(self, v: datetime) -> None:
-        self._end = v.strftime(DATE_FORMAT)
+def favicon_response(file: str, max_age: int = FAVICON_MAX_AGE) -> Response:
+    """
+    Sends a stored favicon, answering revalidations with 304
+    :param file: the file name
+    :param max_age: seconds browsers may use the icon without asking again
+    :return: the response
+    """
+    resp = send_from_directory(relative_path(FAVICONS_PATH), file, etag=FAVICONS.etag(file), max_age=max_age)
+    extension = file.rsplit('.', 1)[-1].upper()
+    if extension in EXTENSIONS_REVERSE:
+        resp.mimetype = EXTENSIONS_REVERSE[extension]
+    # the route requires a signed-in user, so shared caches must not keep the icon
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
 
-    @property
-    def color(self) -> str:
-        return self._color
 
-    @color.setter
-    def color(self, v: str) -> None:
-        self._color = v
+class FaviconFetcher:
+    """
+    Downloads missing favicons from FAVICON_API through one pooled HTTP session per worker, with every request bounded
+    by `timeout` seconds. Hostnames without an icon, or whose download failed, are remembered in the shared cache for
+    `negative_ttl` seconds so that no worker asks again before then. Downloads of the same hostname are serialized by
+    one of FAVICON_LOCK_STRIPES lock files in `lock_path`: whoever waited for the lock finds the icon stored or the miss
+    remembered and does not fetch again. Nobody waits longer than `timeout` seconds for the lock; the icon is then
+    shown as missing for this request only.
+    """
 
-    @property
-    def schulnetz(self) -> str:
-        return self._schulnetz
+    def __init__(self, index: FaviconIndex, lock_path: str, timeout: int, negative_ttl: int) -> None:
+        self._index = index
+        self._lock_path = lock_path
+        self._timeout = timeout
+        self._negative_ttl = negative_ttl
+        self._session = None
+        self._pid = None
+        self._lock = Lock()
+        self.fetched = 0
+        self.failed = 0
+        self.negative_hits = 0
+        self.coalesced = 0
+        self.busy = 0
+
+    def _open(self) -> None:
+        with self._lock:
+            if self._pid == getpid():
+                return
+            # the connections of the parent process must not be shared
+            self._session = RequestsSession()
+            self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=8))
+            self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=8))
+            Path(self._lock_path).mkdir(parents=True, exist_ok=True)
+            self._pid = getpid()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @contextmanager
+    def _single_flight(self, hostname: str) -> t.Iterator[bool]:
+        stripe = int.from_bytes(blake2b(hostname.encode(), digest_size=4).digest(), 'big') % FAVICON_LOCK_STRIPES
+        with open(join(self._lock_path, f"host-{stripe}"), 'a') as file:
+            deadline = perf_counter() + self._timeout
+            while True:
+                try:
+                    flock(file, LOCK_EX | LOCK_NB)
+                except BlockingIOError:
+                    if perf_counter() >= deadline:
+                        yield False
+                        return
+                    sleep(FAVICON_LOCK_POLL_INTERVAL)
+                    continue
+                yield True
+                return
+
+    def _known(self, hostname: str) -> t.Optional[str]:
+        file = self._index.get(hostname)
+        if file is not None:
+            return file
+        if SHARED_CACHE.get('favicon-miss', hostname) is not None:
+            self._count('negative_hits')
+            return FAVICON_EMPTY
+        return None
+
+    def _download(self, hostname: str) -> t.Optional[str]:
+        try:
+            response = self._session.get(f"{environ['FAVICON_API']}{hostname}?s=256", timeout=self._timeout)
+        except RequestException as error:
+            log_exception('The favicon could not be downloaded' + 0 * str(error))
+            return None
+        if response.status_code != 200 or not response.content:
+            return None
+        mimetype = response.headers.get('Content-Type', 'image/x-icon').split(';', 1)[0].strip()
+        file = f"{hostname}.{EXTENSIONS.get(mimetype, 'ICO').lower()}"
+        path = join(self._index.path, file)
+        temporary = join(self._index.path, f".{file}.{getpid()}")
+        with open(temporary, 'wb') as new_file:
+            new_file.write(response.content)
+        os_replace(temporary, path)
+        return file
+
+    def get(self, hostname: str) -> str:
+        """
+        Finds the favicon of a website, downloading it if no worker has tried recently
+        :param hostname: the hostname of the website
+        :return: the file name, FAVICON_EMPTY if the website has no icon
+        """
+        file = self._known(hostname)
+        if file is not None:
+            return file
+        self._open()
+        with self._single_flight(hostname) as locked:
+            file = self._known(hostname)
+            if file is not None:
+                self._count('coalesced')
+                return file
+            if not locked:
+                # another worker is still downloading it
+                self._count('busy')
+                return FAVICON_EMPTY
+            file = self._download(hostname)
+            if file is None:
+                self._count('failed')
+                SHARED_CACHE.set('favicon-miss', hostname, 1, self._negative_ttl)
+                return FAVICON_EMPTY
+        self._count('fetched')
+        return file
+
+    def stats(self) -> dict[str, int]:
+        """
+        Counts the downloads of this worker
+        :return: the counters
+        """
+        with self._lock:
+            return {
+                'fetched': self.fetched,
+                'failed': self.failed,
+                'negative_hits': self.negative_hits,
+                'coalesced': self.coalesced,
+                'busy': self.busy,
+            }
 
-    @schulnetz.setter
-    def schulnetz(self, v: str) -> None:
-        self._schulnetz = v
 
+FAVICON_FETCHER = FaviconFetcher(FAVICONS, FAVICON_LOCK_PATH, env_int('FAVICON_TIMEOUT', 5),
+                                 env_int('FAVICON_NEGATIVE_TTL', 86400))
 
-########################################################################################################################
-# DECORATORS
-########################################################################################################################
 
+def favicon_hostname(url: str) -> str:
+    """
+    Extracts the hostname whose favicon is shown for a link
+    :param url: the link, with or without scheme
+    :return: the lower-cased hostname, empty if there is none
+    """
+    url = url.strip()
+    if not url.startswith('http'):
+        url = f"http://{url}"  # noqa
+    if url.count('/') < 3:
+        url += '/'
+    return urlparse(url.lower()).netloc
 
-def login_required(func):
-    def wrapper(*args, **kwargs):
-        r = {'error': 'account required'}, 401
-        if is_signed_in():
-            return func(*args, **kwargs)
-        return r
 
-    wrapper.__name__ = func.__name__
-    return wrapper
+def favicon_map(favorites: list[str], threads: int = FAVICON_MAP_THREADS) -> dict[str, str]:
+    """
+    Collects the favicons of a list of favorites as data URIs, downloading missing icons in parallel. The result is
+    kept in the shared cache under a hash of the list, for as long as browsers may keep its shortest-lived icon.
+    :param favorites: the favorites of a user, each `url | title`
+    :param threads: the number of icons downloaded at once
+    :return: the data URIs by url
+    """
+    key = blake2b('\n'.join(favorites).encode(), digest_size=16).hexdigest()
+    cached = SHARED_CACHE.get('favicon-map', key)
+    if cached is not None:
+        return cached
+    urls = sorted({i.split('|', 1)[0].strip() for i in favorites} - {''})
+    hostnames = [favicon_hostname(url) for url in urls]
+    def fetch(hostname: str) -> str:
+        return FAVICON_FETCHER.get(hostname) if hostname else FAVICON_EMPTY
+
+    if threads > 1 and len(urls) > 1:
+        with ThreadPoolExecutor(min(threads, len(urls))) as executor:
+            files = list(executor.map(fetch, hostnames))
+    else:
+        files = [fetch(hostname) for hostname in hostnames]
+    result = {}
+    for url, file in zip(urls, files):
+        with open(relative_path(join(FAVICONS_PATH, file)), 'rb') as icon:
+            content = b64encode(icon.read()).decode()
+        mimetype = EXTENSIONS_REVERSE.get(file.rsplit('.', 1)[-1].upper(), 'image/x-icon')
+        result[url] = f"data:{mimetype};base64,{content}"
+    SHARED_CACHE.set('favicon-map', key, result, FAVICON_EMPTY_MAX_AGE if FAVICON_EMPTY in files else FAVICON_MAX_AGE)
+    return result
+
+
+class FaviconWarmer:
+    """
+    Builds favicon maps ahead of the next page view in one background thread per worker, one icon after the other.
+    Lists are queued without blocking and dropped once `capacity` are waiting; the page view then builds the map
+    itself.
+    """
 
+    def __init__(self, capacity: int) -> None:
+        self._capacity = capacity
+        self._queue = Queue(capacity)
+        self._pid = None
+        self._lock = Lock()
+        self.warmed = 0
+        self.dropped = 0
 
-def premium_required(func):
-    def wrapper(*args, **kwargs):
-        r = {
-            'error': 'premium required',
-            'message': 'Premium subscription or above is required.',
-        }, 401
-        if 'account' in session:
+    def put(self, favorites: list[str]) -> None:
+        """
+        Queues a list of favorites without blocking
+        :param favorites: the favorites of a user
+        :return:
+        """
+        if self._pid != getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(favorites)
+        except Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._pid == getpid():
+                return
+            # a forked worker must not inherit the queue of its parent
+            self._queue = Queue(self._capacity)
+            self._pid = getpid()
+            Thread(target=self._run, args=(self._queue,), name='favicon-warmer', daemon=True).start()
+
+    def _run(self, queue: Queue) -> None:
+        while True:
+            favorites = queue.get()
             try:
-                user: User = Login.load(session['account']).get_account()
-            except Exception as error:
-                log_exception('An error occurred while loading the account data' + 0 * str(error))
-                return r
-            if user.valid_payment():
-                return func(*args, **kwargs)
-        return r
+                favicon_map(favorites, 1)
+                self.warmed += 1
+            except (OSError, RequestException) as error:
+                log_exception('The favicons of the favorites could not be prepared' + 0 * str(error))
 
-    wrapper.__name__ = func.__name__
-    return wrapper
+    def stats(self) -> dict[str, int]:
+        """
+        Counters of this worker
+        :return: the counters
+        """
+        return {'warmed': self.warmed, 'dropped': self.dropped, 'queued': self._queue.qsize()}
 
 
-def premium_lite_required(func):
-    def wrapper(*args, **kwargs):
-        r = {
-            'error': 'premium lite required',
-            'message': 'Premium Lite subscription or above is required.',
-        }, 401
-        if 'account' in session:
-            try:
-                user: User = Login.load(session['account']).get_account()
-            except Exception as error:
-                log_exception('An error occurred while loading the account data' + 0 * str(error))
-                return r
-            if user.valid_payment() or user.valid_payment_lite():
-                return func(*args, **kwargs)
-        return r
+FAVICON_WARMER = FaviconWarmer(FAVICON_WARM_QUEUE_SIZE)
 
-    wrapper.__name__ = func.__name__
-    return wrapper
+
+def warm_favicon_map(favorites: list[str]) -> None:
+    """
+    Builds the favicon map of a list of favorites in the background, so the next page view finds it cached
+    :param favorites: the favorites of a user
+    :return: None
+    """
+    FAVICON_WARMER.put(favorites)
 
 
 ########################################################################################################################
@@ -2193,11 +4982,60 @@ def premium_lite_required(func):
 ########################################################################################################################
 
 
+REQUEST_TIERS_PUBLIC = ('/api/v1/constants', '/api/v1/news/')
+REQUEST_TIERS = {'asset': 0, 'public': 0, 'full': 0}
+REQUEST_TIERS_LOCK = Lock()
+
+
+def request_tier(path: str) -> str:
+    """
+    Classifies a request by the work it needs before it is handled
+    :param path: the request path
+    :return: `asset` for static and bundle files, which skip the rate limit, the IP score, the session and the access
+        log; `public` for the pages of the app and cacheable API responses, which skip the session; `full` for
+        everything else
+    """
+    if path.startswith('/static/'):
+        return 'asset'
+    if path.startswith(('/api/', '/dateien/')):
+        return 'public' if path.startswith(REQUEST_TIERS_PUBLIC) else 'full'
+    return 'asset' if '.' in path.rsplit('/', 1)[-1] else 'public'
+
+
+class TieredSessionInterface(SecureCookieSessionInterface):
+    """
+    Leaves the session cookie alone outside the full tier, so asset and public responses carry no Set-Cookie header
+    and can be cached
+    """
+
+    def should_set_cookie(self, app_: Flask, session_) -> bool:
+        return g.get('tier', 'full') == 'full' and super().should_set_cookie(app_, session_)
+
+
+app.session_interface = TieredSessionInterface()
+
+
 @app.before_request
 def before_request():
-    session.permanent = True
-    app.permanent_session_lifetime = timedelta(days=92)
-    score = scan_request()
+    tier = request_tier(request.path)
+    g.tier = tier
+    with REQUEST_TIERS_LOCK:
+        REQUEST_TIERS[tier] += 1
+    if tier == 'asset':
+        return
+    MAIL_SENDER.start()
+    retry_after = RATE_LIMITER.check(request.access_route[-1], request.path)
+    if retry_after:
+        return {
+            'error': 'too many requests',
+            'message': 'Too many requests, please try again later.',
+        }, 429, {'Retry-After': str(retry_after)}
+    if tier == 'public':
+        score = scan_request(False)
+    else:
+        session.permanent = True
+        app.permanent_session_lifetime = timedelta(days=92)
+        score = scan_request()
     if score == 0:
         return render_template('_banned.html', ip=request.access_route[-1]), 403
 
@@ -2218,7 +5056,10 @@ def r_dateien_dokumente(id_: str, name: str):
         return 'Dokument konnte nicht gefunden werden', 404
     if not result:
         return 'Dokument konnte nicht gefunden werden', 404
-    resp = make_response(send_from_directory(join(app.root_path, 'files'), f"{id_}.{result.extension}"))
+    if result.blob:
+        resp = make_response(send_from_directory(BLOBS.path, BLOBS.file(result.blob), etag=result.blob))
+    else:
+        resp = make_response(send_from_directory(join(app.root_path, 'files'), f"{id_}.{result.extension}"))
     resp.headers['Content-Disposition'] = f"inline; filename={name}"
     resp.mimetype = result.mimetype
     return resp
@@ -2226,10 +5067,7 @@ def r_dateien_dokumente(id_: str, name: str):
 
 @app.route('/dateien/lernsets/<string:id_>/<string:name>', methods=['GET'])
 def r_dateien_lernsets(id_: str, name: str):
-    db_result = query_db('SELECT * FROM learn_exercises WHERE set_id=?', (id_,))
-    result = []
-    for i in db_result:
-        result.append(LearnExercise.load(i[0]).__dict__())
+    result = [i.__dict__() for i in LearnExercise.load_by_sets([id_])]
     resp = make_response(dumps(result))
     resp.headers['Content-Disposition'] = f"inline; filename={name}"
     resp.mimetype = 'application/json'
@@ -2254,67 +5092,86 @@ def r_api_v1_account():
 @app.route('/api/v1/favicon/<path:path>')
 @login_required
 def r_api_v1_favicon(path: str):
-    if not path.startswith('http'):
-        path = f"http://{path}"  # noqa
-    if path.count('/') < 3:
-        path += '/'
-    path = path.lower()
-    parsed_uri = urlparse(path)
-    website = parsed_uri.netloc
-    for file in listdir(relative_path('favicons/')):
-        if file.rsplit('.', 1)[0].lower() == website.lower():
-            resp = send_from_directory(relative_path('favicons'), file)
-            extension = file.split('.')[-1]
-            if extension in EXTENSIONS_REVERSE:
-                resp.mimetype = EXTENSIONS_REVERSE[extension.upper()]
-            return resp
-    if website:
-        response = requests_send('GET', f"{environ['FAVICON_API']}{website}?s=256")
-        mimetype = response.headers.get('Content-Type', 'image/x-icon')
-        content = response.content
-        if response.status_code == 200:
-            with open(relative_path(f"favicons/{website}.{EXTENSIONS.get(mimetype, 'ICO').lower()}"), 'wb') as new_file:
-                new_file.write(content)
-            resp = Response(content, 200)
-            resp.mimetype = mimetype
-            return resp
-    resp = send_from_directory(relative_path('favicons'), '_empty.png')
-    resp.mimetype = EXTENSIONS_REVERSE['PNG']
-    return resp
+    website = favicon_hostname(path)
+    if not website:
+        return favicon_response(FAVICON_EMPTY, FAVICON_EMPTY_MAX_AGE)
+    file = FAVICON_FETCHER.get(website)
+    if file == FAVICON_EMPTY:
+        return favicon_response(FAVICON_EMPTY, FAVICON_EMPTY_MAX_AGE)
+    return favicon_response(file)
 
 
-@app.route('/api/v1/qrbill/<product>', methods=['GET'])
+@app.route('/api/v1/favicons', methods=['GET'])
 @login_required
-def r_api_v1_qrbill(product: str):
-    if (product not in PRICES.keys()) or (product not in PRODUCTS.keys()):
-        return {
-            'error': 'not found',
-            'message': 'The product was not found.',
-        }, 404
-    account = Login.load(session['account']).get_account()
+def r_api_v1_favicons():
+    favicons = favicon_map(User.load(session_user()).favorites)
+    resp = make_response({
+        'status': 'success',
+        'message': 'Favicons retrieved successfully.',
+        'favicons': favicons,
+    })
+    resp.set_etag(blake2b(dumps(favicons, sort_keys=True).encode(), digest_size=16).hexdigest())
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+
+@lru_cache(env_int('QRBILL_CACHE_SIZE', 256))
+def render_qrbill(product: str, mail: str, number: str, account: str, name: str, postcode: str,
+                  city: str) -> tuple[str, str]:
+    """
+    Draws the QR bill of a product for an account
+    :param product: the product
+    :param mail: the e-mail address of the account, printed on the bill
+    :param number: the payment reference number of the account and product
+    :param account: the IBAN of the creditor
+    :param name: the name of the creditor
+    :param postcode: the postcode of the creditor
+    :param city: the city of the creditor
+    :return: the SVG and its ETag
+    """
     bill = qrbill.QRBill(
-        account=environ['BILLING_ACCOUNT'].replace(' ', ''),
+        account=account.replace(' ', ''),
         creditor={
-            'name': environ['BILLING_NAME'],
-            'line1': environ['BILLING_POSTCODE'],
-            'line2': environ['BILLING_CITY'],
+            'name': name,
+            'line1': postcode,
+            'line2': city,
             'country': 'CH',
         },
         amount=PRICES[product],
-        additional_information=f"{PRODUCTS[product]} für {account.mail}",
+        reference_number=payment_reference(number, qr_iban(account)),
+        additional_information=f"{PRODUCTS[product]} für {mail}",
         language='de',
     )
-    temp_id = rand_base64(21)
-    bill.as_svg(relative_path(f"temp/qrbills/{temp_id}.svg"))
-    resp = make_response(send_from_directory(relative_path('temp/qrbills'), f"{temp_id}.svg"))
+    buffer = StringIO()
+    bill.as_svg(buffer)
+    svg = buffer.getvalue()
+    return svg, blake2b(svg.encode(), digest_size=16).hexdigest()
+
+
+@app.route('/api/v1/qrbill/<product>', methods=['GET'])
+@login_required
+def r_api_v1_qrbill(product: str):
+    if any(product not in i.keys() for i in (PRICES, PRODUCTS, PRODUCT_PAYMENTS)):
+        return {
+            'error': 'not found',
+            'message': 'The product was not found.',
+        }, 404
+    user_id = session_user()
+    svg, etag = render_qrbill(product, User.load(user_id).mail, payment_reference_for(user_id, product),
+                              environ['BILLING_ACCOUNT'], environ['BILLING_NAME'], environ['BILLING_POSTCODE'],
+                              environ['BILLING_CITY'])
+    resp = make_response(svg)
     resp.mimetype = 'image/svg+xml'
-    return resp
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
 
 
 @app.route('/api/v1/account/signin', methods=['POST'])
 def r_api_v1_account_signin():
     data = request.get_json(force=True, silent=True)
-    sleep(rand_uniform(0.1, 0.4))
     if (data is None) or (not isinstance(data, dict)):
         return {
             'error': 'json parse error',
@@ -2335,6 +5192,7 @@ def r_api_v1_account_signin():
         user = User.load(user_id)
     except (KeyError, TypeError) as error:
         log_exception('Email does not exist in users' + 0 * str(error))
+        PASSWORD_HASHER.imitate()
         return {
             'error': 'sign-in failed',
             'message': 'The combination of password and email does not exist.'
@@ -2344,9 +5202,16 @@ def r_api_v1_account_signin():
             'error': 'sign-in failed',
             'message': 'The combination of password and email does not exist.'
         }, 401
+    if user.hash_iterations != PASSWORD_HASHER.iterations:
+        # the hash was made with other parameters; the password is known now, so it can be upgraded
+        try:
+            user.set_password(data['password'])
+            user.save()
+        except HashingBusy as error:
+            log_exception('The password hash could not be upgraded' + 0 * str(error))
     login = Login(account=user.id_, browser=extract_browser(request.user_agent))
     login.save()
-    session['account'] = login.id_
+    start_session(login)
     return {
         'status': 'success',
         'message': 'You are now signed-in with cookies.'
@@ -2386,12 +5251,14 @@ def r_api_v1_account_register():
             'message': 'An account with this email address already exists.',
         }, 400
     salt = rand_salt()
+    iterations = PASSWORD_HASHER.iterations
+    hash_ = hash_password(data['password'], urlsafe_b64decode(salt), iterations)
     account = {'name': data['name'], 'classes': data['class_'].split(' '), 'grade': data['grade'],
                'mail': data['email'],
                'newsletter': data['newsletter'], 'salt': salt,
-               'hash_': urlsafe_b64encode(hash_password(data['password'], urlsafe_b64decode(salt))).decode()}
+               'hash_': urlsafe_b64encode(hash_).decode(),
+               'hash_iterations': iterations}
     mail = MailCheck(account=account, valid=datetime.now() + timedelta(minutes=15))
-    mail.save()
     mail_plain = f"""Guten Tag, {data['name']}
 
     Um die Registrierung bei ksalp.ch abzuschliessen, klicken Sie bitte auf den folgenden Link:
@@ -2408,8 +5275,10 @@ def r_api_v1_account_register():
     <p>Der Link ist für 15 Minuten gültig. Falls Sie sich nicht registriert haben, ignorieren Sie diese E-Mail.</p>
     <p>Das ksalp.ch Team wünscht Ihnen viel Erfolg beim Lernen.</p>
     """
-    result = send_mail(address=data['email'], subject='Registrierung bei ksalp.ch', message_plain=mail_plain,
-                       message=mail_html)
+    with transaction():
+        mail.save()
+        result = send_mail(address=data['email'], subject='Registrierung bei ksalp.ch', message_plain=mail_plain,
+                           message=mail_html)
     if result is not None:
         return {
             'error': 'exception during email delivery',
@@ -2470,9 +5339,11 @@ def r_api_v1_account_logout():
             'error': 'invalid account login',
             'message': 'The account login could not be found.',
         }
-    login.valid = datetime.now()
-    login.save()
-    session['account'] = ''
+    with transaction():
+        login.valid = datetime.now()
+        login.save()
+        revoke_login(login.id_)
+    end_session()
     return {
         'status': 'success',
         'message': 'Account logged out successfully.'
@@ -2664,9 +5535,14 @@ def r_api_v1_account_settings_password():
             'error': 'invalid password',
             'message': 'The old password is invalid.',
         }, 400
-    account.salt = rand_salt()
-    account.hash_ = hash_password(data['password'], account.salt)
-    account.save()
+    now = to_epoch(datetime.now())
+    with transaction():
+        account.set_password(data['password'])
+        account.save()
+        # every other session of the account is signed out
+        for login in query_db('UPDATE login SET valid=? WHERE account=? AND id!=? AND valid>? RETURNING id',
+                              (now, account.id_, session['account'], now)):
+            revoke_login(login[0])
     return {
         'status': 'success',
         'message': 'Password updated successfully.',
@@ -2717,6 +5593,7 @@ def r_api_v1_account_settings_favorites():
     account = Login.load(session['account']).get_account()
     account.favorites = [i.strip() for i in data['favorites'].split('\n') if ' | ' in i.strip()]
     account.save()
+    warm_favicon_map(account.favorites)
     return {
         'status': 'success',
         'message': 'Favorites settings updated successfully.',
@@ -2725,10 +5602,17 @@ def r_api_v1_account_settings_favorites():
 
 @app.route('/api/v1/documents/list', methods=['GET'])
 def r_api_v1_documents_list():
+    try:
+        since = parse_date_arg('since')
+    except ValueError as error:
+        log_exception('An invalid date has been requested' + 0 * str(error))
+        return {
+            'error': 'invalid date',
+            'message': f"`since` has to be in the format {DATE_FORMAT}.",
+        }, 400
     documents = []
-    result = query_db('SELECT id FROM documents')
-    for i in result:
-        document = Document.load(i[0]).__dict__()
+    for i in Document.load_all(since):
+        document = i.__dict__()
         document['created'] = document['created'].strftime(DATE_FORMAT)
         document['edited'] = document['edited'].strftime(DATE_FORMAT)
         documents.append(document)
@@ -2741,6 +5625,7 @@ def r_api_v1_documents_list():
 
 @app.route('/api/v1/documents/new/form', methods=['POST'])
 @login_required
+@blob_upload(DOCUMENT_MAX_SIZE)
 def r_api_v1_documents_new_form():
     form = dict(request.form)
     if 'file' not in request.files:
@@ -2779,10 +5664,10 @@ def r_api_v1_documents_new_form():
         mimetype=EXTENSIONS_REVERSE.get(extension.upper(), 'application/octet-stream'),
         size=0,
     )
-    file_path = join(app.root_path, 'files', document.id_ + '.' + extension)
-    file.save(file_path)
-    document.size = getsize(file_path)
-    document.save()
+    with BLOBS.store(file.stream) as blob:
+        document.blob = blob
+        document.size = file.stream.size
+        document.save()
     return {
         'status': 'success',
         'message': 'Document created successfully.',
@@ -2792,6 +5677,7 @@ def r_api_v1_documents_new_form():
 
 @app.route('/api/v1/documents/edit/form', methods=['POST'])
 @login_required
+@blob_upload(DOCUMENT_MAX_SIZE)
 def r_api_v1_documents_edit_form():
     form = dict(request.form)
     if 'file' not in request.files:
@@ -2839,10 +5725,10 @@ def r_api_v1_documents_edit_form():
     document.edited = datetime.now()
     document.extension = extension
     document.mimetype = EXTENSIONS_REVERSE.get(extension.upper(), 'application/octet-stream')
-    file_path = join(app.root_path, 'files', document.id_ + '.' + extension)
-    file.save(file_path)
-    document.size = getsize(file_path)
-    document.save()
+    with BLOBS.store(file.stream) as blob:
+        document.blob = blob
+        document.size = file.stream.size
+        document.save()
     return {
         'status': 'success',
         'message': 'Document created successfully.',
@@ -2852,7 +5738,7 @@ def r_api_v1_documents_edit_form():
 @app.route('/api/v1/documents/data/<document_id>', methods=['GET'])
 def r_api_v1_documents_data(document_id):
     try:
-        document = Document.load(document_id).__dict__()
+        document = Document.load_many([document_id])[0].__dict__()
     except Exception as error:
         log_exception('An error occurred while loading the requested document' + 0 * str(error))
         return {
@@ -2870,10 +5756,17 @@ def r_api_v1_documents_data(document_id):
 
 @app.route('/api/v1/learnsets/list', methods=['GET'])
 def r_api_v1_learnsets_list():
+    try:
+        since = parse_date_arg('since')
+    except ValueError as error:
+        log_exception('An invalid date has been requested' + 0 * str(error))
+        return {
+            'error': 'invalid date',
+            'message': f"`since` has to be in the format {DATE_FORMAT}.",
+        }, 400
     learnsets = []
-    result = query_db('SELECT id FROM learn_sets')
-    for i in result:
-        learnset = LearnSet.load(i[0]).__dict__()
+    for i in LearnSet.load_all(since):
+        learnset = i.__dict__()
         learnset['created'] = learnset['created'].strftime(DATE_FORMAT)
         learnset['edited'] = learnset['edited'].strftime(DATE_FORMAT)
         learnsets.append(learnset)
@@ -2935,17 +5828,20 @@ def r_api_v1_learnsets_new_form():
         created=datetime.now(),
         edited=datetime.now(),
     )
-    learnset.save()
-    for element in learnset_contents:
-        exercise = LearnExercise(
-            set_id=learnset.id_,
-            question=element['question'],
-            answer=element['answer'],
-            answers=element['answers'],
-            frequency=element['frequency'],
-            auto_check=element['auto_check'],
-        )
-        exercise.save()
+    exercise_ids = IDS.reserve(8, len(learnset_contents))
+    with transaction():
+        learnset.save()
+        for exercise_id, element in zip(exercise_ids, learnset_contents):
+            exercise = LearnExercise(
+                id_=exercise_id,
+                set_id=learnset.id_,
+                question=element['question'],
+                answer=element['answer'],
+                answers=element['answers'],
+                frequency=element['frequency'],
+                auto_check=element['auto_check'],
+            )
+            exercise.save()
     return {
         'status': 'success',
         'message': 'Learnset created successfully.',
@@ -3013,36 +5909,37 @@ def r_api_v1_learnsets_edit_form():
     learnset.grade = form['grade']
     learnset.language = form['language']
     learnset.edited = datetime.now()
-    learnset.save()
-    result1 = query_db('SELECT id FROM learn_exercises WHERE set_id=?', (learnset.id_,))
-    existing_exercises = [i[0] for i in result1]
-    for element in learnset_contents:
-        existing_id = query_db('SELECT id FROM learn_exercises WHERE set_id=? AND question=?',
-                               (learnset.id_, element['question']), True)
-        if existing_id and len(existing_id) > 0 and isinstance(existing_id[0], int):
-            exercise = LearnExercise.load(existing_id[0])
-            exercise.answer = element['answer']
-            exercise.answers = element['answers']
-            exercise.frequency = element['frequency']
-            exercise.auto_check = element['auto_check']
-            exercise.save()
-            while existing_id[0] in existing_exercises:
-                existing_exercises.remove(existing_id[0])
-        else:
-            exercise = LearnExercise(
-                set_id=learnset.id_,
-                question=element['question'],
-                answer=element['answer'],
-                answers=element['answers'],
-                frequency=element['frequency'],
-                auto_check=element['auto_check'],
-            )
-            exercise.save()
-    for element in existing_exercises:
-        try:
-            query_db('DELETE FROM learn_exercises WHERE id=? AND set_id=?', (element, learnset.id_))
-        except Exception as error:
-            log_exception('An error occurred while updating the learnset exercises' + 0 * str(error))
+    with transaction():
+        learnset.save()
+        result1 = query_db('SELECT id FROM learn_exercises WHERE set_id=?', (learnset.id_,))
+        existing_exercises = [i[0] for i in result1]
+        for element in learnset_contents:
+            existing_id = query_db('SELECT id FROM learn_exercises WHERE set_id=? AND question=?',
+                                   (learnset.id_, element['question']), True)
+            if existing_id and len(existing_id) > 0 and isinstance(existing_id[0], int):
+                exercise = LearnExercise.load(existing_id[0])
+                exercise.answer = element['answer']
+                exercise.answers = element['answers']
+                exercise.frequency = element['frequency']
+                exercise.auto_check = element['auto_check']
+                exercise.save()
+                while existing_id[0] in existing_exercises:
+                    existing_exercises.remove(existing_id[0])
+            else:
+                exercise = LearnExercise(
+                    set_id=learnset.id_,
+                    question=element['question'],
+                    answer=element['answer'],
+                    answers=element['answers'],
+                    frequency=element['frequency'],
+                    auto_check=element['auto_check'],
+                )
+                exercise.save()
+        for element in existing_exercises:
+            try:
+                query_db('DELETE FROM learn_exercises WHERE id=? AND set_id=?', (element, learnset.id_))
+            except Exception as error:
+                log_exception('An error occurred while updating the learnset exercises' + 0 * str(error))
     return {
         'status': 'success',
         'message': 'Learnset edited successfully.',
@@ -3052,7 +5949,7 @@ def r_api_v1_learnsets_edit_form():
 @app.route('/api/v1/learnsets/data/<learnset_id>', methods=['GET'])
 def r_api_v1_learnsets_data(learnset_id):
     try:
-        learnset = LearnSet.load(learnset_id).__dict__()
+        learnset = LearnSet.load_many([learnset_id])[0].__dict__()
     except Exception as error:
         log_exception('An error occurred while loading the requested learnset' + 0 * str(error))
         return {
@@ -3061,10 +5958,7 @@ def r_api_v1_learnsets_data(learnset_id):
         }, 404
     learnset['created'] = learnset['created'].strftime(DATE_FORMAT)
     learnset['edited'] = learnset['edited'].strftime(DATE_FORMAT)
-    exercises = []
-    for element in query_db('SELECT id FROM learn_exercises WHERE set_id=?', (learnset_id,)):
-        exercise = LearnExercise.load(element[0]).__dict__()
-        exercises.append(exercise)
+    exercises = [i.__dict__() for i in LearnExercise.load_by_sets([learnset_id])]
     return {
         'status': 'success',
         'message': 'learnset retrieved successfully.',
@@ -3078,8 +5972,11 @@ def r_api_v1_learnsets_bulk(learnset_ids):
     ids = learnset_ids.split('.')
     learnsets = []
     try:
-        for element in ids:
-            learnset = LearnSet.load(element).__dict__()
+        result = LearnSet.load_many(ids)
+        if len(result) != len(ids):
+            raise KeyError(f"Only {len(result)} of {len(ids)} LearnSets have been found")
+        for element in result:
+            learnset = element.__dict__()
             learnset['created'] = learnset['created'].strftime(DATE_FORMAT)
             learnset['edited'] = learnset['edited'].strftime(DATE_FORMAT)
             learnsets.append(learnset)
@@ -3089,20 +5986,13 @@ def r_api_v1_learnsets_bulk(learnset_ids):
             'error': 'learnsets not found',
             'message': 'The requested learnsets could not be found.',
         }, 404
-    exercises = []
-    for element_id in ids:
-        for element in query_db('SELECT id FROM learn_exercises WHERE set_id=?', (element_id,)):
-            exercise = LearnExercise.load(element[0]).__dict__()
-            exercises.append(exercise)
+    exercises = [i.__dict__() for i in LearnExercise.load_by_sets(ids)]
     stats = {}
     try:
         try:
             account = Login.load(session['account']).get_account()
-            for exercise in exercises:
-                result = query_db('SELECT id FROM learn_stats WHERE exercise_id=? AND owner=?',
-                                  (exercise['id_'], account.id_), True)
-                if result:
-                    stats[exercise['id_']] = LearnStat.load(result[0]).__dict__()
+            result = LearnStat.load_by_owner(account.id_, [i['id_'] for i in exercises])
+            stats = {key: value.__dict__() for key, value in result.items()}
         except KeyError:
             pass
     except Exception as error:
@@ -3154,22 +6044,25 @@ def r_api_v1_learnsets_answer(exercise_id: str):
 @app.route('/api/v1/calendars/list', methods=['GET'])
 @login_required
 def r_api_v1_calendars_list():
+    try:
+        after = parse_date_arg('from')
+        before = parse_date_arg('to')
+    except ValueError as error:
+        log_exception('An invalid date has been requested' + 0 * str(error))
+        return {
+            'error': 'invalid date',
+            'message': f"`from` and `to` have to be in the format {DATE_FORMAT}.",
+        }, 400
     account = Login.load(session['account']).get_account()
     result = query_db('SELECT id, access FROM calendars')
     accessible = [i[0] for i in result if check_calendar_access(i[1], account)]
     calendars = []
     for element in accessible:
         try:
-            calendars.append(Calendar.load(element[0]).__dict__())
+            calendars.append(Calendar.load(element).__dict__())
         except Exception as error:
             log_exception('An error occurred while loading the requested calendar' + 0 * str(error))
-    events = []
-    for calendar in calendars:
-        for event in query_db('SELECT id FROM calendar_events WHERE calendar=?', (calendar['id_'],)):
-            try:
-                events.append(CalendarEvent.load(event[0]).__dict__())
-            except Exception as error:
-                log_exception('An error occurred while loading the requested calendar' + 0 * str(error))
+    events = [i.__dict__() for i in CalendarEvent.load_range([i['id_'] for i in calendars], after, before)]
     return {
         'status': 'success',
         'message': 'Calendar events have been retrieved.',
@@ -3206,10 +6099,11 @@ def r_api_v1_calendars_selection_update():
             'message': 'At least one of the following required fields is missing: `value`',
         }, 415
     account = Login.load(session['account']).get_account()
-    query_db('DELETE FROM calendar_selections WHERE owner=?', (account.id_,))
-    for element in data['value']:
-        element_id = rand_base64(19)
-        query_db('INSERT INTO calendar_selections VALUES (?, ?, ?)', (element_id, account.id_, str(element)))
+    with transaction():
+        query_db('DELETE FROM calendar_selections WHERE owner=?', (account.id_,))
+        for element in data['value']:
+            element_id = IDS.new(19)
+            query_db('INSERT INTO calendar_selections VALUES (?, ?, ?)', (element_id, account.id_, str(element)))
     return {
         'status': 'success',
         'message': 'Calendar selections have been updated.',
@@ -3283,6 +6177,71 @@ def r_api_v1_news_list(file_name):
     }
 
 
+@app.route('/api/v1/admin/stats', methods=['GET'])
+@login_required
+@admin_required
+def r_api_v1_admin_stats():
+    return {
+        'status': 'success',
+        'message': 'Statistics retrieved successfully.',
+        'pid': getpid(),
+        'database': DATABASE.stats(),
+        'shared_cache': SHARED_CACHE.stats(),
+        'ip_scores': IP_SCORES.stats(),
+        'access_log': ACCESS_LOG.stats(),
+        'session_revocations': SESSION_REVOCATIONS.stats(),
+        'rate_limits': RATE_LIMITER.stats(),
+        'request_tiers': dict(REQUEST_TIERS),
+        'hashing': PASSWORD_HASHER.stats(),
+        'mail': MAIL_SENDER.stats(),
+        'favicons': FAVICON_FETCHER.stats(),
+        'favicon_warmer': FAVICON_WARMER.stats(),
+        'blobs': BLOBS.stats(),
+    }, 200
+
+
+@app.route('/api/v1/admin/payments/import', methods=['POST'])
+@login_required
+@admin_required
+def r_api_v1_admin_payments_import():
+    if 'file' not in request.files:
+        return {
+            'error': 'missing file',
+            'message': 'No file was uploaded.',
+        }, 415
+    try:
+        counts = import_payments(request.files['file'].stream)
+    except (ParseError, ValueError) as error:
+        log_exception('The bank statement could not be read' + 0 * str(error))
+        return {
+            'error': 'invalid statement',
+            'message': 'The file is not a readable camt.053 or camt.054 statement.',
+        }, 400
+    return {
+        'status': 'success',
+        'message': 'Payments imported successfully.',
+        'payments': counts,
+    }, 200
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def error_handler_request_entity_too_large(error: RequestEntityTooLarge):
+    log_exception('An upload exceeded the size limit' + 0 * str(error))
+    return {
+        'error': 'file too large',
+        'message': f"Uploads may not be larger than {request.max_content_length or 0} bytes.",
+    }, 413
+
+
+@app.errorhandler(HashingBusy)
+def error_handler_hashing_busy(error: HashingBusy):
+    log_exception('A password could not be hashed' + 0 * str(error))
+    return {
+        'error': 'busy',
+        'message': 'The server is busy, please try again in a moment.',
+    }, 503, {'Retry-After': '1'}
+
+
 @app.errorhandler(404)
 def error_handler_404(*_, **__):
     if DEVELOPMENT:
@@ -3312,5 +6271,532 @@ def error_handler_404(*_, **__):
             return send_from_directory(relative_path('build'), 'index.html'), 200
 
 
+########################################################################################################################
+# COMMANDS
+########################################################################################################################
+
+
+LEARN_SET_COUNTS_REPAIR = (
+    'UPDATE learn_sets SET exercise_count = counts.exercises, answer_count = counts.answers FROM (SELECT learn_sets.id '
+    'AS id, COUNT(learn_exercises.id) AS exercises, COALESCE(SUM(CASE WHEN answers = \'\' THEN 0 ELSE '
+    '(length(answers) - length(replace(answers, \', \', \'\'))) / 2 + 1 END), 0) AS answers FROM learn_sets LEFT JOIN '
+    'learn_exercises ON learn_exercises.set_id = learn_sets.id GROUP BY learn_sets.id) AS counts WHERE counts.id = '
+    'learn_sets.id AND (exercise_count != counts.exercises OR answer_count != counts.answers) RETURNING learn_sets.id'
+)
+QUERY_PLAN_ALLOWED_SCANS = [
+    # listings which intentionally return every row
+    'SELECT documents.*, COALESCE(users.name, \'\') FROM documents LEFT JOIN users ON users.id = documents.owner',
+    'SELECT learn_sets.*, COALESCE(users.name, \'\') FROM learn_sets LEFT JOIN users ON users.id = learn_sets.owner',
+    # admin and repair commands which intentionally visit every row
+    LEARN_SET_COUNTS_REPAIR,
+    HASH_ITERATIONS_BACKFILL,
+    'SELECT status, COUNT(*), MIN(next_attempt) FROM mail_queue GROUP BY status',
+    'SELECT id, access FROM calendars',
+    'SELECT id, extension FROM documents WHERE blob = \'\'',
+    # periodic housekeeping of the shared cache
+    'DELETE FROM entries WHERE expires < ?',
+    'SELECT COUNT(*) FROM entries',
+    'DELETE FROM entries WHERE (namespace, key) IN (SELECT namespace, key FROM entries ORDER BY accessed LIMIT ?)',
+]
+
+
+def collect_statements() -> list[str]:
+    """
+    Collects every SQL statement written as a string literal in this file
+    :return: list of statements
+    """
+    with open(__file__, 'r') as file:
+        tree = ast.parse(file.read())
+    statements = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            statement = node.value.strip()
+            if ' ' in statement and statement.upper().startswith(('SELECT ', 'INSERT ', 'UPDATE ', 'DELETE ')):
+                statements.add(node.value)
+    return sorted(statements)
+
+
+@app.cli.command('check-query-plans')
+def c_check_query_plans():
+    """
+    Fails if a statement used in app.py scans a whole table instead of using an index.
+    """
+    conn = sqlite_connect(':memory:')
+    migrate_db(conn)
+    with open(relative_path('resources/shared_cache.sql'), 'r') as file:
+        conn.executescript(file.read())
+    failures = 0
+    for statement in collect_statements():
+        numbered = [int(number) for number in re_findall(r'\?(\d+)', statement)]
+        parameters = max(numbered) if numbered else statement.count('?')
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {statement}", [None] * parameters).fetchall()
+        scans = [i[3] for i in plan if i[3].startswith('SCAN ') and 'VIRTUAL TABLE' not in i[3]]
+        if scans and statement not in QUERY_PLAN_ALLOWED_SCANS:
+            failures += 1
+            click.echo(f"{statement}\n    {'; '.join(scans)}", err=True)
+    conn.close()
+    if failures:
+        raise click.ClickException(f"{failures} statement(s) scan a table")
+    click.echo('All query plans use indexes.')
+
+
+@app.cli.command('ban-ip')
+@click.argument('ip')
+@click.option('--score', default=0, help='The new score, 0 bans the IP.')
+def c_ban_ip(ip: str, score: int):
+    """
+    Sets the score of an IP. All workers apply it within IP_SCORE_TTL seconds.
+    """
+    IP_SCORES.set(ip, score)
+    while IP_SCORES.flush():
+        pass
+    click.echo(f"The score of {ip} is now {score}.")
+
+
+@app.cli.command('purge-expired')
+def c_purge_expired():
+    """
+    Deletes expired logins, e-mail confirmations, leftover QR bill files and files no document has used for
+    BLOB_GRACE_PERIOD. Logins are kept for LOGIN_LIFETIME after they expired, as a signed session of a revoked Login
+    may still claim to be valid until then.
+    """
+    now = to_epoch(datetime.now())
+    with transaction():
+        logins = query_db('DELETE FROM login WHERE valid < ? RETURNING id',
+                          (now - int(LOGIN_LIFETIME.total_seconds()),))
+        mail_checks = query_db('DELETE FROM mail_check WHERE valid < ? RETURNING id', (now,))
+    for login in logins:
+        Login.uncache(login[0])
+    # QR bills used to be written to temporary files which were never deleted
+    rmtree(relative_path('temp/qrbills'), ignore_errors=True)
+    blobs = BLOBS.collect()
+    click.echo(f"Deleted {len(logins)} login(s), {len(mail_checks)} e-mail confirmation(s) and {blobs} unused "
+               f"file(s).")
+
+
+@app.cli.command('migrate-documents')
+def c_migrate_documents():
+    """
+    Moves the files of documents uploaded before the blob store into it, storing identical files once.
+    """
+    migrated = 0
+    for id_, extension in query_db('SELECT id, extension FROM documents WHERE blob = \'\''):
+        path = join(app.root_path, 'files', f"{id_}.{extension}")
+        if not exists(path):
+            click.echo(f"The file of document {id_} is missing.", err=True)
+            continue
+        with open(path, 'rb') as file:
+            with BLOBS.store(file) as blob:
+                query_db('UPDATE documents SET blob = ?, size = ? WHERE id = ?', (blob, getsize(path), id_))
+        remove(path)
+        migrated += 1
+    click.echo(f"Moved the files of {migrated} document(s) into the blob store.")
+
+
+@app.cli.command('repair-learnset-counts')
+def c_repair_learnset_counts():
+    """
+    Recomputes the exercise and answer counts of all LearnSets, e.g. after exercises were changed by hand.
+    """
+    with transaction():
+        changed = query_db(LEARN_SET_COUNTS_REPAIR)
+    click.echo(f"Repaired the counts of {len(changed)} LearnSet(s).")
+
+
+@app.cli.command('import-payments')
+@click.argument('files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def c_import_payments(files: tuple[str, ...]):
+    """
+    Extends the subscriptions paid in ISO 20022 camt.053 or camt.054 bank statements.
+    """
+    for file in files:
+        with open(file, 'rb') as statement:
+            try:
+                counts = import_payments(statement)
+            except (ParseError, ValueError) as error:
+                raise click.ClickException(f"{file} is not a readable camt.053 or camt.054 statement: {error}")
+        click.echo(f"{file}: " + ', '.join(f"{count} {name}" for name, count in counts.items()))
+
+
+@app.cli.command('mail-queue')
+@click.option('--retry-failed', is_flag=True, help='Queue the failed e-mails again.')
+@click.option('--send', is_flag=True, help='Send the due e-mails now if no worker is sending.')
+def c_mail_queue(retry_failed: bool, send: bool):
+    """
+    Shows the outbound e-mail queue.
+    """
+    if retry_failed:
+        requeued = query_db('UPDATE mail_queue SET status = \'queued\', attempts = 0, next_attempt = ? '
+                            'WHERE status = \'failed\' RETURNING id', (to_epoch(datetime.now()),))
+        click.echo(f"Queued {len(requeued)} failed e-mail(s) again.")
+    if send:
+        if not MAIL_SENDER.lead():
+            raise click.ClickException('A worker is sending the queue.')
+        while sent := MAIL_SENDER.send_due():
+            click.echo(f"Attempted {sent} e-mail(s).")
+        click.echo(str(MAIL_SENDER.stats()))
+    for status, count, next_attempt in query_db('SELECT status, COUNT(*), MIN(next_attempt) FROM mail_queue '
+                                                'GROUP BY status'):
+        click.echo(f"{status}: {count}, next attempt {from_epoch(next_attempt).strftime(DATE_FORMAT)}")
+
+
+class StandInSMTPHandler(StreamRequestHandler):
+    """
+    Speaks just enough plain SMTP for check-mail-sender. Recipients starting with `refuse` are rejected for good,
+    recipients starting with `defer` for now.
+    """
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        self.reply('220 stand-in')
+        while line := self.rfile.readline().decode():
+            command = line[:4].upper()
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 stand-in')
+            elif command == 'RCPT' and 'refuse' in line:
+                self.reply('550 no such user')
+            elif command == 'RCPT' and 'defer' in line:
+                self.reply('451 try again later')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.delivered += 1
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+@app.cli.command('check-mail-sender')
+def c_check_mail_sender():
+    """
+    Runs the mail queue against a local stand-in SMTP server: while the server is unreachable the batch stops after
+    one connection attempt and no message loses an attempt, afterwards the queue is sent over one connection and
+    refused or deferred messages fail or are retried. Everything happens in one transaction which is rolled back.
+    """
+    if not MAIL_SENDER.lead():
+        raise click.ClickException('A worker is sending the queue, stop the workers first.')
+    server = ThreadingTCPServer(('127.0.0.1', 0), StandInSMTPHandler, bind_and_activate=False)
+    server.allow_reuse_address = True
+    server.server_bind()
+    server.delivered = 0
+    port = server.server_address[1]
+
+    class StandInSender(MailSender):
+        def _connect(self) -> SMTP:
+            smtp = SMTP('127.0.0.1', port, timeout=SMTP_TIMEOUT)
+            self._count('connections')
+            return smtp
+
+    sender = StandInSender(MAIL_LOCK_PATH, 1, 3, 1)
+    failures = []
+
+    def check(name: str, passed: bool) -> None:
+        click.echo(f"{'ok' if passed else 'FAILED'}: {name}")
+        if not passed:
+            failures.append(name)
+
+    with transaction() as conn:
+        now = to_epoch(datetime.now())
+        # the messages really queued are moved out of the way and put back by the rollback
+        query_db('UPDATE mail_queue SET next_attempt = next_attempt + ? WHERE status = \'queued\'', (1 << 40,))
+        for address in [f"user-{i}@example.invalid" for i in range(5)] + ['refuse@example.invalid',
+                                                                         'defer@example.invalid']:
+            query_db('INSERT INTO mail_queue (address, subject, message_plain, message, created, status, attempts, '
+                     'next_attempt, error) VALUES (?, \'check\', \'check\', \'check\', ?, \'queued\', 0, ?, \'\')',
+                     (address, now, now))
+        check('an unreachable server stops the batch', sender.send_due() == 0)
+        check('one connection attempt for the whole batch', sender.stats()['unavailable'] == 1)
+        check('no message lost an attempt', query_db('SELECT COUNT(*) FROM mail_queue WHERE status = \'queued\' AND '
+                                                     'next_attempt <= ? AND attempts = 0', (now,), True)[0] == 7)
+        check('the queue backs off', sender.send_due() == 0 and sender.stats()['unavailable'] == 1)
+        server.server_activate()
+        Thread(target=server.serve_forever, name='stand-in smtp', daemon=True).start()
+        sender._paused_until = 0.0
+        check('every message is attempted', sender.send_due() == 7)
+        sender._disconnect()
+        stats = sender.stats()
+        check('one connection for all messages', stats['connections'] == 1)
+        check('the messages are delivered', stats['sent'] == 5 and server.delivered == 5)
+        check('refused and deferred messages', stats['failed'] == 1 and stats['retried'] == 1)
+        conn.rollback()
+    server.shutdown()
+    server.server_close()
+    if failures:
+        raise click.ClickException(f"{len(failures)} check(s) failed.")
+
+
+class StandInFaviconHandler(BaseHTTPRequestHandler):
+    """
+    Answers like FAVICON_API for check-favicons, slowly, and counts the requests per hostname. Hostnames starting with
+    `missing` have no icon.
+    """
+
+    def do_GET(self) -> None:  # noqa
+        hostname = urlparse(self.path).path.strip('/')
+        with self.server.lock:
+            self.server.requests[hostname] = self.server.requests.get(hostname, 0) + 1
+        sleep(0.3)
+        if hostname.startswith('missing'):
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', '4')
+        self.end_headers()
+        self.wfile.write(b'\x89PNG')
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@app.cli.command('check-favicons')
+def c_check_favicons():
+    """
+    Runs the favicon fetcher against a local stand-in of FAVICON_API: parallel requests for one hostname download it
+    once, a missing icon is remembered, and a request which cannot get the lock of a hostname gives up after the
+    timeout. The icons are stored in a temporary directory.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInFaviconHandler)
+    server.lock = Lock()
+    server.requests = {}
+    Thread(target=server.serve_forever, name='stand-in favicons', daemon=True).start()
+    environ['FAVICON_API'] = f"http://127.0.0.1:{server.server_address[1]}/"
+    failures = []
+
+    def check(name: str, passed: bool) -> None:
+        click.echo(f"{'ok' if passed else 'FAILED'}: {name}")
+        if not passed:
+            failures.append(name)
+
+    suffix = rand_base16(8)
+    with TemporaryDirectory() as path:
+        fetcher = FaviconFetcher(FaviconIndex(path), join(path, '.locks'), 1, 60)
+        hostname = f"icon-{suffix}.example.invalid"
+        with ThreadPoolExecutor(8) as executor:
+            files = list(executor.map(fetcher.get, [hostname] * 8))
+        check('parallel requests download an icon once', server.requests.get(hostname) == 1)
+        check('every request gets the icon', files == [f"{hostname}.png"] * 8)
+        missing = f"missing-{suffix}.example.invalid"
+        files = [fetcher.get(missing) for _ in range(3)]
+        check('a missing icon is asked for once', server.requests.get(missing) == 1 and fetcher.stats()['failed'] == 1)
+        check('a missing icon is shown as empty', files == [FAVICON_EMPTY] * 3)
+        SHARED_CACHE.delete('favicon-miss', missing)
+        locked = f"locked-{suffix}.example.invalid"
+        stripe = int.from_bytes(blake2b(locked.encode(), digest_size=4).digest(), 'big') % FAVICON_LOCK_STRIPES
+        with open(join(path, '.locks', f"host-{stripe}"), 'a') as file:
+            flock(file, LOCK_EX)
+            start = perf_counter()
+            # the lock belongs to the open file, so another open file of this process has to wait for it as well
+            file_ = fetcher.get(locked)
+            waited = perf_counter() - start
+        check('a held lock is given up after the timeout', file_ == FAVICON_EMPTY and 1 <= waited < 2)
+        check('nothing is downloaded without the lock', locked not in server.requests)
+    server.shutdown()
+    server.server_close()
+    if failures:
+        raise click.ClickException(f"{len(failures)} check(s) failed.")
+
+
+NEWSLETTER_BATCH_SIZE = 100
+
+
+@app.cli.command('send-newsletter')
+@click.argument('name')
+@click.option('--subject', required=True, help='The subject line.')
+@click.option('--html', 'html_path', required=True, type=click.Path(exists=True, dir_okay=False),
+              help='The html message.')
+@click.option('--plain', 'plain_path', required=True, type=click.Path(exists=True, dir_okay=False),
+              help='The plain text message.')
+@click.option('--connections', default=2, help='Number of SMTP connections used in parallel.')
+@click.option('--rate', default=5.0, help='The maximum number of e-mails per second.')
+def c_send_newsletter(name: str, subject: str, html_path: str, plain_path: str, connections: int, rate: float):
+    """
+    Sends a newsletter to every user who subscribed to newsletters. `$name` in the messages is replaced by the name of
+    the recipient. The progress is recorded under NAME after every batch of users, so running the command again with
+    the same NAME resumes after the last completed batch; a crash can repeat at most one batch. E-mails which cannot
+    be sent are handed to the mail queue.
+    """
+    with open(html_path, 'r') as file:
+        html = Template(file.read())
+    with open(plain_path, 'r') as file:
+        plain = Template(file.read())
+    now = to_epoch(datetime.now())
+    query_db('INSERT INTO newsletters VALUES (?, ?, \'\', 0, 0, ?, 0) ON CONFLICT (name) DO NOTHING',
+             (name, subject, now))
+    last_user, sent, failed, finished = query_db(
+        'SELECT last_user, sent, failed, finished FROM newsletters WHERE name=?', (name,), True)
+    if finished:
+        raise click.ClickException(f"The newsletter {name} has already been sent.")
+    if last_user:
+        click.echo(f"Resuming {name} after {sent} e-mail(s).")
+    state = SimpleNamespace(lock=Lock(), next_send=perf_counter(), connections=[])
+    threads = thread_local()
+
+    def deliver(recipient: tuple[str, str, str]) -> t.Optional[tuple[str, str, str, Exception]]:
+        _, user_name, address = recipient
+        mail = build_mail(address, subject, plain.safe_substitute(name=user_name),
+                          html.safe_substitute(name=html_escape(user_name)))
+        with state.lock:
+            wait = state.next_send - perf_counter()
+            state.next_send = max(state.next_send, perf_counter()) + 1 / rate
+        if wait > 0:
+            sleep(wait)
+        try:
+            for attempt in range(2):
+                if getattr(threads, 'smtp', None) is None:
+                    threads.smtp = smtp_connect()
+                    with state.lock:
+                        state.connections.append(threads.smtp)
+                try:
+                    threads.smtp.sendmail(environ['SMTP_ADDRESS'], address, mail)
+                    return None
+                except SMTPServerDisconnected:
+                    threads.smtp = None
+                    if attempt:
+                        raise
+        except (SMTPException, OSError) as error:
+            log_exception('An error occurred while sending the newsletter' + 0 * str(error))
+            if not isinstance(error, (SMTPRecipientsRefused, SMTPDataError)):
+                threads.smtp = None
+            return recipient + (error,)
+
+    start = perf_counter()
+    sent_now = 0
+    with ThreadPoolExecutor(connections) as executor:
+        while True:
+            recipients = query_db('SELECT id, name, mail FROM users WHERE newsletter = 1 AND id > ? ORDER BY id '
+                                  'LIMIT ?', (last_user, NEWSLETTER_BATCH_SIZE))
+            if not recipients:
+                break
+            failures = [i for i in executor.map(deliver, recipients) if i is not None]
+            last_user = recipients[-1][0]
+            with transaction():
+                for _, user_name, address, _ in failures:
+                    send_mail(address, subject, plain.safe_substitute(name=user_name),
+                              html.safe_substitute(name=html_escape(user_name)))
+                query_db('UPDATE newsletters SET last_user=?, sent=sent+?, failed=failed+? WHERE name=?',
+                         (last_user, len(recipients) - len(failures), len(failures), name))
+            sent += len(recipients) - len(failures)
+            failed += len(failures)
+            sent_now += len(recipients)
+            click.echo(f"{sent} sent, {failed} queued for retry, {sent_now / (perf_counter() - start):.1f} e-mails/s")
+    query_db('UPDATE newsletters SET finished=? WHERE name=?', (to_epoch(datetime.now()), name))
+    for smtp in state.connections:
+        try:
+            smtp.quit()
+        except (SMTPException, OSError):
+            smtp.close()
+    click.echo(f"The newsletter {name} has been sent to {sent} user(s), {failed} e-mail(s) are in the mail queue.")
+
+
+@app.cli.command('calibrate-hashing')
+@click.option('--target-ms', default=250, help='The time one password hash should take.')
+def c_calibrate_hashing(target_ms: int):
+    """
+    Measures PBKDF2 on this host and recommends HASH_ITERATIONS for a target latency. Every user keeps the iteration
+    count they were hashed with and is rehashed with the new count when they sign in next.
+    """
+    iterations = 10000
+    while True:
+        best = float('inf')
+        for _ in range(3):
+            start = perf_counter()
+            pbkdf2_hmac('sha3_512', b'password', b'salt', iterations)
+            best = min(best, perf_counter() - start)
+        if best >= 0.05:
+            break
+        iterations *= 2
+    per_iteration = best / iterations
+    recommended = max(1000, round(target_ms / 1000 / per_iteration / 1000) * 1000)
+    current = int(environ.get('HASH_ITERATIONS') or 0)
+    click.echo(f"{iterations} iterations take {best * 1000:.1f} ms on this host.")
+    if current:
+        click.echo(f"HASH_ITERATIONS={current} takes {current * per_iteration * 1000:.0f} ms.")
+    click.echo(f"Recommended for {target_ms} ms: HASH_ITERATIONS={recommended}")
+
+
+@app.cli.command('loadtest-signin')
+@click.argument('url')
+@click.option('--email', required=True, help='E-mail address of an existing account.')
+@click.option('--password', required=True, help='Password of that account.')
+@click.option('--requests', 'count', default=200, help='Number of sign-in requests.')
+@click.option('--concurrency', default=16, help='Number of requests in flight at once.')
+def c_loadtest_signin(url: str, email: str, password: str, count: int, concurrency: int):
+    """
+    Sends sign-in requests to a running instance, every other one for an unknown e-mail address, and reports the
+    throughput and latencies of both kinds. Compare two versions by running it against each; raise RATE_LIMIT_SIGNIN on
+    the instance under test first.
+    """
+    target = f"{url.rstrip('/')}/api/v1/account/signin"
+
+    def attempt(i: int) -> tuple[bool, int, float]:
+        known = i % 2 == 0
+        start = perf_counter()
+        response = requests_send('POST', target, timeout=60, json={
+            'email': email if known else f"unknown-{i}-{rand_base16(8)}@example.invalid",
+            'password': password,
+        })
+        return known, response.status_code, perf_counter() - start
+
+    start = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(attempt, range(count)))
+    elapsed = perf_counter() - start
+    click.echo(f"{count} sign-ins in {elapsed:.2f} s: {count / elapsed:.1f} requests/s")
+    for known in (True, False):
+        latencies = sorted(duration for kind, _, duration in results if kind == known)
+        statuses = {}
+        for kind, status, _ in results:
+            if kind == known:
+                statuses[status] = statuses.get(status, 0) + 1
+        click.echo(f"{'known' if known else 'unknown'} e-mail: median {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+                   f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f} ms, status codes {statuses}")
+
+
+@app.cli.command('bench-models')
+@click.option('--rows', default=100000, help='Number of exercises to build.')
+def c_bench_models(rows: int):
+    """
+    Compares the cost of building LearnExercises from rows: as plain objects with an instance dict, through the
+    constructor and its setters like load() did before, and with _from_row.
+    """
+    data = [(f"{i:08d}", 'learnset', f"question {i}", 'answer', 'a, b, c', 1.0, 1) for i in range(rows)]
+    variants = {
+        'instance dict': lambda row: SimpleNamespace(_id=row[0], _set_id=row[1], _question=row[2], _answer=row[3],
+                                                     _answers=row[4], _frequency=row[5], _auto_check=row[6]),
+        'constructor': lambda row: LearnExercise(row[0], row[1], row[2], row[3], row[4].split(', '), row[5], row[6]),
+        '_from_row': LearnExercise._from_row,
+    }
+    for name, build in variants.items():
+        start = perf_counter()
+        objects = [build(row) for row in data]
+        elapsed = perf_counter() - start
+        del objects
+        tracemalloc.start()
+        objects = [build(row) for row in data]
+        statistics = tracemalloc.take_snapshot().statistics('filename')
+        tracemalloc.stop()
+        del objects
+        blocks = sum(i.count for i in statistics)
+        size = sum(i.size for i in statistics)
+        click.echo(f"{name:<14} {elapsed / rows * 1e6:6.2f} us/row {blocks / rows:6.2f} allocations/row "
+                   f"{size / rows:7.1f} bytes/row")
+    dates = [1704067200 + 60 * (i % 1000) for i in range(rows)]
+    texts = [from_epoch(i).strftime(DATE_FORMAT) for i in dates]
+    for name, decode, values in (('strptime', lambda value: datetime.strptime(value, DATE_FORMAT), texts),
+                                 ('from_epoch', from_epoch, dates)):
+        start = perf_counter()
+        for value in values:
+            decode(value)
+        click.echo(f"{name:<14} {(perf_counter() - start) / rows * 1e6:6.2f} us/date")
+
+
 if __name__ == '__main__':
     app.run('0.0.0.0', port=5000, debug=False)
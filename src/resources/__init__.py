@@ -93,6 +93,37 @@ PRODUCTS = {
     'premiumYear': 'ksalp.ch Premium 1 Jahr',
     'premiumLiteYear': 'ksalp.ch Premium Lite 1 Jahr',
 }
+PRODUCT_PAYMENTS = {  # the User attribute which holds the end of the subscription
+    'premiumYear': 'payment',
+    'premiumLiteYear': 'payment_lite',
+}
+RATE_LIMIT_GROUPS = [  # the first matching path prefix decides the group, all other paths belong to `default`
+    ('/api/v1/account/signin', 'signin'),
+    ('/api/v1/account/register', 'register'),
+    ('/api/v1/account/settings/password', 'password'),
+    ('/api/v1/documents/new/', 'upload'),
+    ('/api/v1/documents/edit/', 'upload'),
+    ('/api/v1/learnsets/new/', 'upload'),
+    ('/api/v1/learnsets/edit/', 'upload'),
+    ('/api/v1/documents/list', 'listing'),
+    ('/api/v1/learnsets/list', 'listing'),
+    ('/api/v1/learnsets/bulk/', 'listing'),
+    ('/api/v1/calendars/list', 'listing'),
+    ('/api/v1/favicon/', 'favicon'),
+    ('/dateien/', 'files'),
+    ('/api/', 'api'),
+]
+RATE_LIMITS = {  # burst, requests per minute; a whole school may share one IP
+    'signin': (300, 120),
+    'register': (60, 20),
+    'password': (60, 20),
+    'upload': (20, 30),
+    'listing': (60, 300),
+    'favicon': (120, 600),
+    'files': (120, 600),
+    'api': (300, 3000),
+    'default': (600, 6000),
+}
 SEARCH_ENGINES = {
     'DuckDuckGo': {
         'url': 'https://duckduckgo.com/?q=%s',
@@ -0,0 +1,7 @@
+CREATE INDEX IF NOT EXISTS users_mail ON users (mail);
+CREATE INDEX IF NOT EXISTS mail_check_code ON mail_check (code);
+CREATE INDEX IF NOT EXISTS learn_exercises_set_id ON learn_exercises (set_id, question);
+CREATE INDEX IF NOT EXISTS learn_stats_exercise_id ON learn_stats (exercise_id, owner);
+CREATE INDEX IF NOT EXISTS calendar_events_calendar ON calendar_events (calendar);
+CREATE INDEX IF NOT EXISTS calendar_selections_owner ON calendar_selections (owner);
+CREATE INDEX IF NOT EXISTS login_account ON login (account);
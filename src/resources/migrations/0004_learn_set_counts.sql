@@ -0,0 +1,36 @@
+ALTER TABLE learn_sets ADD COLUMN exercise_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE learn_sets ADD COLUMN answer_count INTEGER NOT NULL DEFAULT 0;
+UPDATE learn_sets SET
+    exercise_count = (SELECT COUNT(*) FROM learn_exercises WHERE learn_exercises.set_id = learn_sets.id),
+    answer_count = (SELECT COALESCE(SUM(CASE WHEN answers = '' THEN 0 ELSE
+        (length(answers) - length(replace(answers, ', ', ''))) / 2 + 1 END), 0)
+        FROM learn_exercises WHERE learn_exercises.set_id = learn_sets.id);
+CREATE TRIGGER IF NOT EXISTS learn_exercises_count_insert AFTER INSERT ON learn_exercises
+BEGIN
+    UPDATE learn_sets SET
+        exercise_count = exercise_count + 1,
+        answer_count = answer_count + CASE WHEN new.answers = '' THEN 0 ELSE
+            (length(new.answers) - length(replace(new.answers, ', ', ''))) / 2 + 1 END
+    WHERE id = new.set_id;
+END;
+CREATE TRIGGER IF NOT EXISTS learn_exercises_count_delete AFTER DELETE ON learn_exercises
+BEGIN
+    UPDATE learn_sets SET
+        exercise_count = exercise_count - 1,
+        answer_count = answer_count - CASE WHEN old.answers = '' THEN 0 ELSE
+            (length(old.answers) - length(replace(old.answers, ', ', ''))) / 2 + 1 END
+    WHERE id = old.set_id;
+END;
+CREATE TRIGGER IF NOT EXISTS learn_exercises_count_update AFTER UPDATE OF set_id, answers ON learn_exercises
+BEGIN
+    UPDATE learn_sets SET
+        exercise_count = exercise_count - 1,
+        answer_count = answer_count - CASE WHEN old.answers = '' THEN 0 ELSE
+            (length(old.answers) - length(replace(old.answers, ', ', ''))) / 2 + 1 END
+    WHERE id = old.set_id;
+    UPDATE learn_sets SET
+        exercise_count = exercise_count + 1,
+        answer_count = answer_count + CASE WHEN new.answers = '' THEN 0 ELSE
+            (length(new.answers) - length(replace(new.answers, ', ', ''))) / 2 + 1 END
+    WHERE id = new.set_id;
+END;
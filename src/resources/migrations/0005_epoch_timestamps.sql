@@ -0,0 +1,207 @@
+-- timestamps become seconds since 1970; the stored texts are local time, like datetime.now()
+DROP TRIGGER IF EXISTS learn_exercises_count_insert;
+DROP TRIGGER IF EXISTS learn_exercises_count_delete;
+DROP TRIGGER IF EXISTS learn_exercises_count_update;
+CREATE TABLE users_new (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    mail TEXT NOT NULL,
+    salt TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    newsletter INTEGER NOT NULL,
+    created INTEGER NOT NULL,
+    theme TEXT NOT NULL,
+    iframe INTEGER NOT NULL,
+    payment INTEGER NOT NULL,
+    payment_lite INTEGER NOT NULL,
+    banned TEXT NOT NULL,
+    search TEXT NOT NULL,
+    class TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    favorites TEXT NOT NULL
+);
+INSERT INTO users_new SELECT
+    id,
+    name,
+    mail,
+    salt,
+    hash,
+    newsletter,
+    COALESCE(CAST(strftime('%s', substr(created, 1, 10) || ' ' || replace(substr(created, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    theme,
+    iframe,
+    COALESCE(CAST(strftime('%s', payment, 'utc') AS INTEGER), 0),
+    COALESCE(CAST(strftime('%s', payment_lite, 'utc') AS INTEGER), 0),
+    banned,
+    search,
+    class,
+    grade,
+    favorites
+FROM users;
+DROP TABLE users;
+ALTER TABLE users_new RENAME TO users;
+CREATE TABLE comments_new (
+    id TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    author TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    posted INTEGER NOT NULL
+);
+INSERT INTO comments_new SELECT
+    id,
+    content,
+    author,
+    subject,
+    COALESCE(CAST(strftime('%s', substr(posted, 1, 10) || ' ' || replace(substr(posted, 12), '-', ':'), 'utc') AS INTEGER), 0)
+FROM comments;
+DROP TABLE comments;
+ALTER TABLE comments_new RENAME TO comments;
+CREATE TABLE calendar_events_new (
+    id TEXT PRIMARY KEY,
+    calendar TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    color TEXT NOT NULL,
+    schulnetz TEXT NOT NULL
+);
+INSERT INTO calendar_events_new SELECT
+    id,
+    calendar,
+    title,
+    description,
+    COALESCE(CAST(strftime('%s', substr(start, 1, 10) || ' ' || replace(substr(start, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    COALESCE(CAST(strftime('%s', substr(end, 1, 10) || ' ' || replace(substr(end, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    color,
+    schulnetz
+FROM calendar_events;
+DROP TABLE calendar_events;
+ALTER TABLE calendar_events_new RENAME TO calendar_events;
+CREATE TABLE documents_new (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    description TEXT NOT NULL,
+    class TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    language TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    edited INTEGER NOT NULL,
+    created INTEGER NOT NULL,
+    extension TEXT NOT NULL,
+    mimetype TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+INSERT INTO documents_new SELECT
+    id,
+    title,
+    subject,
+    description,
+    class,
+    grade,
+    language,
+    owner,
+    COALESCE(CAST(strftime('%s', substr(edited, 1, 10) || ' ' || replace(substr(edited, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    COALESCE(CAST(strftime('%s', substr(created, 1, 10) || ' ' || replace(substr(created, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    extension,
+    mimetype,
+    size
+FROM documents;
+DROP TABLE documents;
+ALTER TABLE documents_new RENAME TO documents;
+CREATE TABLE learn_sets_new (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    description TEXT NOT NULL,
+    class TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    language TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    edited INTEGER NOT NULL,
+    created INTEGER NOT NULL,
+    exercise_count INTEGER NOT NULL DEFAULT 0,
+    answer_count INTEGER NOT NULL DEFAULT 0
+);
+INSERT INTO learn_sets_new SELECT
+    id,
+    title,
+    subject,
+    description,
+    class,
+    grade,
+    language,
+    owner,
+    COALESCE(CAST(strftime('%s', substr(edited, 1, 10) || ' ' || replace(substr(edited, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    COALESCE(CAST(strftime('%s', substr(created, 1, 10) || ' ' || replace(substr(created, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    exercise_count,
+    answer_count
+FROM learn_sets;
+DROP TABLE learn_sets;
+ALTER TABLE learn_sets_new RENAME TO learn_sets;
+CREATE TABLE login_new (
+    id TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    valid INTEGER NOT NULL,
+    browser TEXT NOT NULL
+);
+INSERT INTO login_new SELECT
+    id,
+    account,
+    COALESCE(CAST(strftime('%s', substr(valid, 1, 10) || ' ' || replace(substr(valid, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    browser
+FROM login;
+DROP TABLE login;
+ALTER TABLE login_new RENAME TO login;
+CREATE TABLE mail_check_new (
+    id TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    valid INTEGER NOT NULL,
+    code TEXT NOT NULL
+);
+INSERT INTO mail_check_new SELECT
+    id,
+    account,
+    COALESCE(CAST(strftime('%s', substr(valid, 1, 10) || ' ' || replace(substr(valid, 12), '-', ':'), 'utc') AS INTEGER), 0),
+    code
+FROM mail_check;
+DROP TABLE mail_check;
+ALTER TABLE mail_check_new RENAME TO mail_check;
+CREATE INDEX IF NOT EXISTS users_mail ON users (mail);
+CREATE INDEX IF NOT EXISTS mail_check_code ON mail_check (code);
+CREATE INDEX IF NOT EXISTS mail_check_valid ON mail_check (valid);
+CREATE INDEX IF NOT EXISTS calendar_events_calendar ON calendar_events (calendar, start);
+CREATE INDEX IF NOT EXISTS login_account ON login (account);
+CREATE INDEX IF NOT EXISTS login_valid ON login (valid);
+CREATE INDEX IF NOT EXISTS documents_edited ON documents (edited);
+CREATE INDEX IF NOT EXISTS learn_sets_edited ON learn_sets (edited);
+CREATE TRIGGER IF NOT EXISTS learn_exercises_count_insert AFTER INSERT ON learn_exercises
+BEGIN
+    UPDATE learn_sets SET
+        exercise_count = exercise_count + 1,
+        answer_count = answer_count + CASE WHEN new.answers = '' THEN 0 ELSE
+            (length(new.answers) - length(replace(new.answers, ', ', ''))) / 2 + 1 END
+    WHERE id = new.set_id;
+END;
+CREATE TRIGGER IF NOT EXISTS learn_exercises_count_delete AFTER DELETE ON learn_exercises
+BEGIN
+    UPDATE learn_sets SET
+        exercise_count = exercise_count - 1,
+        answer_count = answer_count - CASE WHEN old.answers = '' THEN 0 ELSE
+            (length(old.answers) - length(replace(old.answers, ', ', ''))) / 2 + 1 END
+    WHERE id = old.set_id;
+END;
+CREATE TRIGGER IF NOT EXISTS learn_exercises_count_update AFTER UPDATE OF set_id, answers ON learn_exercises
+BEGIN
+    UPDATE learn_sets SET
+        exercise_count = exercise_count - 1,
+        answer_count = answer_count - CASE WHEN old.answers = '' THEN 0 ELSE
+            (length(old.answers) - length(replace(old.answers, ', ', ''))) / 2 + 1 END
+    WHERE id = old.set_id;
+    UPDATE learn_sets SET
+        exercise_count = exercise_count + 1,
+        answer_count = answer_count + CASE WHEN new.answers = '' THEN 0 ELSE
+            (length(new.answers) - length(replace(new.answers, ', ', ''))) / 2 + 1 END
+    WHERE id = new.set_id;
+END;
@@ -0,0 +1 @@
+ALTER TABLE users ADD COLUMN hash_iterations INTEGER NOT NULL DEFAULT 0;
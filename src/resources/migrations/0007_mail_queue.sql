@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS mail_queue (
+    id INTEGER PRIMARY KEY,
+    address TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    message_plain TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    next_attempt INTEGER NOT NULL,
+    error TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS mail_queue_status ON mail_queue (status, next_attempt);
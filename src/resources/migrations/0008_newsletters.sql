@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS newsletters (
+    name TEXT PRIMARY KEY,
+    subject TEXT NOT NULL,
+    last_user TEXT NOT NULL,
+    sent INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    started INTEGER NOT NULL,
+    finished INTEGER NOT NULL
+);
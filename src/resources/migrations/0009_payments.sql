@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS payment_references (
+    number TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    product TEXT NOT NULL,
+    created INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS payment_references_account ON payment_references (account, product);
+CREATE TABLE IF NOT EXISTS payment_imports (
+    entry TEXT PRIMARY KEY,
+    number TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    booked INTEGER NOT NULL,
+    imported INTEGER NOT NULL,
+    status TEXT NOT NULL
+);
@@ -0,0 +1,22 @@
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL,
+    updated INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_unreferenced ON blobs (updated) WHERE refs = 0;
+ALTER TABLE documents ADD COLUMN blob TEXT NOT NULL DEFAULT '';
+CREATE INDEX IF NOT EXISTS documents_legacy ON documents (id) WHERE blob = '';
+CREATE TRIGGER IF NOT EXISTS documents_blob_insert AFTER INSERT ON documents WHEN new.blob != ''
+BEGIN
+    UPDATE blobs SET refs = refs + 1 WHERE hash = new.blob;
+END;
+CREATE TRIGGER IF NOT EXISTS documents_blob_delete AFTER DELETE ON documents WHEN old.blob != ''
+BEGIN
+    UPDATE blobs SET refs = refs - 1 WHERE hash = old.blob;
+END;
+CREATE TRIGGER IF NOT EXISTS documents_blob_update AFTER UPDATE OF blob ON documents WHEN old.blob != new.blob
+BEGIN
+    UPDATE blobs SET refs = refs - 1 WHERE hash = old.blob;
+    UPDATE blobs SET refs = refs + 1 WHERE hash = new.blob;
+END;
@@ -0,0 +1,24 @@
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS ip_scores (
+    ip TEXT PRIMARY KEY,
+    score INTEGER NOT NULL,
+    dirty INTEGER NOT NULL,
+    loaded REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ip_scores_dirty ON ip_scores (dirty) WHERE dirty = 1;
+CREATE INDEX IF NOT EXISTS ip_scores_loaded ON ip_scores (loaded);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    allowed INTEGER NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rate_limits_updated ON rate_limits (updated);
@@ -6,6 +6,10 @@ environ['SMTP_SERVER'] = ''
 environ['SMTP_PORT'] = ''
 environ['SMTP_ADDRESS'] = ''
 environ['SMTP_PASSWORD'] = ''
+environ['MAIL_LOCK_PATH'] = ''
+environ['MAIL_POLL_INTERVAL'] = ''
+environ['MAIL_MAX_ATTEMPTS'] = ''
+environ['MAIL_RETRY_DELAY'] = ''
 environ['IMPRINT_NAME'] = ''
 environ['IMPRINT_ADDRESS'] = ''
 environ['IMPRINT_CITY'] = ''
@@ -13,7 +17,48 @@ environ['IMPRINT_MAIL'] = ''
 environ['HASH_PEPPER_1'] = ''
 environ['HASH_PEPPER_2'] = ''
 environ['HASH_ITERATIONS'] = ''
+environ['HASH_STATE_PATH'] = ''
+environ['HASH_SLOTS'] = ''
+environ['HASH_QUEUE'] = ''
+environ['HASH_QUEUE_TIMEOUT'] = ''
 environ['KSALP_ADMINS'] = ''
+environ['DB_JOURNAL_MODE'] = ''
+environ['DB_SYNCHRONOUS'] = ''
+environ['DB_MMAP_SIZE'] = ''
+environ['DB_CACHE_SIZE'] = ''
+environ['DB_TEMP_STORE'] = ''
+environ['DB_BUSY_TIMEOUT'] = ''
+environ['SHARED_CACHE_PATH'] = ''
+environ['SHARED_CACHE_TTL'] = ''
+environ['SHARED_CACHE_MAX_ENTRIES'] = ''
+environ['SHARED_CACHE_MMAP_SIZE'] = ''
+environ['ID_STATE_PATH'] = ''
+environ['ID_KEY'] = ''
+environ['IP_SCORE_TTL'] = ''
+environ['IP_SCORE_RELOAD'] = ''
+environ['IP_FLUSH_INTERVAL'] = ''
+environ['ACCESS_LOG_MAX_BYTES'] = ''
+environ['ACCESS_LOG_MAX_AGE'] = ''
+environ['ACCESS_LOG_FLUSH_INTERVAL'] = ''
+environ['ACCESS_LOG_QUEUE_SIZE'] = ''
+environ['HASH_IP_CACHE_SIZE'] = ''
+environ['SESSION_VALIDATION'] = ''
+environ['SESSION_BLOOM_BITS'] = ''
+environ['SESSION_SYNC_INTERVAL'] = ''
+environ['RATE_LIMIT_SIGNIN'] = ''
+environ['RATE_LIMIT_REGISTER'] = ''
+environ['RATE_LIMIT_PASSWORD'] = ''
+environ['RATE_LIMIT_UPLOAD'] = ''
+environ['RATE_LIMIT_LISTING'] = ''
+environ['RATE_LIMIT_FAVICON'] = ''
+environ['RATE_LIMIT_FILES'] = ''
+environ['RATE_LIMIT_API'] = ''
+environ['RATE_LIMIT_DEFAULT'] = ''
 environ['FAVICON_API'] = ''
+environ['FAVICON_LOCK_PATH'] = ''
+environ['FAVICON_TIMEOUT'] = ''
+environ['FAVICON_NEGATIVE_TTL'] = ''
+environ['QRBILL_CACHE_SIZE'] = ''
+environ['DOCUMENT_MAX_SIZE'] = ''
 
 gunicorn.SERVER = 'nginx/gunicorn (ksalp.ch)'
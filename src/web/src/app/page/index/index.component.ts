@@ -10,6 +10,7 @@ import {MatCard, MatCardContent, MatCardImage, MatCardLgImage, MatCardXlImage} f
 import {ConstantService} from "../../service/constant.service";
 import {MatDivider} from "@angular/material/divider";
 import {Title} from "@angular/platform-browser";
+import {HttpClient} from "@angular/common/http";
 
 @Component({
   selector: 'app-index',
@@ -32,18 +33,46 @@ import {Title} from "@angular/platform-browser";
 })
 export class IndexComponent {
   public account: Account | null = null;
+  public favicons: {[key: string]: string} = {};
+  public faviconsLoaded: boolean = false;
+  private faviconsRequested: boolean = false;
 
   constructor(
     public accountService: AccountService,
     public constantService: ConstantService,
+    private httpClient: HttpClient,
     private titleService: Title,
   ) {
     this.titleService.setTitle('Hauptseite - [ksalp.ch]');
     this.accountService.getAccountInfo().subscribe((value: Account | null) => {
       this.account = value;
+      if (!this.faviconsRequested && value !== null && value.isValid()) {
+        this.loadFavicons();
+      }
     })
   }
 
+  loadFavicons(): void {
+    this.faviconsRequested = true;
+    this.httpClient.get<{favicons: {[key: string]: string}}>('/api/v1/favicons').subscribe({
+      next: (value: {favicons: {[key: string]: string}}) => {
+        this.favicons = value.favicons;
+        this.faviconsLoaded = true;
+      },
+      error: () => {
+        this.faviconsLoaded = true;
+      },
+    });
+  }
+
+  favicon(favorite: string): string {
+    let url = favorite.split('|')[0].trim();
+    if (url in this.favicons) {
+      return this.favicons[url];
+    }
+    return '/api/v1/favicon/' + url;
+  }
+
   submitSearch(): void {
     let input = <HTMLInputElement>document.getElementById('search');
     if (this.account !== null && this.account.isValid() && input !== null) {